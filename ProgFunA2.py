@@ -1,5 +1,19 @@
 import sys 
+import os
 import datetime
+import time
+import threading
+import contextlib
+import sqlite3
+import mmap
+import struct
+import bisect
+import heapq
+import gc
+import shutil
+from collections import OrderedDict
+from decimal import Decimal, ROUND_HALF_EVEN
+from array import array
 
 # Define custom exceptions
 class InvalidReward(Exception):
@@ -14,12 +28,22 @@ class InvalidProduct(Exception):
 class Customer: #super class
     # Create a super class to define common attributes 
     # that are shared among different types of customers. 
+    # __slots__ keeps the objects small, there is no __dict__ for each customer
+    __slots__ = ('__ID', '__name', '__reward', '__order_history', 'order_loader',
+                 'order_count', 'lifetime_spend', 'lifetime_rewards', 'last_order_time')
     def __init__(self, ID, name, reward):
         #create a constructor to initialize the attributes of the object.   
         self.__ID = ID
         self.__name = name
         self.__reward = reward
-        self.order_history = []
+        self.__order_history = []
+        # set by Records when the order history is loaded lazily
+        self.order_loader = None
+        # totals of the order history, kept up to date as orders arrive
+        self.order_count = 0
+        self.lifetime_spend = 0
+        self.lifetime_rewards = 0
+        self.last_order_time = None
 
     @property # getter methods return the values of the attributes of this class
     def ID(self):
@@ -32,6 +56,17 @@ class Customer: #super class
     @property
     def reward(self):
         return self.__reward
+
+    @property
+    def order_history(self):
+        # read the order history from the file the first time it is used
+        if self.order_loader is not None:
+            self.order_loader(self)
+        return self.__order_history
+
+    @order_history.setter
+    def order_history(self, order_history):
+        self.__order_history = order_history
     
     @reward.setter 
     # reward value is  a dynamic value that reflects a customer's purchases,
@@ -42,6 +77,13 @@ class Customer: #super class
         # else:
         #     raise InvalidReward("Reward points cannot be negative.")
 
+    # add one order to the totals of the order history
+    def add_order_totals(self, total_cost, earned_rewards, order_time):
+        self.order_count += 1
+        self.lifetime_spend += total_cost
+        self.lifetime_rewards += earned_rewards
+        self.last_order_time = order_time
+
     # 4 empty super method: do nothing, intended to be overridden in subclasses
     def get_reward(self):
         pass
@@ -58,13 +100,14 @@ class Customer: #super class
 class BasicCustomer(Customer): #subclass for customer
     # By default, the flat reward rate is 100%, so create a class variable to share this rate with all object
     __reward_rate = 1.0
+    __slots__ = ()
     def __init__(self, ID, name, reward):
         super().__init__(ID, name, reward)
         #self.order_history = []
     
     def get_reward(self, final_total_cost):
         # Calculate reward based on the total cost and the reward rate
-        return round(final_total_cost * BasicCustomer.get_reward_rate())
+        return pricing.reward(self, final_total_cost)
     
     def update_reward(self, value):
         # Update the reward attribute by adding the given value
@@ -77,6 +120,7 @@ class BasicCustomer(Customer): #subclass for customer
     @classmethod
     def set_reward_rate(cls,value):
         cls.__reward_rate = value
+        pricing.reward_rate_changed(cls)
         return cls.__reward_rate
     
     @classmethod
@@ -85,6 +129,7 @@ class BasicCustomer(Customer): #subclass for customer
     
 class VIPCustomer(Customer): #subclass of customer
     __reward_rate = 1.0
+    __slots__ = ('__discount_rate',)
     def __init__(self, ID, name, reward, discount_rate = 0.08):
         super().__init__(ID, name, reward)
         self.__discount_rate = discount_rate
@@ -100,18 +145,17 @@ class VIPCustomer(Customer): #subclass of customer
         # Ensure that the value cannot be negative and cannot exceed 100% 
         # if 0 <= value <= 1:
         self.__discount_rate = value
+        pricing.discount_rate_changed(self)
         # else:
         #     raise ValueError("Discount rate must be between 0% (0.0) and 100% (1.0).")
     
     def get_discount(self, original_total_cost):
-        discount = original_total_cost * self.__discount_rate
-        return round(discount)
+        return pricing.round_points(pricing.discount(self, original_total_cost))
     
     def get_reward(self, original_total_cost):
-        discount = original_total_cost * self.__discount_rate
-        final_total_cost = original_total_cost - discount
-        reward = final_total_cost * VIPCustomer.get_reward_rate()
-        return round(reward)
+        original_total_cost = pricing.decimal(original_total_cost)
+        final_total_cost = original_total_cost - pricing.discount(self, original_total_cost)
+        return pricing.reward(self, final_total_cost)
     
     def update_reward(self, value):
         self._Customer__reward += value
@@ -123,6 +167,7 @@ class VIPCustomer(Customer): #subclass of customer
     @classmethod
     def set_reward_rate(cls, value):
         cls.__reward_rate = value
+        pricing.reward_rate_changed(cls)
 
     # getter method for the reward rate
     @classmethod
@@ -132,8 +177,11 @@ class VIPCustomer(Customer): #subclass of customer
     # setter method for the discount rate   
     def set_discount_rate(self, value):
         self.__discount_rate = value
-        
+        pricing.discount_rate_changed(self)
+
+
 class Product:
+    __slots__ = ('__product_ID', '__product_name', '__unit_price', '__dr_prescription')
     def __init__(self, product_ID, product_name, unit_price, dr_prescription = False): 
         self.__product_ID = product_ID
         self.__product_name = product_name
@@ -153,7 +201,11 @@ class Product:
     @property
     def unit_price(self):
         return self.__unit_price
-    
+
+    # change the price, the cached prices of this product are dropped
+    def set_unit_price(self, value):
+        self.__unit_price = value
+        pricing.price_changed(self)
     
     def display_info(self):
         #  Prints the values of the Product attributes
@@ -161,6 +213,7 @@ class Product:
         print(f"Product ID: {self.product_ID} Product Name: {self.product_name} Unit Price: {self.unit_price} Need_Prescription:{prescription_status}")
 
 class Bundle(Product): #subclass of Product, have a list of components
+    __slots__ = ('__component', '__unit_price', '__dr_prescription')
     def __init__(self, product_ID, product_name, component, unit_price = 0, dr_prescription = False):
         super().__init__(product_ID,product_name,dr_prescription)
         self.__component = component
@@ -170,6 +223,10 @@ class Bundle(Product): #subclass of Product, have a list of components
     def unit_price(self):
         return self.__unit_price
 
+    def set_unit_price(self, value):
+        self.__unit_price = value
+        pricing.price_changed(self)
+
     @property
     def component(self):
         return self.__component
@@ -184,12 +241,14 @@ class Bundle(Product): #subclass of Product, have a list of components
     
     # calculate the total price of the bundle
     def calculate_price(self, record):
-        total_price = 0
+        total_price = Decimal(0)
         for comp in self.component:
             product = record.products.get(comp)
             if product:
-                total_price += product.unit_price
-        self.__unit_price = round(total_price * 0.8,2)
+                total_price += pricing.unit_price(product)
+        unit_price = float((total_price * BUNDLE_PRICE_RATE).quantize(CENT, ROUND_HALF_EVEN))
+        if unit_price != self.__unit_price:
+            self.set_unit_price(unit_price)
 
     # check if the bundle needs a prescription
     def bundle_prescription(self, record):
@@ -211,6 +270,7 @@ class Bundle(Product): #subclass of Product, have a list of components
     
 
 class Order:
+    __slots__ = ('__customer', '__prodcut', '__quantity')
     def __init__(self, customer, product, quantity):
         self.__customer = customer
         self.__prodcut = product
@@ -227,154 +287,2793 @@ class Order:
         return self.__quantity
     
     def compute_cost(self):
-        discount = 0
-        original_total_cost = self.product.unit_price * self.quantity
-        # Calculate discount if customer is VIPCustomer
-        if isinstance(self.customer, VIPCustomer):
-            discount = original_total_cost * self.customer.discount_rate
-            final_total_cost = original_total_cost - discount
+        price = pricing.price(self.customer, [self.product], [self.quantity])
+        return (float(price['original_total_cost']), float(price['discount']), float(price['final_total_cost']), price['reward'])
+
+# a bundle costs 80% of the price of its components
+BUNDLE_PRICE_RATE = Decimal("0.8")
+CENT = Decimal("0.01")
+NO_DISCOUNT = Decimal(0)
+
+class PricingEngine:
+    # Works out the cost, discount and reward of a purchase in one place, in exact decimal arithmetic.
+    # Converting prices and rates to Decimal is the slow part, so the results are cached:
+    # the unit price of each product, the reward rate of each customer class, the discount rate
+    # of each VIP customer, and the unit discount of each product at each discount rate.
+    # The setters of prices and rates call the *_changed methods, which drop exactly the entries they affect.
+    # The caches are keyed by the objects themselves, so two Records in one process never share a price.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.unit_prices = {}
+        self.reward_rates = {}
+        self.discount_rates = {}
+        # product -> {discount rate: unit discount}
+        self.lines = {}
+
+    # a float price or rate as the decimal it was written as, e.g. 0.1 -> Decimal("0.1")
+    @staticmethod
+    def decimal(value):
+        return value if isinstance(value, Decimal) else Decimal(str(value))
+
+    # points and whole dollars are rounded half to even, like round()
+    @staticmethod
+    def round_points(value):
+        return int(value.to_integral_value(ROUND_HALF_EVEN))
+
+    # the value is read and stored under the lock, so an invalidation can never be overtaken by a stale value
+    def cached(self, cache, key, read):
+        value = cache.get(key)
+        if value is None:
+            with self.lock:
+                value = cache[key] = self.decimal(read())
+        return value
+
+    def unit_price(self, product):
+        return self.cached(self.unit_prices, product, lambda: product.unit_price)
+
+    def reward_rate(self, customer):
+        rate = self.reward_rates.get(type(customer))
+        if rate is None:
+            rate = self.cached(self.reward_rates, type(customer), customer.get_reward_rate)
+        return rate
+
+    def discount_rate(self, customer):
+        rate = self.discount_rates.get(customer)
+        if rate is None:
+            if not isinstance(customer, VIPCustomer):
+                return NO_DISCOUNT
+            rate = self.cached(self.discount_rates, customer, lambda: customer.discount_rate)
+        return rate
+
+    # (unit price, unit discount) of a product at a discount rate
+    def line(self, product, discount_rate):
+        unit_price = self.unit_prices.get(product)
+        if unit_price is None:
+            unit_price = self.unit_price(product)
+        tiers = self.lines.get(product)
+        unit_discount = tiers.get(discount_rate) if tiers is not None else None
+        if unit_discount is None:
+            unit_discount = unit_price * discount_rate
+            with self.lock:
+                # dropped if the price changed since it was read
+                if self.unit_prices.get(product) == unit_price:
+                    self.lines.setdefault(product, {})[discount_rate] = unit_discount
+        return unit_price, unit_discount
+
+    def discount(self, customer, original_total_cost):
+        return self.decimal(original_total_cost) * self.discount_rate(customer)
+
+    def reward(self, customer, final_total_cost):
+        return self.round_points(self.decimal(final_total_cost) * self.reward_rate(customer))
+
+    # the totals of a basket, before any reward points are redeemed
+    def price(self, customer, products, quantities):
+        discount_rate = self.discount_rate(customer)
+        original_total_cost = discount = NO_DISCOUNT
+        unit_prices = self.unit_prices
+        lines = self.lines
+        for product, quantity in zip(products, quantities):
+            # both entries are dropped together, so a hit on both is one consistent price
+            unit_price = unit_prices.get(product)
+            tiers = lines.get(product)
+            unit_discount = tiers.get(discount_rate) if tiers is not None else None
+            if unit_price is None or unit_discount is None:
+                unit_price, unit_discount = self.line(product, discount_rate)
+            original_total_cost += unit_price * quantity
+            discount += unit_discount * quantity
+        final_total_cost = original_total_cost - discount
+        return {
+            'original_total_cost': original_total_cost,
+            'discount': discount,
+            'final_total_cost': final_total_cost,
+            'reward': self.round_points(final_total_cost * self.reward_rate(customer)),
+        }
+
+    def price_changed(self, product):
+        with self.lock:
+            self.unit_prices.pop(product, None)
+            self.lines.pop(product, None)
+
+    def reward_rate_changed(self, customer_class):
+        with self.lock:
+            self.reward_rates.pop(customer_class, None)
+
+    def discount_rate_changed(self, customer):
+        with self.lock:
+            self.discount_rates.pop(customer, None)
+
+    # drop everything, e.g. after the records were replaced
+    def clear(self):
+        with self.lock:
+            self.unit_prices.clear()
+            self.reward_rates.clear()
+            self.discount_rates.clear()
+            self.lines.clear()
+
+pricing = PricingEngine()
+
+class Metrics:
+    # Counters and latency histograms for the checkout flow, exported in the Prometheus text format.
+    # When disabled nothing is timed: enable() wraps the methods listed in TIMED_METHODS with timers
+    # and disable() puts the original methods back, the few counters in the code check self.enabled first.
+    BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, float('inf'))
+    TIMED_METHODS = {
+        'Records': ('find_customer', 'find_product', 'search_products', 'read_customers', 'read_products', 'read_orders',
+                    'read_snapshot', 'save_customers', 'save_products', 'save_orders', 'append_orders', 'recompute_bundles',
+                    'import_prices'),
+        'Operations': ('purchase', 'checkout', 'process_transactions', 'compact'),
+    }
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = {}
+        # name -> [count in each bucket, sum of seconds, count]
+        self.histograms = {}
+        self.reporter = None
+
+    def enable(self):
+        for class_name, method_names in Metrics.TIMED_METHODS.items():
+            cls = globals()[class_name]
+            for method_name in method_names:
+                method = getattr(cls, method_name)
+                if not hasattr(method, 'original'):
+                    setattr(cls, method_name, self.timed(method_name, method))
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        for class_name, method_names in Metrics.TIMED_METHODS.items():
+            cls = globals()[class_name]
+            for method_name in method_names:
+                method = getattr(cls, method_name)
+                if hasattr(method, 'original'):
+                    setattr(cls, method_name, method.original)
+
+    def timed(self, name, method):
+        def timed_method(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.observe(name, time.perf_counter() - start_time)
+        timed_method.original = method
+        timed_method.__name__ = method.__name__
+        return timed_method
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [[0] * len(Metrics.BUCKETS), 0.0, 0]
+            for i, bucket in enumerate(Metrics.BUCKETS):
+                if seconds <= bucket:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    # all metrics in the Prometheus text format
+    def prometheus_text(self):
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE pharmacy_{name}_total counter")
+                lines.append(f"pharmacy_{name}_total {value}")
+            for name, (buckets, total, count) in sorted(self.histograms.items()):
+                lines.append(f"# TYPE pharmacy_{name}_seconds histogram")
+                cumulative = 0
+                for bucket, bucket_count in zip(Metrics.BUCKETS, buckets):
+                    cumulative += bucket_count
+                    le = "+Inf" if bucket == float('inf') else repr(bucket)
+                    lines.append(f'pharmacy_{name}_seconds_bucket{{le="{le}"}} {cumulative}')
+                lines.append(f"pharmacy_{name}_seconds_sum {total}")
+                lines.append(f"pharmacy_{name}_seconds_count {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, filename):
+        with open(filename + '.tmp', 'w') as file:
+            file.write(self.prometheus_text())
+        os.replace(filename + '.tmp', filename)
+
+    # one line per timed operation: count, average and a rough 99th percentile from the buckets
+    def summary(self):
+        lines = []
+        with self.lock:
+            for name, (buckets, total, count) in sorted(self.histograms.items()):
+                cumulative = 0
+                p99 = Metrics.BUCKETS[-1]
+                for bucket, bucket_count in zip(Metrics.BUCKETS, buckets):
+                    cumulative += bucket_count
+                    if cumulative >= count * 0.99:
+                        p99 = bucket
+                        break
+                lines.append(f"{name}: {count} calls, average {total / count * 1000:.3f} ms, p99 <= {p99 * 1000:g} ms")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+    # write the Prometheus file and log a summary every interval seconds, on a background thread
+    def start_reporter(self, interval=60, filename=None, log=print):
+        def report():
+            while not stop.wait(interval):
+                if filename:
+                    self.write_prometheus(filename)
+                log(self.summary())
+        stop = threading.Event()
+        self.reporter = stop
+        threading.Thread(target=report, daemon=True).start()
+
+    def stop_reporter(self):
+        if self.reporter is not None:
+            self.reporter.set()
+            self.reporter = None
+
+metrics = Metrics()
+
+# read a file in fixed-size chunks and yield (line number, byte offset, line) for each non-empty line
+# so that a big file never needs to be held in memory at once
+# start and end limit the reading to the lines in that byte range, start must be at the beginning of a line
+# and the line numbers then count from start
+def read_lines_in_chunks(filename, chunk_size=1 << 20, start=0, end=None):
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        line_number = 0
+        offset = start
+        remaining = end - start if end is not None else None
+        rest = b""
+        while True:
+            if remaining is None:
+                chunk = file.read(chunk_size)
+            else:
+                chunk = file.read(min(chunk_size, remaining))
+                remaining -= len(chunk)
+            if not chunk:
+                break
+            if metrics.enabled:
+                metrics.count('bytes_read', len(chunk))
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            for raw_line in lines:
+                line_number += 1
+                line = raw_line.decode('utf-8').strip()
+                if line:
+                    yield line_number, offset, line
+                offset += len(raw_line) + 1
+        if rest.strip():
+            yield line_number + 1, offset, rest.decode('utf-8').strip()
+
+def parse_customer_line(line):
+    data = [item.strip() for item in line.split(",")]
+    if data[0].startswith('B'): # B as "BasicCustomer: ID, name, rewad_rate, reward".... 
+        customer = BasicCustomer(data[0], data[1], int(data[3]))
+        # the reward rate is shared by all Basic customers, keep the one that was saved
+        BasicCustomer.set_reward_rate(float(data[2]))
+        return customer
+    elif data[0].startswith('V'): # V as "VIPCustomer: ID, name, reward_rate, discount_rate, reward".... 
+        customer = VIPCustomer(ID = data[0], name = data[1], reward = int(data[4]), discount_rate=float(data[3]))
+        VIPCustomer.set_reward_rate(float(data[2]))
+        return customer
+    raise ValueError(f"Unknown customer type: {data[0]}")
+
+def parse_product_line(line):
+    data = [item.strip() for item in line.split(",")] # to avoid the space in the string
+    if data[0].startswith('P'): # as a regular product
+        dr_prescription = True if data[3].lower() == 'y' else False
+        return Product(data[0], data[1], float(data[2]), dr_prescription)
+    elif data[0].startswith('B'): # as a bundle
+        return Bundle(data[0], data[1], data[2:])
+    raise ValueError(f"Unknown product type: {data[0]}")
+
+# a line of a transaction file: "customer, product, quantity[, product, quantity ...][, y/n]"
+# as (customer name or ID, [(product name or ID, quantity), ...], has prescription)
+def parse_transaction_line(line):
+    data = [item.strip() for item in line.split(",")]
+    has_prescription = False
+    if len(data) % 2 == 0: # the last field is the prescription flag
+        has_prescription = data.pop().lower() == 'y'
+    items = []
+    for i in range(1, len(data)-1, 2):
+        try:
+            quantity = int(data[i+1])
+        except ValueError:
+            quantity = data[i+1]
+        items.append((data[i], quantity))
+    return data[0], items, has_prescription
+
+# a line of a price file: "product name or ID, price, y/n for a prescription"
+def parse_price_line(line):
+    data = [item.strip() for item in line.split(",")]
+    if len(data) != 3 or not data[0]:
+        raise ValueError("A price line must have a product name or ID, a price and y/n for a prescription.")
+    price = float(data[1])
+    if not price > 0 or data[2].lower() not in ['y', 'n']:
+        raise ValueError("Price must be greater than 0 and prescription status must be 'y' or 'n'.")
+    return data[0], price, data[2].lower() == 'y'
+
+ORDER_TIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+# "dd/mm/yyyy HH" -> the epoch time that hour starts, so that most order times are parsed with a lookup
+ORDER_HOURS = {}
+
+# turn an order time like "18/10/2026 15:28:12" into seconds since the epoch, and back
+# times are local, so each hour goes through datetime once to get daylight saving right
+def parse_order_time(order_time):
+    if len(order_time) == 19:
+        hour_start = ORDER_HOURS.get(order_time[:13])
+        if hour_start is not None:
+            return hour_start + int(order_time[14:16]) * 60 + int(order_time[17:19])
+    date, time = order_time.split()
+    day, month, year = date.split("/")
+    hour, minute, second = time.split(":")
+    if len(order_time) == 19:
+        ORDER_HOURS[order_time[:13]] = datetime.datetime(int(year), int(month), int(day), int(hour)).timestamp()
+    return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second)).timestamp()
+
+# a time window typed at the till as (start, end) epoch times, end not included:
+# "14/10/2026" is that whole day, "14/10/2026 09:00 - 14/10/2026 12:00" or "14/10/2026 09:00 - 12:00" a shift
+def parse_time_window(text):
+    def parse_point(point, day=None):
+        point = point.strip()
+        for time_format in ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y"):
+            try:
+                return datetime.datetime.strptime(point, time_format), time_format == "%d/%m/%Y"
+            except ValueError:
+                pass
+        if day is not None: # only a time, on the day of the start
+            return datetime.datetime.combine(day.date(), datetime.datetime.strptime(point, "%H:%M").time()), False
+        raise ValueError(f"Invalid date or time: {point}")
+    if " - " in text:
+        first, second = text.split(" - ", 1)
+        start, start_is_day = parse_point(first)
+        end, end_is_day = parse_point(second, start)
+        if end_is_day:
+            end += datetime.timedelta(days=1)
+    else:
+        start, is_day = parse_point(text)
+        if not is_day:
+            raise ValueError("Enter a whole day, or a start and an end separated by ' - '.")
+        end = start + datetime.timedelta(days=1)
+    if end <= start:
+        raise ValueError("The end of the window must be after its start.")
+    return start.timestamp(), end.timestamp()
+
+# the epoch time of an order dict, orders made or read by this version carry it already
+def order_timestamp(order):
+    timestamp = order.get('timestamp')
+    return timestamp if timestamp is not None else parse_order_time(order['order_time'])
+
+def format_order_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime(ORDER_TIME_FORMAT)
+
+class OrderStore:
+    # Keeps all orders in parallel arrays instead of one dict (and one list of tuples) per order.
+    # The lines of order i are the entries line_start[i] to line_start[i+1] of the line arrays.
+    def __init__(self):
+        self.customer_index = array('i')
+        self.total_cost = array('d')
+        self.earned_rewards = array('i')
+        self.order_time = array('q')
+        self.line_start = array('q', [0])
+        self.product_index = array('i')
+        self.unit_price = array('d')
+        self.quantity = array('i')
+        # each product name is stored once, orders keep its index
+        self.product_names = []
+        self.product_numbers = {}
+
+    def __len__(self):
+        return len(self.total_cost)
+
+    # add an order dict and return its number
+    def add(self, customer_index, order):
+        for product_name, unit_price, quantity in order['products']:
+            product_number = self.product_numbers.get(product_name)
+            if product_number is None:
+                product_number = len(self.product_names)
+                self.product_names.append(product_name)
+                self.product_numbers[product_name] = product_number
+            self.product_index.append(product_number)
+            self.unit_price.append(unit_price)
+            self.quantity.append(quantity)
+        self.line_start.append(len(self.quantity))
+        self.customer_index.append(customer_index)
+        self.total_cost.append(order['total_cost'])
+        self.earned_rewards.append(order['earned_rewards'])
+        self.order_time.append(int(order_timestamp(order)))
+        return len(self.total_cost) - 1
+
+    # build the order dict again, in the same shape as the orders read from the file
+    def get(self, number):
+        products = []
+        for line in range(self.line_start[number], self.line_start[number+1]):
+            products.append((self.product_names[self.product_index[line]], self.unit_price[line], self.quantity[line]))
+        return {
+            'products': products,
+            'total_cost': self.total_cost[number],
+            'earned_rewards': self.earned_rewards[number],
+            'order_time': format_order_time(self.order_time[number]),
+            'timestamp': float(self.order_time[number])
+        }
+
+class OrderHistory:
+    # The order history of one customer when orders are kept in an OrderStore.
+    # It behaves like the list of order dicts: append, len, index and iterate.
+    __slots__ = ('store', 'customer_index', 'numbers')
+    def __init__(self, store, customer_index):
+        self.store = store
+        self.customer_index = customer_index
+        self.numbers = array('i')
+
+    def append(self, order):
+        self.numbers.append(self.store.add(self.customer_index, order))
+
+    def extend(self, orders):
+        for order in orders:
+            self.append(order)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.store.get(number) for number in self.numbers[index]]
+        return self.store.get(self.numbers[index])
+
+    def __iter__(self):
+        for number in self.numbers:
+            yield self.store.get(number)
+
+# size and modification time of a data file, to tell whether a snapshot was written from it
+def file_stamp(filename):
+    try:
+        status = os.stat(filename)
+        return (status.st_size, status.st_mtime_ns)
+    except (OSError, TypeError):
+        return (-1, -1)
+
+# make sure a file that was written and closed is on disk
+def sync_file(filename):
+    with open(filename, 'rb') as file:
+        os.fsync(file.fileno())
+
+# Binary snapshot of the records, version 1. All numbers are little-endian.
+# The header holds the reward rates, the size and time of the three data files the snapshot
+# was written from, and the (offset, size) of each section. Every section starts on 8 bytes.
+#   strings, order_product_names: utf-8 strings, each one ended by a newline
+#   customers, products: fixed-width records, see SNAPSHOT_CUSTOMER and SNAPSHOT_PRODUCT
+#   components and the order columns: plain arrays with the typecodes in SNAPSHOT_COLUMNS,
+#   laid out like an OrderStore with the orders of each customer next to each other
+SNAPSHOT_MAGIC = b"PHARMSNP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SECTIONS = ('strings', 'customers', 'products', 'components', 'order_product_names', 'total_cost',
+                     'earned_rewards', 'order_time', 'line_start', 'product_index', 'unit_price', 'quantity')
+SNAPSHOT_HEADER = struct.Struct('<8sI4xdd6q' + 'qq' * len(SNAPSHOT_SECTIONS))
+# type (0 Basic, 1 VIP), ID, name, last order time (string numbers, -1 if none), reward, discount rate,
+# first order, order count, lifetime spend, lifetime rewards
+SNAPSHOT_CUSTOMER = struct.Struct('<B3xIIiqdqqdq')
+# type (0 product, 1 bundle), prescription, ID, name, unit price, first component, component count
+SNAPSHOT_PRODUCT = struct.Struct('<B?2xIIdII')
+SNAPSHOT_COLUMNS = {'components': 'I', 'total_cost': 'd', 'earned_rewards': 'q', 'order_time': 'q',
+                    'line_start': 'q', 'product_index': 'I', 'unit_price': 'd', 'quantity': 'i'}
+
+class StringTable:
+    # Numbers each distinct string once, in the order they are first seen.
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self.numbers = {string: number for number, string in enumerate(self.strings)}
+
+    def number(self, string):
+        number = self.numbers.get(string)
+        if number is None:
+            number = self.numbers[string] = len(self.strings)
+            self.strings.append(string)
+        return number
+
+    def pack(self):
+        return "".join(string + "\n" for string in self.strings).encode('utf-8')
+
+# write the customers, products and orders of the records to a snapshot file
+# source_files are the customer, product and order files that hold the same data
+def write_snapshot(records, filename, source_files):
+    if sys.byteorder != 'little':
+        raise ValueError("Snapshots can only be written on little-endian machines.")
+    old = records.snapshot
+    strings = StringTable()
+    # names already in the old snapshot keep their numbers, so its order lines can be copied as they are
+    order_names = StringTable(old.product_names if old is not None else ())
+    columns = {name: array(typecode) for name, typecode in SNAPSHOT_COLUMNS.items()}
+    columns['line_start'].append(0)
+    customer_data = bytearray()
+    product_data = bytearray()
+    with records.lock:
+        for customer in records.customers:
+            first_order = len(columns['total_cost'])
+            pending = records.snapshot_orders.get(customer.ID) if customer.order_loader is not None else None
+            if pending is not None:
+                old.copy_orders(pending[0], pending[1], columns)
+            else:
+                for order in customer.order_history:
+                    for product_name, unit_price, quantity in order['products']:
+                        columns['product_index'].append(order_names.number(product_name))
+                        columns['unit_price'].append(unit_price)
+                        columns['quantity'].append(quantity)
+                    columns['line_start'].append(len(columns['quantity']))
+                    columns['total_cost'].append(order['total_cost'])
+                    columns['earned_rewards'].append(order['earned_rewards'])
+                    columns['order_time'].append(int(order_timestamp(order)))
+            is_vip = isinstance(customer, VIPCustomer)
+            customer_data += SNAPSHOT_CUSTOMER.pack(
+                1 if is_vip else 0, strings.number(customer.ID), strings.number(customer.name),
+                strings.number(customer.last_order_time) if customer.last_order_time is not None else -1,
+                customer.reward, customer.discount_rate if is_vip else 0.0,
+                first_order, len(columns['total_cost']) - first_order, customer.lifetime_spend, customer.lifetime_rewards)
+        for product in records.products.values():
+            is_bundle = isinstance(product, Bundle)
+            component_start = len(columns['components'])
+            if is_bundle:
+                columns['components'].extend(strings.number(comp) for comp in product.component)
+            product_data += SNAPSHOT_PRODUCT.pack(
+                1 if is_bundle else 0, product.dr_prescription, strings.number(product.product_ID),
+                strings.number(product.product_name), product.unit_price,
+                component_start, len(columns['components']) - component_start)
+
+    sections = {'strings': strings.pack(), 'customers': customer_data, 'products': product_data,
+                'order_product_names': order_names.pack()}
+    for name, column in columns.items():
+        sections[name] = column.tobytes()
+    locations = []
+    with open(filename + '.tmp', 'wb') as file:
+        file.write(bytes(SNAPSHOT_HEADER.size))
+        for name in SNAPSHOT_SECTIONS:
+            file.write(bytes(-file.tell() % 8))
+            locations += [file.tell(), len(sections[name])]
+            file.write(sections[name])
+        stamps = [value for source_file in source_files for value in file_stamp(source_file)]
+        file.seek(0)
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, BasicCustomer.get_reward_rate(),
+                                        VIPCustomer.get_reward_rate(), *stamps, *locations))
+        if metrics.enabled:
+            metrics.count('bytes_written', sum(len(section) for section in sections.values()))
+    os.replace(filename + '.tmp', filename)
+
+class Snapshot(OrderStore):
+    # A snapshot file opened with mmap. It is a read-only OrderStore: the order columns are views
+    # of the mapped file, so only the pages of the orders that are used are ever read from disk.
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.views = []
+        try:
+            if len(self.map) < SNAPSHOT_HEADER.size:
+                raise ValueError("File is too short to be a snapshot.")
+            header = SNAPSHOT_HEADER.unpack_from(self.map)
+            if header[0] != SNAPSHOT_MAGIC:
+                raise ValueError("File is not a snapshot.")
+            if header[1] != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported snapshot version {header[1]}.")
+            if sys.byteorder != 'little':
+                raise ValueError("Snapshots can only be read on little-endian machines.")
+            self.basic_reward_rate, self.vip_reward_rate = header[2], header[3]
+            self.stamps = [tuple(header[4 + i:6 + i]) for i in range(0, 6, 2)]
+            self.sections = {}
+            for number, name in enumerate(SNAPSHOT_SECTIONS):
+                offset, size = header[10 + 2 * number], header[11 + 2 * number]
+                if offset + size > len(self.map):
+                    raise ValueError(f"Snapshot section {name} is cut off.")
+                self.sections[name] = self.view(offset, offset + size)
+            for name, typecode in SNAPSHOT_COLUMNS.items():
+                column = self.sections[name].cast(typecode)
+                self.views.append(column)
+                setattr(self, name, column)
+            self.product_names = self.read_strings('order_product_names')
+        except ValueError:
+            self.close()
+            raise
+
+    # every view of the map is kept so that close() can release it before unmapping
+    def view(self, start, end):
+        whole = memoryview(self.map)
+        view = whole[start:end]
+        self.views += [whole, view]
+        return view
+
+    def close(self):
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        self.map.close()
+
+    # True if the data files are still the ones the snapshot was written from
+    def matches(self, source_files):
+        return [file_stamp(source_file) for source_file in source_files] == self.stamps
+
+    def read_strings(self, name):
+        return bytes(self.sections[name]).decode('utf-8').split("\n")[:-1]
+
+    def customers(self):
+        return SNAPSHOT_CUSTOMER.iter_unpack(self.sections['customers'])
+
+    def products(self):
+        return SNAPSHOT_PRODUCT.iter_unpack(self.sections['products'])
+
+    # add orders first to first+count to the columns of a new snapshot without building the order dicts
+    def copy_orders(self, first, count, columns):
+        start, end = self.line_start[first], self.line_start[first + count]
+        shift = len(columns['quantity']) - start
+        for name in ('total_cost', 'earned_rewards', 'order_time'):
+            columns[name].frombytes(getattr(self, name)[first:first + count].tobytes())
+        for name in ('product_index', 'unit_price', 'quantity'):
+            columns[name].frombytes(getattr(self, name)[start:end].tobytes())
+        columns['line_start'].extend(line + shift for line in self.line_start[first + 1:first + count + 1])
+
+# reward: the points written in the line, the customer's points now by default
+def format_customer_line(customer, reward=None):
+    reward = customer.reward if reward is None else reward
+    if isinstance(customer, BasicCustomer):
+        return f"{customer.ID},{customer.name},{BasicCustomer.get_reward_rate()},{reward}"
+    elif isinstance(customer, VIPCustomer):
+        return f"{customer.ID},{customer.name},{VIPCustomer.get_reward_rate()},{customer.discount_rate},{reward}"
+
+# the line of a customer in the customer file: reading the order file adds the earned rewards
+# of every order to the customer again, so the file keeps the points from before the orders
+def format_saved_customer_line(customer):
+    return format_customer_line(customer, customer.reward - customer.lifetime_rewards)
+
+def format_product_line(product):
+    # check if the product is a regular product or a bundle
+    if type(product) == Product: # to aviod the bundle class be added into the regular product list
+        return f"{product.product_ID},{product.product_name},{product.unit_price},{'y' if product.dr_prescription else 'n'}"
+    elif isinstance(product, Bundle):
+        components = ','.join(product.component)
+        return f"{product.product_ID},{product.product_name},{components}"
+
+def format_order_line(customer, order):
+    products = ','.join([f"{product[0]},{product[2]}" for product in order['products']])
+    return f"{customer.ID},{products},{order['total_cost']:.2f},{order['earned_rewards']},{order['order_time']}"
+
+# the receipt of a purchase, laid out as display_receipt always printed it
+# the templates are put together once, so rendering a receipt is a few format calls into one string
+RECEIPT_RULE = '-' * 45 + "\n"
+RECEIPT_HEADER = (RECEIPT_RULE + "Receipt".center(45, ' ') + "\n" + RECEIPT_RULE + "Name:".ljust(20) + " {}\n").format
+RECEIPT_LINE = ("Product:".ljust(20) + " {}\n" + "Unit Price:".ljust(20) + " {:.2f} (AUD)\n"
+                + "Quantity:".ljust(20) + " {}\n" + RECEIPT_RULE).format
+RECEIPT_VIP = ("Original cost:".ljust(20) + " {:.2f} (AUD)\n" + "Discount:".ljust(20) + " {:.2f} (AUD)\n").format
+RECEIPT_TOTAL = ("Total cost:".ljust(20) + " {:.2f} (AUD)\n" + "Earned reward:".ljust(20) + " {}\n" + RECEIPT_RULE).format
+
+def render_receipt(customer, detail, original_total_cost, discount, final_total_cost, reward):
+    parts = [RECEIPT_HEADER(customer.name)]
+    for product_name, unit_price, quantity in detail:
+        parts.append(RECEIPT_LINE(product_name, unit_price, quantity))
+    if isinstance(customer, VIPCustomer):
+        parts.append(RECEIPT_VIP(original_total_cost, discount))
+    parts.append(RECEIPT_TOTAL(final_total_cost, reward))
+    return "".join(parts)
+
+# the number in an ID like B12 or P7, or None for IDs that don't look like that
+def id_number(ID):
+    if len(ID) > 1 and ID[1:].isdigit():
+        return int(ID[1:])
+    return None
+
+# sort keys of the fields customers and products can be listed by
+# IDs sort by their letter and then by number, so B2 comes before B10
+CUSTOMER_LISTING_SORTS = {
+    'ID': lambda item: (item.ID[:1], id_number(item.ID) or -1, item.ID),
+    'name': lambda item: (item.name.casefold(), item.ID),
+}
+PRODUCT_LISTING_SORTS = {
+    'ID': lambda product: (product.product_ID[:1], id_number(product.product_ID) or -1, product.product_ID),
+    'name': lambda product: (product.product_name.casefold(), product.product_ID),
+}
+CUSTOMER_FILTERS = {
+    'basic': lambda customer: isinstance(customer, BasicCustomer),
+    'vip': lambda customer: isinstance(customer, VIPCustomer),
+}
+PRODUCT_FILTERS = {
+    'product': lambda product: type(product) == Product,
+    'bundle': lambda product: isinstance(product, Bundle),
+    'prescription': lambda product: product.dr_prescription,
+}
+
+# the 3-letter pieces of a text, with spaces around it so that the start and the end count too
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+class ProductSearchIndex:
+    # Finds products by the start of their name or ID, and suggests names close to a misspelt one.
+    # Prefixes are found with bisect in a sorted list of case-folded names and IDs.
+    # Fuzzy matches come from an index of the trigrams of each name and are ranked by how many
+    # trigrams they share with the text. Trigrams shared by many products say little and would make
+    # every product a candidate, so only the rarest trigrams of the text are used to pick candidates.
+    RARE_TRIGRAMS = 4
+    MOST_CANDIDATES = 5000
+    CANDIDATES = 30
+    # the share of trigrams two names must have in common to count as alike
+    SIMILARITY = 0.3
+
+    def __init__(self):
+        self.products = {}
+        # the indexes are built from all products the first time a search is made, so loading
+        # a catalogue costs nothing extra; after that each product is indexed as it is added
+        self.built = False
+        # sorted (case-folded name or ID, product ID)
+        self.keys = []
+        # trigram -> IDs of the products whose name has it
+        self.trigrams = {}
+
+    def add(self, product):
+        self.remove(product.product_ID)
+        self.products[product.product_ID] = product
+        if self.built:
+            self.index(product)
+
+    def remove(self, product_ID):
+        product = self.products.pop(product_ID, None)
+        if product is None or not self.built:
+            return
+        for key in {product.product_name.casefold(), product_ID.casefold()}:
+            i = bisect.bisect_left(self.keys, (key, product_ID))
+            if i < len(self.keys) and self.keys[i] == (key, product_ID):
+                del self.keys[i]
+        for trigram in trigrams(product.product_name.casefold()):
+            IDs = self.trigrams.get(trigram)
+            if IDs is not None:
+                IDs.discard(product_ID)
+                if not IDs:
+                    del self.trigrams[trigram]
+
+    def build(self):
+        self.keys = []
+        self.trigrams = {}
+        for product in self.products.values():
+            self.index(product)
+        self.keys.sort()
+        self.built = True
+
+    def index(self, product):
+        product_ID = product.product_ID
+        for key in {product.product_name.casefold(), product_ID.casefold()}:
+            if self.built:
+                bisect.insort(self.keys, (key, product_ID))
+            else:
+                self.keys.append((key, product_ID))
+        index = self.trigrams
+        for trigram in trigrams(product.product_name.casefold()):
+            IDs = index.get(trigram)
+            if IDs is None:
+                index[trigram] = {product_ID}
+            else:
+                IDs.add(product_ID)
+
+    # products whose name or ID starts with the text, in alphabetical order
+    def prefix(self, text, limit=5):
+        if not self.built:
+            self.build()
+        text = text.strip().casefold()
+        found = []
+        i = bisect.bisect_left(self.keys, (text,))
+        while i < len(self.keys) and len(found) < limit and self.keys[i][0].startswith(text):
+            product = self.products[self.keys[i][1]]
+            if product not in found:
+                found.append(product)
+            i += 1
+        return found
+
+    # products whose name shares the most trigrams with the text, closest first
+    def fuzzy(self, text, limit=5):
+        if not self.built:
+            self.build()
+        text_trigrams = trigrams(text.strip().casefold())
+        postings = sorted((self.trigrams[trigram] for trigram in text_trigrams if trigram in self.trigrams), key=len)
+        counts = {}
+        counted = 0
+        for IDs in postings[:self.RARE_TRIGRAMS]:
+            counted += len(IDs)
+            if counted > self.MOST_CANDIDATES:
+                break
+            for product_ID in IDs:
+                counts[product_ID] = counts.get(product_ID, 0) + 1
+        ranked = []
+        for product_ID in heapq.nlargest(self.CANDIDATES, counts, key=counts.get):
+            name = self.products[product_ID].product_name
+            name_trigrams = trigrams(name.casefold())
+            # Dice coefficient of the two sets of trigrams
+            similarity = 2 * len(text_trigrams & name_trigrams) / (len(text_trigrams) + len(name_trigrams))
+            if similarity >= self.SIMILARITY:
+                ranked.append((-similarity, name, product_ID))
+        ranked.sort()
+        return [self.products[product_ID] for similarity, name, product_ID in ranked[:limit]]
+
+    # prefix matches first, then the closest fuzzy matches
+    def search(self, text, limit=5):
+        found = self.prefix(text, limit)
+        if len(found) < limit:
+            for product in self.fuzzy(text, limit):
+                if len(found) >= limit:
+                    break
+                if product not in found:
+                    found.append(product)
+        return found
+
+class OrderHistoryCache:
+    # Keeps the order histories of the customers used most recently in memory, up to max_orders orders
+    # in all. When a history is read and the total goes over, the histories used longest ago are dropped;
+    # they are read from disk again the next time they are used. Records only puts histories in here
+    # that are complete on disk, a customer with orders that are not written yet stays in memory.
+    def __init__(self, max_orders=100000):
+        self.max_orders = max_orders
+        # customer -> number of orders, the one used longest ago first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, customer):
+        return customer in self.entries
+
+    def hit(self, customer):
+        self.entries.move_to_end(customer)
+        self.hits += 1
+        if metrics.enabled:
+            metrics.count('order_cache_hits')
+
+    # a history was read from disk (miss) or was already in memory, returns the customers whose histories should be dropped
+    def add(self, customer, size, miss=True):
+        if miss:
+            self.misses += 1
+            if metrics.enabled:
+                metrics.count('order_cache_misses')
+        self.entries[customer] = size
+        self.size += size
+        evicted = []
+        while self.size > self.max_orders and len(self.entries) > 1:
+            old_customer, old_size = self.entries.popitem(last=False)
+            self.size -= old_size
+            evicted.append(old_customer)
+        self.evictions += len(evicted)
+        if metrics.enabled and evicted:
+            metrics.count('order_cache_evictions', len(evicted))
+        return evicted
+
+    def remove(self, customer):
+        self.size -= self.entries.pop(customer, 0)
+
+    def stats(self):
+        return {'customers': len(self.entries), 'orders': self.size, 'max_orders': self.max_orders,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+class OrderTimeIndex:
+    # Every order as (epoch time, customer, number in the customer's history), sorted by time,
+    # so the orders in a time window are found with two binary searches.
+    # Built from all orders the first time it is used, like ProductSearchIndex; after that the new
+    # orders are added as they are made, at the end as they are almost always the latest.
+    def __init__(self):
+        self.built = False
+        self.times = array('d')
+        self.customers = []
+        self.numbers = array('q')
+
+    # entries is every (time, customer, number) in any order
+    def build(self, entries):
+        entries = list(entries)
+        entries.sort(key=lambda entry: entry[0])
+        self.times = array('d', [entry[0] for entry in entries])
+        self.customers = [entry[1] for entry in entries]
+        self.numbers = array('q', [entry[2] for entry in entries])
+        self.built = True
+
+    def add(self, timestamp, customer, number):
+        if not self.times or timestamp >= self.times[-1]:
+            self.times.append(timestamp)
+            self.customers.append(customer)
+            self.numbers.append(number)
         else:
-            final_total_cost = original_total_cost
+            i = bisect.bisect_right(self.times, timestamp)
+            self.times.insert(i, timestamp)
+            self.customers.insert(i, customer)
+            self.numbers.insert(i, number)
 
-        # Calculate reward based on the final total cost        
-        if hasattr(self.customer, 'get_reward'):
-            reward = self.customer.get_reward(original_total_cost)
+    def __len__(self):
+        return len(self.times)
 
-        return (original_total_cost, discount, final_total_cost, reward)
+    # (customer, number) of the orders from start up to but not including end, oldest first
+    def between(self, start, end):
+        first = bisect.bisect_left(self.times, start)
+        last = bisect.bisect_left(self.times, end)
+        return [(self.customers[i], self.numbers[i]) for i in range(first, last)]
 
-class Records:
+class IdAllocator:
+    # Hands out the smallest unused number for new IDs in constant time.
+    # The unused numbers are kept as ranges of gaps between the used ones (smallest range last)
+    # plus the highest used number. It is built once from the existing IDs the first time it is needed.
     def __init__(self):
+        self.free = []
+        self.highest = 0
+        self.built = False
+
+    def rebuild(self, IDs):
+        numbers = sorted({number for number in map(id_number, IDs) if number is not None})
+        self.free = []
+        previous = 0
+        for number in numbers:
+            if number > previous + 1:
+                self.free.append((previous + 1, number - 1))
+            previous = number
+        self.free.reverse()
+        self.highest = previous
+        self.built = True
+
+    def allocate(self):
+        if self.free:
+            start, end = self.free.pop()
+            if start < end:
+                self.free.append((start + 1, end))
+            return start
+        self.highest += 1
+        return self.highest
+
+    # mark the number of an ID added from somewhere else as used
+    def reserve(self, ID):
+        number = id_number(ID)
+        if not self.built or number is None:
+            return
+        if number > self.highest:
+            if number > self.highest + 1:
+                self.free.insert(0, (self.highest + 1, number - 1))
+            self.highest = number
+            return
+        # IDs chosen by hand are rare, so a search through the gaps is fine here
+        for i in range(len(self.free) - 1, -1, -1):
+            start, end = self.free[i]
+            if start <= number <= end:
+                ranges = []
+                if number < end:
+                    ranges.append((number + 1, end))
+                if start < number:
+                    ranges.append((start, number - 1))
+                self.free[i:i+1] = ranges
+                return
+
+class Catalogue:
+    # One version of the products and of the name indexes used to find them.
+    # The live version is never rebuilt in place by a bulk import: Records.import_prices builds a new
+    # version next to it and swaps it in with one assignment, so a till that looked up its products
+    # in the old version keeps reading old prices that all belong together.
+    __slots__ = ('products', 'product_names', 'product_names_folded')
+    def __init__(self, products=None, product_names=None, product_names_folded=None):
+        self.products = {} if products is None else products
+        self.product_names = {} if product_names is None else product_names
+        self.product_names_folded = {} if product_names_folded is None else product_names_folded
+
+    # a copy that can be changed while this version is still being read
+    def copy(self):
+        return Catalogue(dict(self.products), dict(self.product_names), dict(self.product_names_folded))
+
+    # put a product in place of the one with its ID, the first product with a name keeps it
+    def replace(self, product):
+        old_product = self.products.get(product.product_ID)
+        self.products[product.product_ID] = product
+        for names, name in ((self.product_names, product.product_name),
+                            (self.product_names_folded, product.product_name.casefold())):
+            if old_product is not None and names.get(name) is old_product:
+                names[name] = product
+            else:
+                names.setdefault(name, product)
+
+class SharedLock:
+    # A lock that many threads can hold at once in shared mode, or one thread in exclusive mode.
+    # Waiting exclusive holders go first so that saving is never starved by busy tills.
+    # Shared mode is not re-entrant: a thread must not take it again while holding it.
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.shared_count = 0
+        self.exclusive_waiting = 0
+        self.exclusive_held = False
+
+    def acquire_shared(self):
+        with self.condition:
+            while self.exclusive_held or self.exclusive_waiting:
+                self.condition.wait()
+            self.shared_count += 1
+
+    def release_shared(self):
+        with self.condition:
+            self.shared_count -= 1
+            if self.shared_count == 0:
+                self.condition.notify_all()
+
+    def acquire_exclusive(self):
+        with self.condition:
+            self.exclusive_waiting += 1
+            while self.exclusive_held or self.shared_count:
+                self.condition.wait()
+            self.exclusive_waiting -= 1
+            self.exclusive_held = True
+
+    def release_exclusive(self):
+        with self.condition:
+            self.exclusive_held = False
+            self.condition.notify_all()
+
+    def shared(self):
+        return LockHolder(self.acquire_shared, self.release_shared)
+
+    def exclusive(self):
+        return LockHolder(self.acquire_exclusive, self.release_exclusive)
+
+class LockHolder:
+    # lets "with lock.shared():" acquire and release a SharedLock
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+class ReceiptSpooler:
+    # Writes receipts away from the tills: submit() only queues the rendered text, and a background
+    # thread writes whatever has been queued with one write to the screen and one to the archive.
+    # The archive is a text file with each receipt after a line "Order <customer ID> <order number> <order time>".
+    # Once it is bigger than max_bytes it is renamed to archive.1, archive.2, ... and a new one is started;
+    # only the newest archives_kept of the renamed files are kept.
+    # A receipt is found again for a reprint with an index of where each one was written, built from
+    # the archive files the first time a receipt is asked for and kept up to date after that.
+    def __init__(self, archive_file=None, max_bytes=10 << 20, archives_kept=5):
+        self.archive_file = archive_file
+        self.max_bytes = max_bytes
+        self.archives_kept = archives_kept
+        self.file = None
+        # archive file name -> {(customer ID, order number): (offset, length)}
+        self.index = None
+        # held while the archive is written or read, the tills never need it
+        self.index_lock = threading.Lock()
+        self.pending = []
+        self.submitted = 0
+        self.written = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.closing = False
+
+    # queue a receipt; order is (customer ID, order number, order time) to archive it under
+    # show writes it to the screen as well, to sys.stdout as it is now
+    def submit(self, text, order=None, show=True):
+        if not show and (order is None or self.archive_file is None):
+            return
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.pending.append((text, order, sys.stdout if show else None))
+            self.submitted += 1
+            self.condition.notify_all()
+
+    # wait until every receipt submitted so far has been written
+    def flush(self):
+        with self.condition:
+            submitted = self.submitted
+            while self.written < submitted:
+                self.condition.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closing:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                # the receipts queued while the last batch was written go out together
+                batch, self.pending = self.pending, []
+            try:
+                self.write(batch)
+            except (OSError, ValueError) as e:
+                print(f"Could not write receipts: {e}", file=sys.stderr)
+            with self.condition:
+                self.written += len(batch)
+                self.condition.notify_all()
+
+    def write(self, batch):
+        screens = {}
+        for text, order, stream in batch:
+            if stream is not None:
+                screens.setdefault(stream, []).append(text)
+        for stream, texts in screens.items():
+            stream.write("".join(texts))
+            stream.flush()
+        if self.archive_file is not None:
+            with self.index_lock:
+                self.archive([(text, order) for text, order, stream in batch if order is not None])
+        if metrics.enabled:
+            metrics.count('receipts_written', len(batch))
+            metrics.count('receipt_batches')
+
+    def archive(self, receipts):
+        if not receipts:
+            return
+        if self.file is None:
+            self.file = open(self.archive_file, 'ab')
+        offset = self.file.tell()
+        data = []
+        for text, (customer_ID, number, order_time) in receipts:
+            title = f"Order {customer_ID} {number} {order_time}\n".encode('utf-8')
+            body = text.encode('utf-8')
+            if self.index is not None:
+                self.index.setdefault(self.archive_file, {})[(customer_ID, number)] = (offset + len(title), len(body))
+            data.append(title)
+            data.append(body)
+            offset += len(title) + len(body)
+        self.file.write(b"".join(data))
+        self.file.flush()
+        if offset >= self.max_bytes:
+            self.rotate()
+
+    # the renamed archives as (number, file name), oldest first
+    def old_archives(self):
+        folder = os.path.dirname(self.archive_file) or "."
+        prefix = os.path.basename(self.archive_file) + "."
+        archives = []
+        for name in os.listdir(folder):
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                archives.append((int(name[len(prefix):]), os.path.join(folder, name)))
+        return sorted(archives)
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        archives = self.old_archives()
+        number = archives[-1][0] + 1 if archives else 1
+        filename = f"{self.archive_file}.{number}"
+        os.replace(self.archive_file, filename)
+        archives.append((number, filename))
+        if self.index is not None and self.archive_file in self.index:
+            self.index[filename] = self.index.pop(self.archive_file)
+        for number, old_filename in archives[:-self.archives_kept] if self.archives_kept else archives:
+            os.remove(old_filename)
+            if self.index is not None:
+                self.index.pop(old_filename, None)
+
+    # where each receipt of an archive file starts and how long it is
+    def read_index(self, filename):
+        index = {}
+        receipt = None
+        for line_number, offset, line in read_lines_in_chunks(filename):
+            if line.startswith("Order "):
+                if receipt is not None:
+                    index[receipt[0]] = (receipt[1], offset - receipt[1])
+                customer_ID, number = line.split()[1:3]
+                receipt = ((customer_ID, int(number)), offset + len(line.encode('utf-8')) + 1)
+        if receipt is not None:
+            index[receipt[0]] = (receipt[1], os.path.getsize(filename) - receipt[1])
+        return index
+
+    # the text of an archived receipt, or None if it was never archived or its archive was removed
+    def receipt(self, customer_ID, number):
+        if self.archive_file is None:
+            return None
+        self.flush()
+        with self.index_lock:
+            if self.index is None:
+                self.index = {}
+                for archive_number, filename in self.old_archives():
+                    self.index[filename] = self.read_index(filename)
+                if os.path.exists(self.archive_file):
+                    self.index[self.archive_file] = self.read_index(self.archive_file)
+            # the newest archive first, in case an order number was archived twice
+            for filename in [self.archive_file] + [name for number, name in reversed(self.old_archives())]:
+                place = self.index.get(filename, {}).get((customer_ID, number))
+                if place is not None:
+                    with open(filename, 'rb') as file:
+                        file.seek(place[0])
+                        return file.read(place[1]).decode('utf-8')
+        return None
+
+    # write what is queued and stop the thread
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+        with self.condition, self.index_lock:
+            self.thread = None
+            self.closing = False
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class Journal:
+    # An append-only log of every change made since the data files were last written.
+    # Each entry is "kind,value" on its own line and is flushed to disk straight away,
+    # so a crash loses at most the transaction that was being written.
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+        self.file = None
+        self.lock = threading.Lock()
+
+    # yield (line number, kind, value) for each entry in the journal
+    def read(self):
+        if not os.path.exists(self.filename):
+            return
+        for line_number, offset, line in read_lines_in_chunks(self.filename):
+            kind, _, value = line.partition(",")
+            self.count += 1
+            yield line_number, kind, value
+
+    def append(self, kind, value, sync=True):
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.filename, 'a')
+            self.file.write(f"{kind},{value}\n")
+            self.count += 1
+            if sync:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+    # make sure everything appended so far is on disk
+    def sync(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+    # empty the journal once its changes are in the data files
+    def clear(self):
+        self.close()
+        with self.lock:
+            open(self.filename, 'w').close()
+            self.count = 0
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class RewardLedger:
+    # An append-only record of every change to the reward points of each customer, one event per line:
+    #   earn,<customer ID>,<points>,<order time>,<order number>
+    #   redeem,<customer ID>,<points>,<order time>,<order number>
+    #   adjust,<customer ID>,<points, may be negative>,<time>    opening balances and changes made by hand
+    #   checkpoint,<customer ID>,<balance>,<time>                after every CHECKPOINT_EVERY events of the customer
+    # The balance of a customer at any time is the last checkpoint before then plus the events after it,
+    # so a query adds up at most CHECKPOINT_EVERY events. The balances of all customers are also written to
+    # <ledger>.checkpoint with the size the ledger had then, so a start reads those balances and the events
+    # after them, instead of adding up the earned rewards of every order ever made.
+    # Once a ledger is kept it holds the balances: it must be kept on every run, or the changes made
+    # without it are lost the next time it is used.
+    CHECKPOINT_EVERY = 100
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.checkpoint_file = filename + ".checkpoint"
+        # the lines are appended and synced like those of the journal
+        self.journal = Journal(filename)
+        self.exists = os.path.exists(filename) and os.path.getsize(filename) > 0
+        # guards the balances, so they always match the events in the file
+        self.lock = threading.Lock()
+        self.balances = {}
+        # customer ID -> events since its last checkpoint
+        self.since_checkpoint = {}
+        # customer ID -> (event times, points, positions of the checkpoints), built on the first balance_at
+        # the points are the change of each event, or the balance at a checkpoint
+        self.history = None
+
+    # one event as the change it makes, or the balance for a checkpoint
+    @staticmethod
+    def parse_event(line):
+        kind, customer_ID, points, event_time = line.split(",", 4)[:4]
+        points = int(points)
+        if kind == 'redeem':
+            points = -points
+        elif kind not in ('earn', 'adjust', 'checkpoint'):
+            raise ValueError(f"Unknown reward event: {kind}")
+        return kind, customer_ID, points, event_time
+
+    def apply(self, kind, customer_ID, points):
+        if kind == 'checkpoint':
+            self.balances[customer_ID] = points
+            self.since_checkpoint[customer_ID] = 0
+        else:
+            self.balances[customer_ID] = self.balances.get(customer_ID, 0) + points
+            self.since_checkpoint[customer_ID] = self.since_checkpoint.get(customer_ID, 0) + 1
+
+    def append(self, kind, customer_ID, points, event_time, reference=None, sync=True):
+        value = f"{customer_ID},{points},{event_time}" + (f",{reference}" if reference is not None else "")
+        self.journal.append(kind, value, sync=sync)
+        points = -points if kind == 'redeem' else points
+        self.apply(kind, customer_ID, points)
+        if self.history is not None:
+            self.add_history(self.history, kind, customer_ID, points, parse_order_time(event_time))
+
+    # record one change; a checkpoint follows once the customer has enough events since the last one
+    def record(self, kind, customer_ID, points, event_time, reference=None, sync=True):
+        with self.lock:
+            self.append(kind, customer_ID, points, event_time, reference, sync=False)
+            if self.since_checkpoint[customer_ID] >= self.CHECKPOINT_EVERY:
+                self.append('checkpoint', customer_ID, self.balances[customer_ID], event_time, sync=False)
+            if sync:
+                self.journal.sync()
+
+    # the points earned and redeemed with an order, as two events
+    def record_order(self, customer_ID, earned, redeemed, order_time, order_number, sync=True):
+        with self.lock:
+            self.append('earn', customer_ID, earned, order_time, order_number, sync=False)
+            if redeemed:
+                self.append('redeem', customer_ID, redeemed, order_time, order_number, sync=False)
+            if self.since_checkpoint[customer_ID] >= self.CHECKPOINT_EVERY:
+                self.append('checkpoint', customer_ID, self.balances[customer_ID], order_time, sync=False)
+            if sync:
+                self.journal.sync()
+
+    # read the balances from the checkpoint and the events after it, before the records are loaded:
+    # read_orders leaves the points of the customers in them alone instead of adding up their orders again
+    def read_balances(self, records):
+        if not self.exists:
+            return
+        start = 0
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as file:
+                start = int(file.readline())
+                for line in file:
+                    customer_ID, balance, since_checkpoint = line.strip().split(",")
+                    self.balances[customer_ID] = int(balance)
+                    self.since_checkpoint[customer_ID] = int(since_checkpoint)
+        for line_number, offset, line in read_lines_in_chunks(self.filename, start=start):
+            try:
+                kind, customer_ID, points, event_time = self.parse_event(line)
+                self.apply(kind, customer_ID, points)
+            except (ValueError, IndexError) as e:
+                records.report_load_error(self.filename, line_number, e)
+        records.reward_balances = self.balances
+
+    # set the reward points of the customers from the ledger, read by read_balances
+    # a new ledger starts with the balances the records were loaded with, as adjust events
+    def load(self, records):
+        now = format_order_time(time.time())
+        if not self.exists:
+            for customer in records.customers:
+                if customer.reward:
+                    self.record('adjust', customer.ID, customer.reward, now, sync=False)
+            self.exists = True
+            self.write_checkpoint()
+            return
+        records.reward_balances = None
+        for customer in records.customers:
+            balance = self.balances.get(customer.ID)
+            if balance is not None:
+                customer.reward = balance
+            elif customer.reward:
+                # a customer the ledger has not seen yet keeps the points it was loaded with
+                self.record('adjust', customer.ID, customer.reward, now, sync=False)
+        self.journal.sync()
+
+    # write every balance and where the ledger ends, so the next start begins from there
+    def write_checkpoint(self):
+        with self.lock:
+            with open(self.checkpoint_file + '.tmp', 'w') as file:
+                file.write(f"{self.size()}\n")
+                for customer_ID, balance in self.balances.items():
+                    file.write(f"{customer_ID},{balance},{self.since_checkpoint.get(customer_ID, 0)}\n")
+            os.replace(self.checkpoint_file + '.tmp', self.checkpoint_file)
+
+    @staticmethod
+    def add_history(history, kind, customer_ID, points, timestamp):
+        entry = history.get(customer_ID)
+        if entry is None:
+            entry = history[customer_ID] = (array('d'), array('q'), array('q'))
+        times, changes, checkpoints = entry
+        if kind == 'checkpoint':
+            checkpoints.append(len(times))
+        times.append(timestamp)
+        changes.append(points)
+
+    def read_history(self, history, start, end):
+        for line_number, offset, line in read_lines_in_chunks(self.filename, start=start, end=end):
+            kind, customer_ID, points, event_time = self.parse_event(line)
+            self.add_history(history, kind, customer_ID, points, parse_order_time(event_time))
+
+    def size(self):
+        self.journal.sync()
+        return os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+
+    # the events of every customer, read the first time a balance at some time is asked for
+    # most of the file is read without the lock so the tills keep recording meanwhile,
+    # then what they added is read under the lock and new events go straight into the history
+    def build_history(self):
+        with self.lock:
+            end = self.size()
+        history = {}
+        self.read_history(history, 0, end)
+        with self.lock:
+            if self.history is None:
+                self.read_history(history, end, self.size())
+                self.history = history
+
+    # the reward points of a customer just after the time, in epoch seconds or as a datetime
+    def balance_at(self, customer_ID, when):
+        if isinstance(when, datetime.datetime):
+            when = when.timestamp()
+        if self.history is None:
+            self.build_history()
+        entry = self.history.get(customer_ID)
+        if entry is None:
+            return 0
+        times, changes, checkpoints = entry
+        last = bisect.bisect_right(times, when)
+        # the last checkpoint before the time, the events after it are added to it
+        c = bisect.bisect_left(checkpoints, last) - 1
+        if c >= 0:
+            first = checkpoints[c]
+            balance = changes[first]
+            first += 1
+        else:
+            first = balance = 0
+        for i in range(first, last):
+            balance += changes[i]
+        return balance
+
+    def sync(self):
+        self.journal.sync()
+
+    def close(self):
+        self.journal.close()
+
+class Records:
+    # compact=True keeps the order histories in one columnar OrderStore instead of lists of dicts
+    # order_cache_size keeps at most that many orders of histories read from disk in memory, see OrderHistoryCache
+    def __init__(self, compact=False, order_cache_size=None):
+        if compact and order_cache_size is not None:
+            raise ValueError("The order cache cannot be used with the compact order store.")
         self.customers = []
-        self.products = {}
+        # the products and their name indexes, see Catalogue
+        self.catalogue = Catalogue()
+        self.order_store = OrderStore() if compact else None
+        self.order_cache = OrderHistoryCache(order_cache_size) if order_cache_size is not None else None
+        # hash indexes so that find_customer/find_product don't scan the whole list
+        self.customer_ids = {}
+        self.customer_names = {}
+        self.customer_names_folded = {}
+        # prefix and fuzzy search over product names and IDs, for suggestions at the till
+        self.product_search = ProductSearchIndex()
+        # every order sorted by time, for date and time windows
+        self.order_times = OrderTimeIndex()
+        # lines that could not be parsed while loading, with file name and line number
+        self.load_errors = []
+        # customer ID -> reward points, set while a RewardLedger that holds the balances is loaded
+        # read_orders then adds the earned rewards of the orders only to the customers that are not in it
+        self.reward_balances = None
+        # lazy order loading: customer ID -> file offsets of the orders not read yet
+        # with an order cache the offsets are kept, so a dropped history can be read again
+        self.pending_orders = {}
+        self.order_files = {}
+        # the Snapshot the records were loaded from, customer ID -> (first order, order count) in it
+        self.snapshot = None
+        self.snapshot_orders = {}
+        # orders made since the order file was last written, as (customer, order)
+        # None when the storage keeps each order as it is made, like SQLiteStorage
+        self.new_orders = []
+        # set by a storage that can look up customers and products that are not in memory,
+        # e.g. ones added by another process sharing an SQLiteStorage
+        self.customer_finder = None
+        self.product_finder = None
+        # sort field -> sorted (sort key, position in customers), and sort field -> sorted (sort key, product ID)
+        # each is built the first time it is listed and kept in order as customers and products are added
+        self.customer_listings = {}
+        self.product_listings = {}
+        # reverse index: product or bundle ID -> IDs of the bundles that contain it
+        self.bundle_parents = {}
+        # bundles whose price and prescription need to be worked out again
+        self.dirty_bundles = set()
+        # numbers for new IDs: Basic and VIP customers share their numbers,
+        # and so do products and bundles, like the IDs in the data files
+        self.customer_numbers = IdAllocator()
+        self.product_numbers = IdAllocator()
+        # several tills can use the same records: lock guards the lists and indexes,
+        # a striped set of locks guards the reward points of each customer,
+        # and change_lock keeps the data files and the journal consistent while saving
+        self.lock = threading.RLock()
+        self.customer_locks = [threading.Lock() for i in range(64)]
+        self.change_lock = SharedLock()
+        # held by whatever changes products, so a bulk import never misses a change made while it runs
+        # it is taken before lock, and a till selling never needs it
+        self.catalogue_lock = threading.RLock()
 
-    def read_customers(self, filename):
+    @property
+    def products(self):
+        return self.catalogue.products
+
+    @property
+    def product_names(self):
+        return self.catalogue.product_names
+
+    @property
+    def product_names_folded(self):
+        return self.catalogue.product_names_folded
+
+    # the lock that guards the reward points of a customer
+    def customer_lock(self, customer):
+        return self.customer_locks[hash(customer.ID) % len(self.customer_locks)]
+
+    # add a customer to the list and keep the ID and name indexes in sync
+    def add_customer(self, customer):
+        with self.lock:
+            if self.order_store is not None:
+                order_history = OrderHistory(self.order_store, len(self.customers))
+                order_history.extend(customer.order_history)
+                customer.order_history = order_history
+            self.customers.append(customer)
+            self.index_customer(customer)
+
+    def index_customer(self, customer):
+        # the first customer with a name keeps it, same as the old linear scan
+        self.customer_ids.setdefault(customer.ID, customer)
+        self.customer_names.setdefault(customer.name, customer)
+        self.customer_names_folded.setdefault(customer.name.casefold(), customer)
+        self.customer_numbers.reserve(customer.ID)
+        # add_customer has just appended the customer
+        for sort, keys in self.customer_listings.items():
+            bisect.insort(keys, (CUSTOMER_LISTING_SORTS[sort](customer), len(self.customers) - 1))
+
+    # add or replace a product in the dict and keep the name indexes in sync
+    def add_product(self, product):
+        with self.lock:
+            old_product = self.products.get(product.product_ID)
+            if isinstance(product, Bundle):
+                self.check_bundle_cycle(product)
+            if old_product is not None:
+                self.unindex_product(old_product)
+                self.unindex_bundle(old_product)
+                pricing.price_changed(old_product)
+            self.products[product.product_ID] = product
+            self.index_product(product)
+            self.index_bundle(product)
+
+    def index_bundle(self, product):
+        if isinstance(product, Bundle):
+            for comp in product.component:
+                self.bundle_parents.setdefault(comp, set()).add(product.product_ID)
+
+    def unindex_bundle(self, product):
+        if isinstance(product, Bundle):
+            for comp in product.component:
+                self.bundle_parents.get(comp, set()).discard(product.product_ID)
+        self.dirty_bundles.discard(product.product_ID)
+
+    # a bundle must not contain itself, directly or through other bundles
+    def check_bundle_cycle(self, bundle):
+        to_check = list(bundle.component)
+        checked = set()
+        while to_check:
+            comp = to_check.pop()
+            if comp == bundle.product_ID:
+                raise InvalidProduct(f"Bundle {bundle.product_ID} contains itself.")
+            if comp in checked:
+                continue
+            checked.add(comp)
+            inner = self.products.get(comp)
+            if isinstance(inner, Bundle):
+                to_check.extend(inner.component)
+
+    # mark every bundle that contains the product, also through nested bundles
+    # dirty is the set to mark them in, the records' dirty bundles by default
+    def mark_bundles_dirty(self, product_ID, dirty=None):
+        dirty = self.dirty_bundles if dirty is None else dirty
+        to_mark = [product_ID]
+        while to_mark:
+            for bundle_ID in self.bundle_parents.get(to_mark.pop(), ()):
+                if bundle_ID not in dirty:
+                    dirty.add(bundle_ID)
+                    to_mark.append(bundle_ID)
+
+    # work out the price and prescription of each dirty bundle exactly once,
+    # inner bundles before the bundles that contain them
+    # a bulk import passes its own dirty bundles and the new catalogue they are priced in
+    def recompute_bundles(self, dirty=None, catalogue=None):
+        own_dirty = dirty is None
+        dirty = self.dirty_bundles if own_dirty else dirty
+        catalogue = self.catalogue if catalogue is None else catalogue
+        done = set()
+        for bundle_ID in list(dirty):
+            self.recompute_bundle(bundle_ID, done, set(), dirty, catalogue)
+        if own_dirty:
+            self.dirty_bundles = set()
+        if metrics.enabled:
+            metrics.count('bundles_recomputed', len(done))
+        return len(done)
+
+    def recompute_bundle(self, bundle_ID, done, visiting, dirty, catalogue):
+        if bundle_ID in done:
+            return
+        if bundle_ID in visiting:
+            raise InvalidProduct(f"Bundle {bundle_ID} contains itself.")
+        visiting.add(bundle_ID)
+        bundle = catalogue.products.get(bundle_ID)
+        for comp in bundle.component:
+            if comp in dirty:
+                self.recompute_bundle(comp, done, visiting, dirty, catalogue)
+        bundle.calculate_price(catalogue)
+        bundle.bundle_prescription(catalogue)
+        visiting.discard(bundle_ID)
+        done.add(bundle_ID)
+
+    def index_product(self, product):
+        self.product_names.setdefault(product.product_name, product)
+        self.product_names_folded.setdefault(product.product_name.casefold(), product)
+        self.product_numbers.reserve(product.product_ID)
+        self.product_search.add(product)
+        for sort, keys in self.product_listings.items():
+            bisect.insort(keys, (PRODUCT_LISTING_SORTS[sort](product), product.product_ID))
+
+    # a new unique customer ID like B5, the number is not used by any Basic or VIP customer
+    def new_customer_id(self, prefix="B"):
+        with self.lock:
+            if not self.customer_numbers.built:
+                self.customer_numbers.rebuild(self.customer_ids)
+            return prefix + str(self.customer_numbers.allocate())
+
+    # a new unique product ID like P7, the number is not used by any product or bundle
+    def new_product_id(self, prefix="P"):
+        with self.lock:
+            if not self.product_numbers.built:
+                self.product_numbers.rebuild(self.products)
+            return prefix + str(self.product_numbers.allocate())
+
+    def unindex_product(self, product):
+        if self.product_names.get(product.product_name) is product:
+            del self.product_names[product.product_name]
+        if self.product_names_folded.get(product.product_name.casefold()) is product:
+            del self.product_names_folded[product.product_name.casefold()]
+        if self.product_search.products.get(product.product_ID) is product:
+            self.product_search.remove(product.product_ID)
+        for sort, keys in self.product_listings.items():
+            key = (PRODUCT_LISTING_SORTS[sort](product), product.product_ID)
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    # rebuild all indexes, e.g. after the lists were changed directly
+    def rebuild_indexes(self):
+        self.customer_numbers = IdAllocator()
+        self.product_numbers = IdAllocator()
+        self.customer_ids = {}
+        self.customer_names = {}
+        self.customer_names_folded = {}
+        self.catalogue = Catalogue(self.products)
+        self.product_search = ProductSearchIndex()
+        self.customer_listings = {}
+        self.product_listings = {}
+        self.order_times = OrderTimeIndex()
+        for customer in self.customers:
+            self.index_customer(customer)
+        self.bundle_parents = {}
+        for product in self.products.values():
+            self.index_product(product)
+            self.index_bundle(product)
+
+    # check a whole price file in one pass, see parse_price_line for the lines
+    # returns the changes as [(product or None for a new one, name, price, needs prescription)] and the errors
+    def read_price_file(self, filename, catalogue):
+        changes = []
+        errors = []
+        listed = set()
+        for line_number, offset, line in read_lines_in_chunks(filename):
+            try:
+                identifier, price, dr_prescription = parse_price_line(line)
+                product = self.find_product(identifier, catalogue)
+                if isinstance(product, Bundle):
+                    raise ValueError(f"{identifier} is a bundle, its price comes from its components.")
+                key = product.product_ID if product is not None else identifier.casefold()
+                if key in listed:
+                    raise ValueError(f"{identifier} is listed more than once.")
+                listed.add(key)
+                changes.append((product, identifier, price, dr_prescription))
+            except ValueError as e:
+                errors.append(f"{filename} line {line_number}: {e}")
+        return changes, errors
+
+    # a new catalogue with the changes applied, the live one is not touched
+    # each changed product and each bundle that contains one is a new object, and every
+    # such bundle is priced once after all the products are in
+    # returns the new catalogue and the new and changed products and bundles
+    def build_catalogue(self, changes):
+        live = self.catalogue
+        catalogue = live.copy()
+        changed = []
+        dirty = set()
+        for product, name, price, dr_prescription in changes:
+            if product is None:
+                product = Product(self.new_product_id(), name, price, dr_prescription)
+            elif product.unit_price != price or product.dr_prescription != dr_prescription:
+                product = Product(product.product_ID, product.product_name, price, dr_prescription)
+            else:
+                continue
+            catalogue.replace(product)
+            changed.append(product)
+            self.mark_bundles_dirty(product.product_ID, dirty)
+        for bundle_ID in dirty:
+            bundle = live.products[bundle_ID]
+            bundle = Bundle(bundle_ID, bundle.product_name, bundle.component, bundle.unit_price)
+            catalogue.replace(bundle)
+            changed.append(bundle)
+        self.recompute_bundles(dirty, catalogue)
+        return catalogue, changed
+
+    # replace the catalogue with a new version in one step
+    # the search index and the product listings are built again from it the next time they are used
+    def swap_catalogue(self, catalogue):
+        product_search = ProductSearchIndex()
+        for product in catalogue.products.values():
+            product_search.add(product)
+        with self.lock:
+            live = self.catalogue
+            self.catalogue = catalogue
+            self.product_search = product_search
+            self.product_listings = {}
+        # the old objects are never priced again once the tills still using them are done
+        for product_ID, product in live.products.items():
+            if catalogue.products.get(product_ID) is not product:
+                pricing.price_changed(product)
+
+    # apply a whole price file at once, or nothing if any line of it is wrong
+    # returns the new and changed products and bundles, and the errors
+    def import_prices(self, filename):
+        with self.catalogue_lock:
+            changes, errors = self.read_price_file(filename, self.catalogue)
+            if errors:
+                return [], errors
+            catalogue, changed = self.build_catalogue(changes)
+            self.swap_catalogue(catalogue)
+        if metrics.enabled:
+            metrics.count('prices_imported', len(changes))
+        return changed, errors
+
+    # report a line that cannot be parsed, keep loading the rest of the file
+    def report_load_error(self, filename, line_number, error):
+        message = f"{filename} line {line_number}: {error}"
+        self.load_errors.append(message)
+        print(f"Skip invalid line. {message}")
+
+    def read_customers(self, filename, chunk_size=1 << 20):
         try:
-            with open(filename, 'r') as file:
-                for line in file:
-                    data = line.strip().split(",")
-                    if data[0].startswith('B'): # B as "BasicCustomer: ID, name, rewad_rate, reward".... 
-                        customer = BasicCustomer(data[0].strip(), data[1].strip(),int(data[3].strip()))
-                    elif data[0].startswith('V'): # # V as "VIPCustomer: ID, name, reward_rate, discount_rate, reward".... 
-                        customer = VIPCustomer(ID = data[0].strip(), name = data[1].strip(),reward = int(data[4].strip()),discount_rate=float(data[3].strip()))
-                    self.customers.append(customer)
+            for line_number, offset, line in read_lines_in_chunks(filename, chunk_size):
+                try:
+                    customer = parse_customer_line(line)
+                    self.add_customer(customer)
+                except (ValueError, IndexError) as e:
+                    self.report_load_error(filename, line_number, e)
         except FileNotFoundError:
             print(f"Customer file {filename} not found.")
         
-    def read_products(self, filename):
+    def read_products(self, filename, chunk_size=1 << 20):
         try:
-            with open(filename,'r') as file:
-                for line in file:
-                    data = [item.strip() for item in line.strip().split(",")] # to avoid the space in the string
-                    if data[0].startswith('P'): # as a regular product
-                        dr_prescription = True if data[3].strip().lower() == 'y' else False
-                        product = Product(data[0].strip(), data[1].strip(), float(data[2].strip()),dr_prescription)
-                        self.products[data[0]] = product
-                    elif data[0].startswith('B'): # as a bundle
-                        product = Bundle(data[0].strip(), data[1].strip(), data[2:])
-                        product.calculate_price(self)
-                        product.bundle_prescription(self)
-                        self.products[data[0]] = product
+            for line_number, offset, line in read_lines_in_chunks(filename, chunk_size):
+                try:
+                    product = parse_product_line(line)
+                    self.add_product(product)
+                    if isinstance(product, Bundle):
+                        self.dirty_bundles.add(product.product_ID)
+                except (ValueError, IndexError, InvalidProduct) as e:
+                    self.report_load_error(filename, line_number, e)
         except FileNotFoundError:
             print(f"Product file {filename} not found.")
+        # bundles can contain products or bundles listed later in the file, so price them at the end
+        self.recompute_bundles()
     
     # read orders from the file and update the customer's order history and reward points
-    def read_orders(self, filename):
+    # in lazy mode only the rewards are applied now, the order history of a customer is
+    # read from the file the first time it is used
+    def read_orders(self, filename, lazy=False, chunk_size=1 << 20):
+        # the orders read here do not go through add_order, so the time index is built again when next used
+        self.order_times = OrderTimeIndex()
+        add_rewards = self.reward_balances is None
         try:
-            with open(filename, 'r') as file:
-                for line in file:
-                    data = line.strip().split(",")
-                    customer_identifier = data[0].strip()
+            for line_number, offset, line in read_lines_in_chunks(filename, chunk_size):
+                try:
+                    # the last three fields are total cost, earned rewards and order time
+                    head, total_cost, earned_rewards, order_time = line.rsplit(",", 3)
+                    customer_identifier = head.split(",", 1)[0]
                     customer = self.find_customer(customer_identifier)
                     # assume that customer name in the file is existing in the customer list
-                    if customer is not None:
-                        products = []
-                        for i in range(1, len(data)-3,2):
-                            product_identifier = data[i].strip()
-                            quantity = int(data[1+1].strip())
-                            product = self.find_product(product_identifier)
-                            if product is not None:
-                                products.append((product.product_name, product.unit_price, quantity))
-                        total_cost =float(data[-3].strip())
-                        earned_rewards = int(data[-2].strip())
-                        order_time = data[-1].strip()
-                        order = {
-                            'products': products,
-                            'total_cost': total_cost,
-                            'earned_rewards': earned_rewards,
-                            'order_time': order_time
-                        }
-                        customer.order_history.append(order)
+                    if customer is None:
+                        continue
+                    earned_rewards = int(earned_rewards.strip())
+                    total_cost = float(total_cost.strip())
+                    if lazy:
+                        self.pending_orders.setdefault(customer.ID, array('q')).append(offset)
+                        customer.order_loader = self.load_pending_orders
+                        self.order_files[customer.ID] = filename
+                    else:
+                        customer.order_history.append(self.parse_order_line(line))
+                    customer.add_order_totals(total_cost, earned_rewards, order_time.strip())
+                    # the customer file holds the points from before the orders, see format_saved_customer_line
+                    # with a reward ledger only the customers it has no balance for get them, once at the end
+                    if add_rewards:
                         customer.update_reward(earned_rewards)
-        except Exception:
-            print("Cannot load the order file.")
+                except (ValueError, IndexError) as e:
+                    self.report_load_error(filename, line_number, e)
+        except FileNotFoundError:
+            print(f"Order file {filename} not found.")
+        if not add_rewards:
+            for customer in self.customers:
+                if customer.ID not in self.reward_balances:
+                    customer.update_reward(customer.lifetime_rewards)
+
+    # turn one order line into an order dict, products are resolved by name or ID
+    def parse_order_line(self, line):
+        data = line.split(",")
+        products = []
+        for i in range(1, len(data)-3,2):
+            product_identifier = data[i].strip()
+            quantity = int(data[i+1].strip())
+            product = self.find_product(product_identifier)
+            if product is not None:
+                products.append((product.product_name, product.unit_price, quantity))
+        order = {
+            'products': products,
+            'total_cost': float(data[-3].strip()),
+            'earned_rewards': int(data[-2].strip()),
+            'order_time': data[-1].strip(),
+            'timestamp': parse_order_time(data[-1].strip())
+        }
+        return order
+
+    # materialize the order history of a customer loaded in lazy mode
+    # the loader is only cleared once the whole history is read, so other tills wait for it
+    def load_pending_orders(self, customer):
+        with self.lock:
+            if customer.order_loader != self.load_pending_orders:
+                return
+            if self.order_cache is None:
+                offsets = self.pending_orders.pop(customer.ID, [])
+                filename = self.order_files.pop(customer.ID, None)
+            else:
+                offsets = self.pending_orders.get(customer.ID, [])
+                filename = self.order_files.get(customer.ID)
+            if offsets:
+                order_history = customer._Customer__order_history
+                with open(filename, 'rb') as file:
+                    for offset in offsets:
+                        file.seek(offset)
+                        line = file.readline().decode('utf-8').strip()
+                        order_history.append(self.parse_order_line(line))
+            self.cache_order_history(customer)
+
+    # put a history that was just read from disk in the order cache, or keep it for good without one
+    def cache_order_history(self, customer, miss=True):
+        if self.order_cache is None:
+            customer.order_loader = None
+            return
+        customer.order_loader = self.touch_order_history
+        for evicted in self.order_cache.add(customer, len(customer._Customer__order_history), miss):
+            evicted.order_history = []
+            if evicted.ID in self.snapshot_orders:
+                evicted.order_loader = self.load_snapshot_orders
+            else:
+                evicted.order_loader = self.load_pending_orders
+
+    # the loader of a cached history, it only marks the history as used
+    def touch_order_history(self, customer):
+        with self.lock:
+            if customer in self.order_cache:
+                self.order_cache.hit(customer)
+
+    # a history that gets an order that is not on disk yet must stay in memory
+    def pin_order_history(self, customer):
+        if self.order_cache is not None and customer in self.order_cache:
+            self.order_cache.remove(customer)
+            customer.order_loader = None
+
+    # load the customers and products from a Snapshot, the order history of a customer
+    # is read from the snapshot the first time it is used
+    def read_snapshot(self, snapshot):
+        BasicCustomer.set_reward_rate(snapshot.basic_reward_rate)
+        VIPCustomer.set_reward_rate(snapshot.vip_reward_rate)
+        strings = snapshot.read_strings('strings')
+        for (kind, ID, name, last_order_time, reward, discount_rate, first_order, order_count,
+             lifetime_spend, lifetime_rewards) in snapshot.customers():
+            if kind == 1:
+                customer = VIPCustomer(strings[ID], strings[name], reward, discount_rate)
+            else:
+                customer = BasicCustomer(strings[ID], strings[name], reward)
+            self.add_customer(customer)
+            customer.order_count = order_count
+            customer.lifetime_spend = lifetime_spend
+            customer.lifetime_rewards = lifetime_rewards
+            customer.last_order_time = strings[last_order_time] if last_order_time >= 0 else None
+            if order_count:
+                self.snapshot_orders[customer.ID] = (first_order, order_count)
+                customer.order_loader = self.load_snapshot_orders
+        components = snapshot.components
+        for kind, dr_prescription, ID, name, unit_price, component_start, component_count in snapshot.products():
+            if kind == 1:
+                component = [strings[number] for number in components[component_start:component_start + component_count]]
+                product = Bundle(strings[ID], strings[name], component, unit_price)
+                # bundles are saved with their price and prescription already worked out
+                product._Bundle__dr_prescription = dr_prescription
+            else:
+                product = Product(strings[ID], strings[name], unit_price, dr_prescription)
+            self.add_product(product)
+        self.snapshot = snapshot
+        self.order_times = OrderTimeIndex()
+
+    # materialize the order history of a customer loaded from a snapshot
+    def load_snapshot_orders(self, customer):
+        with self.lock:
+            if customer.order_loader != self.load_snapshot_orders:
+                return
+            if self.order_cache is None:
+                first_order, order_count = self.snapshot_orders.pop(customer.ID, (0, 0))
+            else:
+                first_order, order_count = self.snapshot_orders.get(customer.ID, (0, 0))
+            order_history = customer._Customer__order_history
+            for number in range(first_order, first_order + order_count):
+                order_history.append(self.snapshot.get(number))
+            self.cache_order_history(customer)
 
-    # check if the customer exists in the list
+    # check if the customer exists, by ID first, then exact name, then case-folded name
     def find_customer(self, search_value):
         search_value = search_value.strip()
-        for customer in self.customers:
-            if customer.name == search_value or customer.ID == search_value:
-                return customer
-        return None
+        customer = self.customer_ids.get(search_value)
+        if customer is None:
+            customer = self.customer_names.get(search_value)
+        if customer is None:
+            customer = self.customer_names_folded.get(search_value.casefold())
+        if customer is None and self.customer_finder is not None:
+            customer = self.customer_finder(search_value)
+        return customer
     
-    # check if the product exists in the list
-    def find_product(self, search_value):
+    # check if the product exists, by ID first, then exact name, then case-folded name
+    # catalogue: the version to look in, so that a whole basket is priced from one version
+    def find_product(self, search_value, catalogue=None):
+        catalogue = self.catalogue if catalogue is None else catalogue
         search_value = search_value.strip()
-        for product in self.products.values():
-            if hasattr(product, 'product_name') and (product.product_name == search_value or product.product_ID == search_value):
-                return product
-        return None
+        product = catalogue.products.get(search_value)
+        if product is None:
+            product = catalogue.product_names.get(search_value)
+        if product is None:
+            product = catalogue.product_names_folded.get(search_value.casefold())
+        if product is None and self.product_finder is not None:
+            product = self.product_finder(search_value)
+        return product
     
-    # display the information of all customers
-    def list_customers(self):
-        for customer in self.customers:
-            customer.display_info()
+    # products that start with the text or are spelt almost like it, for suggestions at the till
+    def search_products(self, text, limit=5):
+        with self.lock:
+            return self.product_search.search(text, limit)
 
-    # display the information of all products
-    def list_products(self):
-        for product in self.products.values():
-            product.display_info()
+    # the customers or products in the order of one field, sorted the first time they are listed that way
+    def customer_listing(self, sort):
+        with self.lock:
+            keys = self.customer_listings.get(sort)
+            if keys is None:
+                sort_key = CUSTOMER_LISTING_SORTS[sort]
+                keys = self.customer_listings[sort] = sorted((sort_key(customer), position) for position, customer in enumerate(self.customers))
+            return keys
+
+    def product_listing(self, sort):
+        with self.lock:
+            keys = self.product_listings.get(sort)
+            if keys is None:
+                sort_key = PRODUCT_LISTING_SORTS[sort]
+                keys = self.product_listings[sort] = sorted((sort_key(product), ID) for ID, product in self.products.items())
+            return keys
+
+    # Yield (cursor, customer) in the order of sort ('ID' or 'name'), only Basic or VIP customers
+    # if kind is 'basic' or 'vip'. Starts after cursor, the cursor of the last customer seen, so
+    # a listing can go on later from where it stopped even if customers were added in between.
+    def iter_customers(self, kind=None, sort='ID', cursor=None):
+        matches = CUSTOMER_FILTERS[kind] if kind else None
+        for key in self.iter_listing(self.customer_listing(sort), cursor):
+            customer = self.customers[key[1]]
+            if matches is None or matches(customer):
+                yield key, customer
+
+    # the same for products, kind is 'product', 'bundle' or 'prescription' for the ones that need one
+    def iter_products(self, kind=None, sort='ID', cursor=None):
+        matches = PRODUCT_FILTERS[kind] if kind else None
+        for key in self.iter_listing(self.product_listing(sort), cursor):
+            product = self.products.get(key[1])
+            if product is not None and (matches is None or matches(product)):
+                yield key, product
+
+    # the keys after cursor, a batch at a time: the place is found again from the last key
+    # for each batch, so keys added or removed by other tills meanwhile are never skipped or repeated
+    def iter_listing(self, keys, cursor, batch_size=64):
+        while True:
+            with self.lock:
+                start = bisect.bisect_right(keys, cursor) if cursor is not None else 0
+                batch = keys[start:start + batch_size]
+            if not batch:
+                return
+            yield from batch
+            cursor = batch[-1]
+
+    # display one page of customers or products and return the cursor of the next page, None after the last one
+    # only the page is looked at, so a page of a huge catalogue shows as fast as one of a small one
+    def list_page(self, items, page_size=20):
+        cursor = None
+        for count, (key, item) in enumerate(items):
+            if page_size and count == page_size:
+                return cursor
+            item.display_info()
+            cursor = key
+        return None
+
+    # display the information of the customers, see iter_customers
+    def list_customers(self, kind=None, sort='ID', cursor=None, page_size=None):
+        return self.list_page(self.iter_customers(kind, sort, cursor), page_size)
+
+    # display the information of the products, see iter_products
+    def list_products(self, kind=None, sort='ID', cursor=None, page_size=None):
+        return self.list_page(self.iter_products(kind, sort, cursor), page_size)
+
+    # (time, customer, number in the history) of every order, taken from wherever each history is:
+    # the snapshot's time column, the order file for histories that were not read yet, or memory
+    def order_time_entries(self):
+        files = {}
+        try:
+            for customer in self.customers:
+                loader = customer.order_loader
+                if loader is not None and loader == self.load_snapshot_orders:
+                    first_order, order_count = self.snapshot_orders.get(customer.ID, (0, 0))
+                    times = self.snapshot.order_time
+                    for number in range(order_count):
+                        yield float(times[first_order + number]), customer, number
+                elif loader is not None and loader == self.load_pending_orders:
+                    filename = self.order_files.get(customer.ID)
+                    if filename not in files:
+                        files[filename] = open(filename, 'rb')
+                    file = files[filename]
+                    for number, offset in enumerate(self.pending_orders.get(customer.ID, ())):
+                        file.seek(offset)
+                        order_time = file.readline().decode('utf-8').rsplit(",", 1)[1].strip()
+                        yield parse_order_time(order_time), customer, number
+                else:
+                    for number, order in enumerate(customer.order_history):
+                        yield order_timestamp(order), customer, number
+        finally:
+            for file in files.values():
+                file.close()
+
+    # one order of a customer, read on its own when the history is not in memory
+    def get_order(self, customer, number):
+        with self.lock:
+            loader = customer.order_loader
+            if loader is not None and loader == self.load_snapshot_orders:
+                return self.snapshot.get(self.snapshot_orders[customer.ID][0] + number)
+            if loader is not None and loader == self.load_pending_orders:
+                with open(self.order_files[customer.ID], 'rb') as file:
+                    file.seek(self.pending_orders[customer.ID][number])
+                    return self.parse_order_line(file.readline().decode('utf-8').strip())
+            return customer.order_history[number]
+
+    # the orders from start up to but not including end as (customer, order), oldest first
+    # start and end are epoch seconds or datetimes; only the orders in the window are read
+    def orders_between(self, start, end):
+        if isinstance(start, datetime.datetime):
+            start = start.timestamp()
+        if isinstance(end, datetime.datetime):
+            end = end.timestamp()
+        with self.lock:
+            if not self.order_times.built:
+                self.order_times.build(self.order_time_entries())
+            found = self.order_times.between(start, end)
+        for customer, number in found:
+            yield customer, self.get_order(customer, number)
+
+    # add a new order to the customer's history, it still needs to be written to the order file
+    def add_order(self, customer, order):
+        with self.lock:
+            customer.order_history.append(order)
+            self.pin_order_history(customer)
+            if self.order_times.built:
+                self.order_times.add(order_timestamp(order), customer, len(customer.order_history) - 1)
+            customer.add_order_totals(order['total_cost'], order['earned_rewards'], order['order_time'])
+            if self.new_orders is not None:
+                self.new_orders.append((customer, order))
 
     # save the information of customers, products, and orders into the file
+    # the files are written to a temporary file first so a crash never leaves half a file
     def save_customers(self, filename):
-        with open(filename, 'w') as file:
+        with open(filename + '.tmp', 'w') as file:
             for customer in self.customers:
-                if isinstance(customer, BasicCustomer):
-                    file.write(f"{customer.ID},{customer.name},{BasicCustomer.get_reward_rate()},{customer.reward}\n")
-                elif isinstance(customer, VIPCustomer):
-                    file.write(f"{customer.ID},{customer.name},{VIPCustomer.get_reward_rate()},{customer.discount_rate},{customer.reward}\n")
+                file.write(format_saved_customer_line(customer) + "\n")
+            if metrics.enabled:
+                metrics.count('bytes_written', file.tell())
+        os.replace(filename + '.tmp', filename)
     
     def save_products(self, filename):
-        with open(filename, 'w') as file:
+        with open(filename + '.tmp', 'w') as file:
             for product in self.products.values():
-                # check if the product is a regular product or a bundle
-                if type(product) == Product: # to aviod the bundle class be added into the regular product list
-                    file.write(f"{product.product_ID},{product.product_name},{product.unit_price},{'y' if product.dr_prescription else 'n'}\n")
-                elif isinstance(product, Bundle):
-                    components = ','.join(product.component)
-                    file.write(f"{product.product_ID},{product.product_name},{components}\n")
+                file.write(format_product_line(product) + "\n")
+            if metrics.enabled:
+                metrics.count('bytes_written', file.tell())
+        os.replace(filename + '.tmp', filename)
 
     def save_orders(self, filename):
-        with open(filename, 'w') as file:
+        # orders loaded lazily must be read before the file is overwritten
+        for customer in self.customers:
+            customer.order_history
+        with open(filename + '.tmp', 'w') as file:
             for customer in self.customers:
                 for order in customer.order_history:
-                    products = ','.join([f"{product[0]},{product[2]}" for product in order['products']])
-                    total_cost = order['total_cost']
-                    earned_rewards = order['earned_rewards']
-                    order_time = order['order_time']
-                    file.write(f"{customer.ID},{products},{total_cost:.2f},{earned_rewards},{order_time}\n")
+                    file.write(format_order_line(customer, order) + "\n")
+            if metrics.enabled:
+                metrics.count('bytes_written', file.tell())
+        os.replace(filename + '.tmp', filename)
+        self.new_orders = []
+
+    # only add the new orders to the end of the order file, the history is never rewritten
+    # with staging the orders are written to that file instead, to be added to the end of the order file
+    # by the caller, who then calls orders_appended(); the offsets kept for the order cache are where
+    # the orders will be in the order file. Returns the size of the order file before the new orders.
+    def append_orders(self, filename, staging=None):
+        if staging is None:
+            file = open(filename, 'ab')
+            start = file.tell()
+        else:
+            file = open(staging, 'wb')
+            start = os.path.getsize(filename) if os.path.exists(filename) else 0
+        with file:
+            offset = start
+            for customer, order in self.new_orders:
+                line = (format_order_line(customer, order) + "\n").encode('utf-8')
+                file.write(line)
+                if self.order_cache is not None:
+                    self.add_pending_order(customer, filename, offset)
+                offset += len(line)
+            if metrics.enabled:
+                metrics.count('bytes_written', offset - start)
+        if staging is None:
+            self.orders_appended()
+        return start
+
+    # the new orders are in the order file now
+    def orders_appended(self):
+        if self.order_cache is not None:
+            self.cache_written_histories({customer for customer, order in self.new_orders})
+        self.new_orders = []
+
+    # remember where a new order was written, so that the history can be read again once it is dropped
+    # histories that start in the snapshot or in another file cannot be read from this one
+    def add_pending_order(self, customer, filename, offset):
+        if customer.ID in self.snapshot_orders or self.order_files.setdefault(customer.ID, filename) != filename:
+            return
+        self.pending_orders.setdefault(customer.ID, array('q')).append(offset)
+
+    # histories kept in memory because they had new orders can go in the order cache once every order is on disk
+    def cache_written_histories(self, customers):
+        with self.lock:
+            for customer in customers:
+                if (customer.order_loader is None and customer.ID in self.pending_orders
+                        and len(self.pending_orders[customer.ID]) == len(customer._Customer__order_history)):
+                    self.cache_order_history(customer, miss=False)
+
+class TextStorage:
+    # Keeps the records in the flat data files. Changes go to the journal first and are folded into
+    # the data files by compact(); the binary snapshot makes starting up fast.
+    # Operations works with any storage that has the same methods, see SQLiteStorage.
+    def __init__(self, customer_file="customers.txt", product_file="products.txt", order_file="orders.txt", lazy_orders=False,
+                 journal_file=None, use_snapshot=True, snapshot_file=None):
+        self.customer_file = customer_file
+        self.product_file = product_file
+        # new orders are appended to the order file even if it was not loaded,
+        # by default the one next to the customer file like the journal and the snapshot
+        self.order_file = order_file or os.path.join(os.path.dirname(customer_file), "orders.txt")
+        self.read_order_file = bool(order_file)
+        self.lazy_orders = lazy_orders
+        # by default the journal and the snapshot are kept next to the customer file
+        if journal_file is None:
+            journal_file = os.path.join(os.path.dirname(customer_file), "journal.txt")
+        self.journal = Journal(journal_file)
+        # written while a compaction puts its files in place, see compact()
+        self.compaction_file = journal_file + ".compact"
+        if snapshot_file is None:
+            snapshot_file = os.path.join(os.path.dirname(customer_file), "snapshot.bin")
+        # the snapshot holds the orders too, so it is only used when the order file is loaded
+        self.snapshot_file = snapshot_file if use_snapshot and order_file else None
+        # the data files were rewritten since the snapshot was, see close()
+        self.snapshot_stale = False
+        self.records = None
+
+    # the number of changes that are not in the data files yet
+    @property
+    def count(self):
+        return self.journal.count
+
+    def load(self, records):
+        self.records = records
+        self.finish_compaction()
+        if not self.read_snapshot():
+            records.read_customers(self.customer_file)
+            records.read_products(self.product_file)
+            if self.read_order_file:
+                records.read_orders(self.order_file, lazy=self.lazy_orders)
+            # write the snapshot now so that the next start is fast
+            self.write_snapshot()
+        self.replay_journal()
+
+    def data_files(self):
+        return [self.customer_file, self.product_file, self.order_file]
+
+    # start from the binary snapshot if it was written from the data files as they are now
+    def read_snapshot(self):
+        if self.snapshot_file is None or not os.path.exists(self.snapshot_file):
+            return False
+        try:
+            snapshot = Snapshot(self.snapshot_file)
+        except (ValueError, OSError) as e:
+            print(f"Skip snapshot {self.snapshot_file}: {e}")
+            return False
+        if not snapshot.matches(self.data_files()):
+            snapshot.close()
+            return False
+        self.records.read_snapshot(snapshot)
+        return True
+
+    # the snapshot needs every order history, so none is written when they are left on disk
+    def write_snapshot(self):
+        if self.snapshot_file is None or self.lazy_orders:
+            return
+        try:
+            write_snapshot(self.records, self.snapshot_file, self.data_files())
+        except (ValueError, OSError) as e:
+            # the text files are still complete, the next start just reads them again
+            print(f"Could not write snapshot {self.snapshot_file}: {e}")
+
+    # apply the changes in the journal that are not in the data files yet
+    def replay_journal(self):
+        for line_number, kind, value in self.journal.read():
+            try:
+                if kind == 'customer':
+                    self.records.add_customer(parse_customer_line(value))
+                elif kind == 'product':
+                    self.apply_product(parse_product_line(value))
+                elif kind == 'order': # "order,reward change,order line"
+                    reward_change, order_line = value.split(",", 1)
+                    customer = self.records.find_customer(order_line.split(",", 1)[0])
+                    if customer is not None:
+                        self.records.add_order(customer, self.records.parse_order_line(order_line))
+                        customer.update_reward(int(reward_change))
+                elif kind == 'reward': # "reward,customer ID,points added"
+                    customer_ID, points = value.split(",")
+                    customer = self.records.find_customer(customer_ID)
+                    if customer is not None:
+                        customer.update_reward(int(points))
+                elif kind == 'reward_rate':
+                    BasicCustomer.set_reward_rate(float(value))
+                elif kind == 'discount_rate': # "discount_rate,customer ID,rate"
+                    customer_ID, rate = value.split(",")
+                    customer = self.records.find_customer(customer_ID)
+                    if customer is not None:
+                        customer.set_discount_rate(float(rate))
+                else:
+                    raise ValueError(f"Unknown journal entry: {kind}")
+            except (ValueError, IndexError) as e:
+                self.records.report_load_error(self.journal.filename, line_number, e)
+
+    # add a product from the journal, or update it if it is already in the records
+    def apply_product(self, product):
+        existing = self.records.products.get(product.product_ID)
+        if type(product) == Product and type(existing) == Product:
+            existing.set_unit_price(product.unit_price)
+            existing._Product__dr_prescription = product.dr_prescription
+            self.records.mark_bundles_dirty(existing.product_ID)
+        else:
+            self.records.add_product(product)
+            if isinstance(product, Bundle):
+                self.records.dirty_bundles.add(product.product_ID)
+            self.records.mark_bundles_dirty(product.product_ID)
+        self.records.recompute_bundles()
+
+    # one change as "kind,value", see replay_journal for the kinds
+    # sync=False leaves writing to disk to a later sync(), used for batches
+    def log_change(self, kind, value, sync=True):
+        self.journal.append(kind, value, sync=sync)
+
+    # the order is already in the customer's history, only the journal needs it
+    def record_order(self, customer, order, reward_change, sync=True):
+        self.journal.append('order', f"{reward_change},{format_order_line(customer, order)}", sync=sync)
+
+    # the text files have no transactions, the locks in Records keep the tills apart
+    def transaction(self, customer=None):
+        return contextlib.nullcontext()
+
+    # every order of every customer as (customer, order), in the order of the customer list
+    def all_orders(self):
+        for customer in self.records.customers:
+            for order in customer.order_history:
+                yield customer, order
+
+    # make sure every change logged so far is on disk
+    def sync(self):
+        self.journal.sync()
+
+    # write the data files and empty the journal, the order file is only appended to
+    # the snapshot is written once when the storage is closed, not every time the journal is folded in
+    # The new files and orders are staged next to the data files first. Once they are all on disk the marker
+    # file is written with the size of the order file before the new orders: from then on the compaction
+    # is finished by finish_compaction(), here or on the next start after a crash, and the journal is only
+    # emptied after every data file is in place. A crash before the marker leaves the data files as they were.
+    def compact(self):
+        self.records.save_customers(self.staged(self.customer_file))
+        self.records.save_products(self.staged(self.product_file))
+        start = self.records.append_orders(self.order_file, staging=self.staged(self.order_file))
+        for filename in self.data_files():
+            sync_file(self.staged(filename))
+        with open(self.compaction_file + '.tmp', 'w') as file:
+            file.write(f"{start}\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.compaction_file + '.tmp', self.compaction_file)
+        self.finish_compaction()
+        self.records.orders_appended()
+        self.snapshot_stale = True
+
+    # the file a data file is written to before it replaces it
+    @staticmethod
+    def staged(filename):
+        return filename + '.compact'
+
+    # put the staged files of a compaction in place once its marker is written, and empty the journal
+    # the order file is cut back to its size before the compaction first, so this can be done again
+    # any number of times after a crash without adding an order twice
+    def finish_compaction(self):
+        if not os.path.exists(self.compaction_file):
+            # a compaction stopped before its marker, the data files and the journal are as they were
+            for filename in self.data_files():
+                if os.path.exists(self.staged(filename)):
+                    os.remove(self.staged(filename))
+            return
+        with open(self.compaction_file) as file:
+            start = int(file.read())
+        with open(self.order_file, 'ab') as order_file, open(self.staged(self.order_file), 'rb') as new_orders:
+            order_file.truncate(start)
+            shutil.copyfileobj(new_orders, order_file)
+            order_file.flush()
+            os.fsync(order_file.fileno())
+        for filename in (self.customer_file, self.product_file):
+            if os.path.exists(self.staged(filename)):
+                os.replace(self.staged(filename), filename)
+        self.journal.clear()
+        os.remove(self.compaction_file)
+        os.remove(self.staged(self.order_file))
+
+    # a snapshot must hold just what the data files hold, so with changes left in the journal
+    # it is not written here; the next start then reads the text files and writes it
+    def close(self):
+        self.journal.close()
+        if self.snapshot_stale and self.journal.count == 0:
+            self.write_snapshot()
+            self.snapshot_stale = False
+
+class SQLiteOrderHistory:
+    # The order history of one customer kept in an SQLiteStorage, read with indexed queries
+    # instead of being held in memory. It behaves like the list of order dicts: append, len, index and iterate.
+    __slots__ = ('storage', 'customer_ID')
+    def __init__(self, storage, customer_ID):
+        self.storage = storage
+        self.customer_ID = customer_ID
+
+    def append(self, order):
+        self.storage.insert_order(self.customer_ID, order)
+
+    def extend(self, orders):
+        for order in orders:
+            self.append(order)
+
+    def __len__(self):
+        return self.storage.order_count(self.customer_ID)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        orders = self.storage.read_orders("WHERE customer_id = ? ORDER BY id LIMIT 1 OFFSET ?", (self.customer_ID, index)) if index >= 0 else []
+        if not orders:
+            raise IndexError("order history index out of range")
+        return orders[0][1]
+
+    def __iter__(self):
+        for customer_ID, order in self.storage.read_orders("WHERE customer_id = ? ORDER BY id", (self.customer_ID,)):
+            yield order
+
+class SQLiteStorage:
+    # Keeps the records in an SQLite database instead of the text files, with the same methods as TextStorage.
+    # Customers and products are still held in memory for fast lookups, but the order histories stay in
+    # the database, so memory does not grow with the number of orders. Each change is committed straight
+    # away and a purchase commits the order and the reward points in one transaction.
+    # Several processes can share one database: a purchase reads the customer's points inside its
+    # transaction, and customers or products added by another process are found by find_customer/find_product.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS customers (
+            row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, kind TEXT NOT NULL, name TEXT NOT NULL,
+            name_folded TEXT NOT NULL, reward INTEGER NOT NULL, discount_rate REAL);
+        CREATE INDEX IF NOT EXISTS customers_name ON customers (name);
+        CREATE INDEX IF NOT EXISTS customers_name_folded ON customers (name_folded);
+        CREATE TABLE IF NOT EXISTS products (
+            row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, kind TEXT NOT NULL, name TEXT NOT NULL,
+            name_folded TEXT NOT NULL, unit_price REAL NOT NULL, prescription INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS products_name ON products (name);
+        CREATE INDEX IF NOT EXISTS products_name_folded ON products (name_folded);
+        CREATE TABLE IF NOT EXISTS bundle_components (
+            bundle_id TEXT NOT NULL, position INTEGER NOT NULL, component_id TEXT NOT NULL,
+            PRIMARY KEY (bundle_id, position)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS bundle_components_component ON bundle_components (component_id);
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY, customer_id TEXT NOT NULL, total_cost REAL NOT NULL,
+            earned_rewards INTEGER NOT NULL, order_time TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS orders_customer ON orders (customer_id, id);
+        CREATE TABLE IF NOT EXISTS order_lines (
+            order_id INTEGER NOT NULL, position INTEGER NOT NULL, product_name TEXT NOT NULL,
+            unit_price REAL NOT NULL, quantity INTEGER NOT NULL,
+            PRIMARY KEY (order_id, position)) WITHOUT ROWID;
+    """
+    CUSTOMER_COLUMNS = "row, id, kind, name, reward, discount_rate"
+    PRODUCT_COLUMNS = "id, kind, name, unit_price, prescription"
+    # with MAX(id) SQLite takes order_time from the last order
+    ORDER_TOTALS = "COUNT(*), SUM(total_cost), SUM(earned_rewards), MAX(id), order_time"
+
+    def __init__(self, filename="pharmacy.db"):
+        self.filename = filename
+        # transactions are started by hand, the connection is shared by the tills under records.lock
+        self.connection = sqlite3.connect(filename, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        self.in_transaction = False
+        # the last customer row read, rows after it were added by another process
+        self.last_customer_row = 0
+        self.records = None
+        # there is never anything to compact, every change is in the database already
+        self.count = 0
+
+    def is_empty(self):
+        return self.connection.execute("SELECT COUNT(*) FROM customers").fetchone()[0] == 0
+
+    def load(self, records):
+        self.records = records
+        records.new_orders = None
+        records.customer_finder = self.find_customer
+        records.product_finder = self.find_product
+        with records.lock:
+            settings = dict(self.connection.execute("SELECT key, value FROM settings"))
+            if 'basic_reward_rate' in settings:
+                BasicCustomer.set_reward_rate(settings['basic_reward_rate'])
+            if 'vip_reward_rate' in settings:
+                VIPCustomer.set_reward_rate(settings['vip_reward_rate'])
+            self.read_new_customers(order_totals=False)
+            # the totals of all order histories in one pass over the orders
+            for customer_ID, *totals in self.connection.execute(f"SELECT customer_id, {self.ORDER_TOTALS} FROM orders GROUP BY customer_id"):
+                customer = records.customer_ids.get(customer_ID)
+                if customer is not None:
+                    self.set_order_totals(customer, *totals)
+            components = {}
+            for bundle_ID, component_ID in self.connection.execute("SELECT bundle_id, component_id FROM bundle_components ORDER BY bundle_id, position"):
+                components.setdefault(bundle_ID, []).append(component_ID)
+            for row in self.connection.execute(f"SELECT {self.PRODUCT_COLUMNS} FROM products ORDER BY row"):
+                self.add_product(row, components.get(row[0], []))
+            records.recompute_bundles()
+
+    # build a customer from a row of the customers table and add it to the records
+    def add_customer(self, row, order_totals=True):
+        number, ID, kind, name, reward, discount_rate = row
+        self.last_customer_row = max(self.last_customer_row, number)
+        customer = self.records.customer_ids.get(ID)
+        if customer is not None:
+            return customer
+        if kind == 'V':
+            customer = VIPCustomer(ID, name, reward, discount_rate)
+        else:
+            customer = BasicCustomer(ID, name, reward)
+        self.records.add_customer(customer)
+        customer.order_history = SQLiteOrderHistory(self, ID)
+        if order_totals:
+            self.set_order_totals(customer, *self.connection.execute(
+                f"SELECT {self.ORDER_TOTALS} FROM orders WHERE customer_id = ?", (ID,)).fetchone())
+        return customer
+
+    def set_order_totals(self, customer, order_count, lifetime_spend, lifetime_rewards, last_id, last_order_time):
+        if order_count:
+            customer.order_count = order_count
+            customer.lifetime_spend = lifetime_spend
+            customer.lifetime_rewards = lifetime_rewards
+            customer.last_order_time = last_order_time
+
+    # build a product from a row of the products table and add it to the records
+    def add_product(self, row, components):
+        ID, kind, name, unit_price, prescription = row
+        if kind == 'B':
+            product = Bundle(ID, name, components, unit_price)
+            product._Bundle__dr_prescription = bool(prescription)
+            self.records.add_product(product)
+            self.records.dirty_bundles.add(ID)
+        else:
+            product = Product(ID, name, unit_price, bool(prescription))
+            self.records.add_product(product)
+        return product
+
+    # customers added by another process since this one last looked
+    def read_new_customers(self, order_totals=True):
+        rows = self.connection.execute(f"SELECT {self.CUSTOMER_COLUMNS} FROM customers WHERE row > ? ORDER BY row",
+                                       (self.last_customer_row,)).fetchall()
+        for row in rows:
+            self.add_customer(row, order_totals)
+
+    # used by Records.find_customer when the customer is not in memory
+    def find_customer(self, search_value):
+        with self.records.lock:
+            row = self.connection.execute(
+                f"SELECT {self.CUSTOMER_COLUMNS} FROM customers WHERE id = ? OR name = ? OR name_folded = ? "
+                "ORDER BY id = ? DESC, name = ? DESC, row LIMIT 1",
+                (search_value, search_value, search_value.casefold(), search_value, search_value)).fetchone()
+            return self.add_customer(row) if row is not None else None
+
+    # used by Records.find_product when the product is not in memory
+    def find_product(self, search_value):
+        with self.records.lock:
+            row = self.connection.execute(
+                f"SELECT {self.PRODUCT_COLUMNS} FROM products WHERE id = ? OR name = ? OR name_folded = ? "
+                "ORDER BY id = ? DESC, name = ? DESC, row LIMIT 1",
+                (search_value, search_value, search_value.casefold(), search_value, search_value)).fetchone()
+            if row is None:
+                return None
+            existing = self.records.products.get(row[0])
+            if existing is not None:
+                return existing
+            components = [component_ID for (component_ID,) in self.connection.execute(
+                "SELECT component_id FROM bundle_components WHERE bundle_id = ? ORDER BY position", (row[0],))]
+            product = self.add_product(row, components)
+            self.records.recompute_bundles()
+            return product
+
+    # run the changes in one transaction; nested calls join the transaction that is already open
+    # customer: read the customer's reward points again, another process may have used them
+    @contextlib.contextmanager
+    def transaction(self, customer=None):
+        with self.records.lock:
+            if self.in_transaction:
+                yield
+                return
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.in_transaction = True
+            try:
+                self.read_new_customers()
+                if customer is not None:
+                    row = self.connection.execute("SELECT reward FROM customers WHERE id = ?", (customer.ID,)).fetchone()
+                    if row is not None:
+                        customer.reward = row[0]
+                yield
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            finally:
+                self.in_transaction = False
+
+    # the same kinds of change as the journal of TextStorage
+    # each change is committed straight away, so sync makes no difference
+    def log_change(self, kind, value, sync=True):
+        with self.transaction():
+            if kind == 'customer':
+                customer = parse_customer_line(value)
+                customer = self.records.customer_ids.get(customer.ID, customer)
+                self.write_customer(customer)
+                # a customer registered in this process keeps its orders in the database from now on
+                if not isinstance(customer.order_history, SQLiteOrderHistory):
+                    orders = list(customer.order_history)
+                    customer.order_history = SQLiteOrderHistory(self, customer.ID)
+                    customer.order_history.extend(orders)
+            elif kind == 'product':
+                product = parse_product_line(value)
+                self.write_product(self.records.products.get(product.product_ID, product))
+            elif kind == 'reward': # "customer ID,points added", the points are already in the customer
+                customer_ID, points = value.split(",")
+                customer = self.records.customer_ids.get(customer_ID)
+                if customer is not None:
+                    self.connection.execute("UPDATE customers SET reward = ? WHERE id = ?", (customer.reward, customer_ID))
+            elif kind == 'reward_rate':
+                self.write_settings()
+            elif kind == 'discount_rate': # "customer ID,rate"
+                customer_ID, rate = value.split(",")
+                self.connection.execute("UPDATE customers SET discount_rate = ? WHERE id = ?", (float(rate), customer_ID))
+            else:
+                raise ValueError(f"Unknown change: {kind}")
+
+    # the order itself was inserted by the customer's SQLiteOrderHistory
+    def record_order(self, customer, order, reward_change, sync=True):
+        with self.transaction():
+            self.connection.execute("UPDATE customers SET reward = ? WHERE id = ?", (customer.reward, customer.ID))
+
+    def write_settings(self):
+        self.connection.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                                    [('basic_reward_rate', BasicCustomer.get_reward_rate()),
+                                     ('vip_reward_rate', VIPCustomer.get_reward_rate())])
+
+    def write_customer(self, customer):
+        is_vip = isinstance(customer, VIPCustomer)
+        self.connection.execute(
+            "INSERT INTO customers (id, kind, name, name_folded, reward, discount_rate) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET kind = excluded.kind, name = excluded.name, name_folded = excluded.name_folded, "
+            "reward = excluded.reward, discount_rate = excluded.discount_rate",
+            (customer.ID, 'V' if is_vip else 'B', customer.name, customer.name.casefold(), customer.reward,
+             customer.discount_rate if is_vip else None))
+
+    def write_product(self, product):
+        is_bundle = isinstance(product, Bundle)
+        self.connection.execute(
+            "INSERT INTO products (id, kind, name, name_folded, unit_price, prescription) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET kind = excluded.kind, name = excluded.name, name_folded = excluded.name_folded, "
+            "unit_price = excluded.unit_price, prescription = excluded.prescription",
+            (product.product_ID, 'B' if is_bundle else 'P', product.product_name, product.product_name.casefold(),
+             product.unit_price, int(product.dr_prescription)))
+        self.connection.execute("DELETE FROM bundle_components WHERE bundle_id = ?", (product.product_ID,))
+        if is_bundle:
+            self.connection.executemany("INSERT INTO bundle_components (bundle_id, position, component_id) VALUES (?, ?, ?)",
+                                        [(product.product_ID, position, comp) for position, comp in enumerate(product.component)])
+
+    def insert_order(self, customer_ID, order):
+        with self.transaction():
+            order_id = self.connection.execute(
+                "INSERT INTO orders (customer_id, total_cost, earned_rewards, order_time) VALUES (?, ?, ?, ?)",
+                (customer_ID, order['total_cost'], order['earned_rewards'], order['order_time'])).lastrowid
+            self.connection.executemany(
+                "INSERT INTO order_lines (order_id, position, product_name, unit_price, quantity) VALUES (?, ?, ?, ?, ?)",
+                [(order_id, position, product_name, unit_price, quantity)
+                 for position, (product_name, unit_price, quantity) in enumerate(order['products'])])
+
+    def order_count(self, customer_ID):
+        with self.records.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM orders WHERE customer_id = ?", (customer_ID,)).fetchone()[0]
+
+    # the orders picked by "where" (a WHERE clause on the orders table) as (customer ID, order dict)
+    def read_orders(self, where, parameters):
+        with self.records.lock:
+            orders = self.connection.execute(
+                f"SELECT id, customer_id, total_cost, earned_rewards, order_time FROM orders {where}", parameters).fetchall()
+            lines = {}
+            for order_id, product_name, unit_price, quantity in self.connection.execute(
+                    f"SELECT order_id, product_name, unit_price, quantity FROM order_lines "
+                    f"WHERE order_id IN (SELECT id FROM orders {where}) ORDER BY order_id, position", parameters):
+                lines.setdefault(order_id, []).append((product_name, unit_price, quantity))
+        return [(customer_ID, {'products': lines.get(order_id, []), 'total_cost': total_cost,
+                               'earned_rewards': earned_rewards, 'order_time': order_time,
+                               'timestamp': parse_order_time(order_time)})
+                for order_id, customer_ID, total_cost, earned_rewards, order_time in orders]
+
+    # every order of every customer as (customer, order), a few hundred customers at a time
+    def all_orders(self, customers_per_query=200):
+        customers = self.records.customers
+        for start in range(0, len(customers), customers_per_query):
+            chunk = customers[start:start + customers_per_query]
+            orders = {}
+            for customer_ID, order in self.read_orders(f"WHERE customer_id IN ({','.join('?' * len(chunk))}) ORDER BY id",
+                                                       [customer.ID for customer in chunk]):
+                orders.setdefault(customer_ID, []).append(order)
+            for customer in chunk:
+                for order in orders.pop(customer.ID, ()):
+                    yield customer, order
+
+    # copy records read from the text files into the database, in one transaction
+    def import_records(self, records):
+        self.records = records
+        with self.transaction():
+            self.write_settings()
+            for customer in records.customers:
+                if records.customer_ids.get(customer.ID) is customer:
+                    self.write_customer(customer)
+                    for order in customer.order_history:
+                        self.insert_order(customer.ID, order)
+            for product in records.products.values():
+                self.write_product(product)
+
+    def sync(self):
+        pass
+
+    def compact(self):
+        pass
+
+    def close(self):
+        self.connection.close()
 
 class Operations:
-    def __init__(self, customer_file="customers.txt", product_file="products.txt", order_file="orders.txt"): #default file names
-        self.records = Records()
+    def __init__(self, customer_file="customers.txt", product_file="products.txt", order_file="orders.txt", lazy_orders=False,
+                 journal_file=None, compact_every=1000, compact_orders=False, use_snapshot=True, snapshot_file=None,
+                 storage=None, order_cache_size=None, receipt_file=None, reward_file=None): #default file names
+        # order_cache_size: keep at most this many orders of the histories in memory, the rest is read from disk when used
+        # receipt_file: archive every receipt there, batch purchases included, so it can be printed again
+        # reward_file: keep every change to the reward points in a RewardLedger there, with the text files only
+        self.records = Records(compact=compact_orders, order_cache_size=order_cache_size)
+        self.receipts = ReceiptSpooler(receipt_file)
+        self.rewards = None
+        if reward_file is not None:
+            if storage is not None:
+                raise ValueError("The reward ledger can only be kept with the text files.")
+            self.rewards = RewardLedger(reward_file)
+        if order_cache_size is not None:
+            lazy_orders = True
+        # the data files are rewritten from the journal once it has this many entries
+        self.compact_every = compact_every
+        # the text files unless another storage is given, e.g. SQLiteStorage
+        if storage is None:
+            storage = TextStorage(customer_file, product_file, order_file, lazy_orders, journal_file, use_snapshot, snapshot_file)
+        self.storage = storage
         try:
-            self.records.read_customers(customer_file)
-            self.records.read_products(product_file)
-            if order_file:
-                self.records.read_orders(order_file)
+            if self.rewards is not None:
+                self.rewards.read_balances(self.records)
+            self.storage.load(self.records)
+            if self.rewards is not None:
+                self.rewards.load(self.records)
         except FileNotFoundError as e:
             print(e)
             sys.exit(1) 
 
+    # write one change to the storage, and fold the journal into the data files when it gets long
+    # sync=False leaves writing to disk to a later storage.sync(), used for batches
+    def log_change(self, kind, value, sync=True):
+        with self.records.change_lock.shared():
+            self.storage.log_change(kind, value, sync=sync)
+        self.maybe_compact()
+
+    # make sure every change logged so far is on disk
+    def sync(self):
+        self.storage.sync()
+        if self.rewards is not None:
+            self.rewards.sync()
+
+    def maybe_compact(self):
+        if self.storage.count >= self.compact_every:
+            self.compact()
+
+    # no till can change anything while the storage is compacted,
+    # so every change is either in the data files or in the journal
+    def compact(self):
+        with self.records.change_lock.exclusive():
+            if self.storage.count == 0:
+                return
+            self.storage.compact()
+            if self.rewards is not None:
+                self.rewards.write_checkpoint()
+
     def main_menu(self):
         while True:
             print('Welcome to the RMIT pharmacy!'.center(60))
@@ -397,9 +3096,9 @@ class Operations:
             if option == '1':
                 self.make_purchase()
             elif option == '2':
-                self.records.list_customers()
+                self.display_customers()
             elif option == '3':
-                self.records.list_products()
+                self.display_products()
             elif option =='4':
                 self.add_update_products()
             elif option == '5':
@@ -409,7 +3108,7 @@ class Operations:
             elif option =='7':
                 self.display_customer_order_history()
             elif option =='8':
-                self.display_all_orders()
+                self.display_orders_in_window()
             elif option == '9':
                 self.save_and_exit()
                 print("Exiting the program. Bye.")
@@ -417,42 +3116,98 @@ class Operations:
             else:
                 print("Invalid option, please choose again.")
     
-    # save the information of customers, products, and orders into the file
+    # every change is already in the storage, so only fold the journal into the data files if it got long
     def save_and_exit(self):
-        self.records.save_customers(customer_file)
-        self.records.save_products(product_file)
-        self.records.save_orders(order_file)
+        self.receipts.close()
+        if self.storage.count >= self.compact_every:
+            self.compact()
+        if self.rewards is not None:
+            # the next start reads the balances from here instead of the whole ledger
+            with self.records.change_lock.exclusive():
+                self.rewards.write_checkpoint()
+            self.rewards.close()
+        self.storage.close()
 
     # add a new product or update an existing product
     def add_product(self, product_name, price, prescription_required):
-        existing_ids = [int(product.product_ID[1:]) for product in self.records.products.values()]
-        unique_number = 1
-        while unique_number in existing_ids:
-            unique_number +=1
-        new_product_id = "P" + str(unique_number) # create a unique product number
         if float(price) <=0 or prescription_required.lower() not in ['y', 'n']:
             return None
-        
-        product = Product(new_product_id, product_name,float(price),prescription_required.lower() == 'y')
-        self.records.products[new_product_id]=product
+        with self.records.catalogue_lock:
+            new_product_id = self.records.new_product_id() # create a unique product number
+            
+            product = Product(new_product_id, product_name,float(price),prescription_required.lower() == 'y')
+            self.records.add_product(product)
+            self.log_change('product', format_product_line(product))
         print(f"New product:{product_name} has been successfully added.")
     
-    def update_prodcut(self,product_name, price, prescription_required):
-        product = self.records.find_product(product_name)
-        if product is not None:
-            if float(price) <=0 or prescription_required.lower() not in ['y', 'n']:
-                return None
-            product._Product__unit_price = float(price)
-            product._Product__dr_prescription = prescription_required.lower() == 'y'  
-            self.update_bundles(product.product_ID)
-            print(f"{product.product_name} has been successfully updated.")  
+    # recompute=False leaves the bundles dirty so that a batch of updates prices each bundle once
+    def update_prodcut(self,product_name, price, prescription_required, recompute=True):
+        with self.records.catalogue_lock:
+            product = self.records.find_product(product_name)
+            if product is not None:
+                if float(price) <=0 or prescription_required.lower() not in ['y', 'n']:
+                    return None
+                product.set_unit_price(float(price))
+                product._Product__dr_prescription = prescription_required.lower() == 'y'  
+                self.records.mark_bundles_dirty(product.product_ID)
+                if recompute:
+                    self.records.recompute_bundles()
+                self.log_change('product', format_product_line(product))
+                print(f"{product.product_name} has been successfully updated.")  
     
     # if the product is updated, the bundles that contain this product should be updated as well
     def update_bundles(self, product_ID):
-        for bundle in self.records.products.values():
-            if isinstance(bundle, Bundle) and product_ID in bundle.component:
-                bundle.calculate_price(self.records)
-                bundle.bundle_prescription(self.records)
+        with self.records.catalogue_lock:
+            self.records.mark_bundles_dirty(product_ID)
+            self.records.recompute_bundles()
+
+    # add points to the reward points of a customer, or take them off with a negative number
+    def adjust_reward(self, customer, points, sync=True):
+        with self.records.change_lock.shared():
+            with self.records.customer_lock(customer), self.storage.transaction(customer):
+                if customer.reward + points < 0:
+                    raise InvalidReward(f"{customer.ID} has only {customer.reward} reward points.")
+                customer.update_reward(points)
+                self.storage.log_change('reward', f"{customer.ID},{points}", sync=sync)
+                if self.rewards is not None:
+                    self.rewards.record('adjust', customer.ID, points, format_order_time(time.time()), sync=sync)
+        self.maybe_compact()
+        return customer.reward
+
+    # the reward points of a customer just after a time, from the reward ledger
+    def reward_balance_at(self, customer, when):
+        if self.rewards is None:
+            raise ValueError("Reward points at a past time need a reward ledger (--rewards).")
+        return self.rewards.balance_at(customer.ID, when)
+
+    # apply a supplier price file in one go, see Records.import_prices
+    # the tills keep selling from the old catalogue until the new one is swapped in
+    def import_prices(self, filename):
+        try:
+            changed, errors = self.records.import_prices(filename)
+        except FileNotFoundError:
+            print(f"Price file {filename} not found.")
+            return None
+        if errors:
+            for error in errors[:20]:
+                print(error)
+            if len(errors) > 20:
+                print(f"... and {len(errors) - 20} more.")
+            print(f"No prices were changed, {len(errors)} lines of {filename} are invalid.")
+            return None
+        self.log_products(changed)
+        print(f"Imported {filename}: {len(changed)} products and bundles changed.")
+        return changed
+
+    # write new and changed products to the storage as one batch
+    def log_products(self, products, sync=True):
+        with self.records.change_lock.shared():
+            with self.storage.transaction():
+                for product in products:
+                    self.storage.log_change('product', format_product_line(product), sync=False)
+            if sync:
+                self.storage.sync()
+        self.maybe_compact()
 
     def add_update_products(self):
         while True:
@@ -468,11 +3223,13 @@ class Operations:
                         raise ValueError("Price must be greater than 0 and prescription status must be 'y' or 'n'.")
                     product = self.records.find_product(name_identifier)
                     valid_products.append((product, name_identifier, price, prescription_required))
-                for product, name_identifier, price, prescription_required in valid_products:
-                    if product is None:
-                        self.add_product(name_identifier, price,prescription_required)
-                    else:
-                        self.update_prodcut(name_identifier, price, prescription_required)
+                with self.records.catalogue_lock:
+                    for product, name_identifier, price, prescription_required in valid_products:
+                        if product is None:
+                            self.add_product(name_identifier, price,prescription_required)
+                        else:
+                            self.update_prodcut(name_identifier, price, prescription_required, recompute=False)
+                    self.records.recompute_bundles()
                 break
             except Exception as e:
                 print(e)
@@ -486,6 +3243,7 @@ class Operations:
                     raise ValueError("Reward rate must be a positive number.") 
                 # update the reward rate for all Basic customers
                 BasicCustomer.set_reward_rate(new_rate)
+                self.log_change('reward_rate', new_rate)
                 print("Reward rate for all Basic customers has been updated successfully.")
                 break
             except Exception as e:
@@ -508,6 +3266,7 @@ class Operations:
                             raise ValueError("Discount rate must be a positive number.")
                         # update the discount rate for the VIP customer
                         customer.set_discount_rate(new_rate)
+                        self.log_change('discount_rate', f"{customer.ID},{new_rate}")
                         print(f"Discount rate for the VIP customer{customer.name} has been updated successfully to {round(new_rate*100,1)}%.")
                         break
                     except ValueError as e:
@@ -519,7 +3278,7 @@ class Operations:
                 print("Invalid input.Try again.")
 
 
-    def display_customer_order_history(self):
+    def display_customer_order_history(self, page_size=20):
         while True:
             try:
                 customer_name = input("Enter customer's name/ID: ").strip()
@@ -528,61 +3287,128 @@ class Operations:
                     print("The customer does not exit. Try a exit customer again.")
                     continue
                 # if history list is empty, print this message, and ends the function.
-                if not customer.order_history:
+                if customer.order_count == 0:
                     print(f"Sorry, {customer.name} has no order history.")
                 else:
-                    max_product_length = 0
-                    for order in customer.order_history:
-                        product_line = [f"{quantity}*{product_name}" for product_name, unit_price,quantity in order["products"]]
-                        products_str = ", ".join(product_line)
-                        # through comparing the length of each order's product list to find the max length of product list, add 3 to get more space
-                        if len(products_str) + 2 * len(order["products"]) > max_product_length:
-                            max_product_length = len(products_str) + 2 * len(order["products"])
-                    
                     print(f"This is the order history of {customer.name}")
-                    print(f"{'     '.ljust(10)} {'Products'.ljust(max_product_length)} {'Total Cost'.ljust(15)} {'Earned Rewards'.ljust(15)}")
-                    for idx, order in enumerate(customer.order_history, start=1):
-                        products_line = [f"{quantity} * {product_name}" for product_name, unit_price, quantity in order['products']]
-                        products_str = ", ".join(products_line)
-                        total_cost = order['total_cost']
-                        earned_rewards = order['earned_rewards']
-                        # create a table to display the order history
-                        print(f"{f'Order {idx}'.ljust(10)} {products_str.ljust(max_product_length)} {format(total_cost,'.2f').ljust(15)} {str(earned_rewards).ljust(15)}")
+                    print(f"Orders: {customer.order_count}, Total spent: {customer.lifetime_spend:.2f}, "
+                          f"Earned rewards: {customer.lifetime_rewards}, Last order: {customer.last_order_time}")
+                    rows = ((f'Order {idx}', order) for idx, order in enumerate(customer.order_history, start=1))
+                    self.print_order_pages(rows, '     ', 10, False, page_size)
+                    if self.receipts.archive_file is not None:
+                        self.reprint_receipts(customer)
                 break
             except Exception as e:
                 print(e)
                 print("Invalid happens.")
 
-    def display_all_orders(self):
-        all_orders = []
-        for customer in self.records.customers:
-            for order in customer.order_history:
-                all_orders.append({
-                    'customer_name': customer.name,
-                    'products': order['products'],
-                    'total_cost' : order['total_cost'],
-                    'earned_rewards': order['earned_rewards'],
-                    'order_time': order['order_time']
-                })
-        if not all_orders:
+    # print archived receipts of the customer's orders again until Enter is pressed
+    def reprint_receipts(self, customer):
+        while True:
+            number = input("Enter an order number to print its receipt again, or press Enter to go back: ").strip()
+            if not number:
+                return
+            if not number.isdigit():
+                print("Please enter the number of an order.")
+                continue
+            receipt = self.receipts.receipt(customer.ID, int(number))
+            if receipt is None:
+                print(f"No receipt of order {number} was archived.")
+            else:
+                print(receipt, end='')
+
+    def display_customers(self, page_size=20):
+        kind, sort = self.get_listing_options("basic/vip", CUSTOMER_FILTERS)
+        self.display_pages(lambda cursor: self.records.list_customers(kind, sort, cursor, page_size), "customers")
+
+    def display_products(self, page_size=20):
+        kind, sort = self.get_listing_options("product/bundle/prescription", PRODUCT_FILTERS)
+        self.display_pages(lambda cursor: self.records.list_products(kind, sort, cursor, page_size), "products")
+
+    # ask which records to show and in which order, Enter keeps all of them sorted by ID
+    def get_listing_options(self, kinds, filters):
+        while True:
+            kind = input(f"Show which ({kinds}, Enter for all)? ").strip().lower() or None
+            if kind is None or kind in filters:
+                break
+            print(f"Please enter one of {kinds}, or press Enter.")
+        while True:
+            sort = input("Sort by (ID/name, Enter for ID)? ").strip().lower() or 'id'
+            if sort in ['id', 'name']:
+                return kind, 'ID' if sort == 'id' else 'name'
+            print("Please enter ID or name, or press Enter.")
+
+    # show one page at a time until the last page, or until q is entered
+    def display_pages(self, show_page, what):
+        cursor = show_page(None)
+        while cursor is not None:
+            if input(f"Press Enter for more {what}, or q to stop: ").strip().lower() == 'q':
+                return
+            cursor = show_page(cursor)
+
+    # all orders, or the orders of a day or a shift found with the time index
+    def display_orders_in_window(self, page_size=20):
+        while True:
+            text = input("Enter a day (dd/mm/yyyy), a window (dd/mm/yyyy HH:MM - HH:MM), or press Enter for all orders: ").strip()
+            if not text:
+                self.display_all_orders(page_size)
+                return
+            try:
+                start, end = parse_time_window(text)
+                break
+            except ValueError as e:
+                print(e)
+        self.display_orders_between(start, end, page_size)
+
+    # the orders from start up to end (epoch times) in time order, with the number of orders and the takings
+    def display_orders_between(self, start, end, page_size=20):
+        totals = {'orders': 0, 'revenue': 0}
+        def rows():
+            for customer, order in self.records.orders_between(start, end):
+                totals['orders'] += 1
+                totals['revenue'] += order['total_cost']
+                yield customer.name, order
+        self.print_order_pages(rows(), 'Customer', 15, True, page_size)
+        if totals['orders'] == 0:
+            print("No orders in this time window.")
+        else:
+            print(f"Shown {totals['orders']} orders, total {totals['revenue']:.2f}")
+
+    def display_all_orders(self, page_size=20):
+        if not any(customer.order_count for customer in self.records.customers):
             print("Order list is empty.")
             return
-        
-        # find the max length of the product list to create a table
-        max_product_length = 0
-        for order in all_orders:
-            product_line = [f"{quantity} * {product_name}" for product_name, unit_price, quantity in order["products"]]
-            products_str = ", ".join(product_line)
-            if len(products_str) + 2 * len(order["products"]) > max_product_length:
-                max_product_length = len(products_str) + 2 * len(order["products"])
-        print(f"{'Customer'.ljust(15)} {'Products'.ljust(max_product_length)} {'Total Cost'.ljust(15)} {'Earned Rewards'.ljust(15)} {'Order Time'.ljust(20)}")
-        for order in all_orders:
-            products_line = [f"{quantity} * {product_name}" for product_name, unit_price, quantity in order['products']]
-            products_str = ", ".join(products_line)
-            total_cost = order['total_cost']
-            earned_rewards = order['earned_rewards']
-            order_time = order['order_time']
-            print(f"{order['customer_name'].ljust(15)} {products_str.ljust(max_product_length)} {format(total_cost, '.2f').ljust(15)} {str(earned_rewards).ljust(15)} {order_time.ljust(20)}")
+        rows = ((customer.name, order) for customer, order in self.storage.all_orders())
+        self.print_order_pages(rows, 'Customer', 15, True, page_size)
+
+    # Print a table of (first column, order) rows one page at a time.
+    # Each order is turned into a string once, and only one page is kept in memory;
+    # the products column is as wide as the longest product list on the page.
+    # page_size=None prints everything without stopping.
+    def print_order_pages(self, rows, first_title, first_width, show_time, page_size=20):
+        page = []
+        shown = 0
+        for first, order in rows:
+            products_str = ", ".join([f"{quantity} * {product_name}" for product_name, unit_price, quantity in order['products']])
+            page.append((first, products_str, len(products_str) + 2 * len(order['products']), order))
+            if page_size and len(page) == page_size:
+                self.print_order_page(page, first_title, first_width, show_time)
+                shown += len(page)
+                page = []
+                if input(f"Shown {shown} orders. Press Enter for more, or q to stop: ").strip().lower() == 'q':
+                    return
+        if page:
+            self.print_order_page(page, first_title, first_width, show_time)
+
+    def print_order_page(self, page, first_title, first_width, show_time):
+        max_product_length = max(width for first, products_str, width, order in page)
+        header = f"{first_title.ljust(first_width)} {'Products'.ljust(max_product_length)} {'Total Cost'.ljust(15)} {'Earned Rewards'.ljust(15)}"
+        lines = [header + f" {'Order Time'.ljust(20)}" if show_time else header]
+        for first, products_str, width, order in page:
+            # create a table to display the order history
+            line = f"{first.ljust(first_width)} {products_str.ljust(max_product_length)} {format(order['total_cost'], '.2f').ljust(15)} {str(order['earned_rewards']).ljust(15)}"
+            lines.append(line + f" {order['order_time'].ljust(20)}" if show_time else line)
+        print("\n".join(lines))
 
     def make_purchase(self):
         while True:
@@ -598,15 +3424,8 @@ class Operations:
                         print("Customer name must contain only alphabetic characters.")
                         continue
                     elif customer_identifier.isalpha():
-                        existing_ids = [int(customer.ID[1:]) for customer in self.records.customers] 
-                        unique_number = 1
-                        # list all the existing customer IDs, find the unique number for the new customer
-                        while unique_number in existing_ids:
-                            unique_number += 1
-                        new_customer_id = "B" + str(unique_number)
-                        print(f"This is a new customer. Register as a Basic Customer: B{unique_number} {customer_identifier}.")
-                        customer = BasicCustomer(new_customer_id, customer_identifier, 0)
-                        self.records.customers.append(customer)
+                        customer = self.find_or_register_customer(customer_identifier)
+                        print(f"This is a new customer. Register as a Basic Customer: {customer.ID} {customer_identifier}.")
                     else:
                         print("Invalid customer identifier. Please try again.")
                         continue
@@ -654,10 +3473,28 @@ class Operations:
         while True:
             product_names_input = input("Enter the names of the products, separated by commas [e.g. vitaminC, vitaminE]: ").strip()
             product_names =[name.strip() for name in product_names_input.split(",") if name.strip()] 
-            if all(self.records.find_product(name) is not None for name in product_names):
-                return product_names
+            # offer the closest products for each name that is not found, instead of starting again
+            for i, name in enumerate(product_names):
+                if self.records.find_product(name) is None:
+                    product_names[i] = self.choose_suggested_product(name)
+                    if product_names[i] is None:
+                        break
             else:
-                print("Product not found. Please try again.")
+                return product_names
+            print("Product not found. Please try again.")
+
+    # show the products that look like a name that was not found and let the cashier pick one
+    def choose_suggested_product(self, name):
+        suggestions = self.records.search_products(name)
+        if not suggestions:
+            return None
+        print(f"Product {name} not found. Did you mean:")
+        for number, product in enumerate(suggestions, start=1):
+            print(f"  {number}. {product.product_name} ({product.product_ID})")
+        choice = input(f"Choose 1-{len(suggestions)}, or press Enter to type the products again: ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(suggestions):
+            return suggestions[int(choice) - 1].product_name
+        return None
 
     def get_valid_quantity(self, num_product):
         # input quantity
@@ -691,71 +3528,224 @@ class Operations:
         return filtered_products, filtered_quantities
             
     def purchase(self, customer, product_names, quantities):
-        original_total_cost = 0
-        final_total_cost = 0
-        discount = 0
-        reward = 0
-        detail=[]
-        for name, quantity in zip(product_names, quantities):
-            product = self.records.find_product(name)
-            cost = product.unit_price * quantity
-            original_total_cost += cost
-            reward = customer.get_reward(cost)
-            detail.append((product.product_name, product.unit_price, quantity))
-        # Apply rewards if applicable
-        if isinstance(customer, VIPCustomer):
-            discount = original_total_cost * customer.discount_rate
-            final_total_cost = original_total_cost-discount
-            reward_deduction = min(customer.reward // 100 * 10, int(final_total_cost))
-            print(f"Applying ${reward_deduction} discount from reward points.")
-            final_total_cost -= reward_deduction
-            reward = customer.get_reward(original_total_cost)
-            new_reward = int(reward-reward_deduction*10)
-        elif isinstance(customer, BasicCustomer):
-            final_total_cost = original_total_cost
-            discount = 0
-            reward_deduction = min(customer.reward // 100 * 10, int(final_total_cost))
+        catalogue = self.records.catalogue
+        products = [self.records.find_product(name, catalogue) for name in product_names]
+        self.checkout(customer, products, quantities, print_deduction=True, show_receipt=True)
+        # the receipt is on the screen before the menu asks anything else
+        self.receipts.flush()
+
+    # work out the costs and rewards of a purchase, update the rewards and record the order
+    # this does not ask or print anything (except the reward deduction when print_deduction is set,
+    # and the receipt when show_receipt is set), so it can be used by the menu and by batch processing
+    # the receipt goes to the archive whenever there is one
+    def checkout(self, customer, products, quantities, print_deduction=False, sync=True, show_receipt=False):
+        detail = [(product.product_name, product.unit_price, quantity) for product, quantity in zip(products, quantities)]
+        # costs, discount and reward in exact decimals from the pricing engine, floats from here on
+        price = pricing.price(customer, products, quantities)
+        original_total_cost = float(price['original_total_cost'])
+        discount = float(price['discount'])
+        reward = price['reward']
+        # the points are read, redeemed and recorded under the customer's lock,
+        # so two tills serving the same customer never lose an update
+        # a storage shared with other processes also commits the order and the points in one transaction
+        with self.records.change_lock.shared():
+            with self.records.customer_lock(customer), self.storage.transaction(customer):
+                reward_deduction = min(customer.reward // 100 * 10, int(price['final_total_cost']))
+                if metrics.enabled and reward_deduction:
+                    metrics.count('reward_redemptions')
+                    metrics.count('reward_points_redeemed', reward_deduction * 10)
+                final_total_cost = float(price['final_total_cost'] - reward_deduction)
+                new_reward = int(reward-reward_deduction*10)
+                customer.update_reward(new_reward)
+
+                # Update the purchase into order history
+                order_time = datetime.datetime.now().replace(microsecond=0)
+                order = {
+                    'products':detail,
+                    'total_cost': final_total_cost,
+                    'earned_rewards': reward,
+                    'order_time': order_time.strftime("%d/%m/%Y %H:%M:%S"),
+                    'timestamp': order_time.timestamp()
+                }    
+                self.records.add_order(customer, order)
+                self.storage.record_order(customer, order, new_reward, sync=sync)
+                # the number of the order in the customer's history, as "Order N" at option 7
+                order_number = customer.order_count
+                if self.rewards is not None:
+                    self.rewards.record_order(customer.ID, reward, reward_deduction * 10, order['order_time'], order_number, sync=sync)
+        if print_deduction:
             print(f"Applying ${reward_deduction} discount from reward points.")
-            final_total_cost -= reward_deduction
-            reward = customer.get_reward(original_total_cost)
-            new_reward = int(reward-reward_deduction*10)
-        customer.update_reward(new_reward)
-        if detail:
-            self.display_receipt(customer, detail, original_total_cost, discount, final_total_cost, reward)      
-
-        # Update the purchase into order history
-        order = {
-            'products':detail,
-            'total_cost': final_total_cost,
-            'earned_rewards': reward,
-            'order_time': datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        }    
-        customer.order_history.append(order)
+        if detail and (show_receipt or self.receipts.archive_file is not None):
+            self.receipts.submit(render_receipt(customer, detail, original_total_cost, discount, final_total_cost, reward),
+                                 (customer.ID, order_number, order['order_time']), show=show_receipt)
+        self.maybe_compact()
+        return {
+            'order': order,
+            'detail': detail,
+            'original_total_cost': original_total_cost,
+            'discount': discount,
+            'final_total_cost': final_total_cost,
+            'reward': reward,
+            'reward_deduction': reward_deduction,
+            'reward_change': new_reward
+        }
+
+    # Process many purchases without any input or printing.
+    # Each transaction is (customer name or ID, [(product name or ID, quantity), ...], has prescription).
+    # The same rules as a purchase at the menu apply: unknown names are registered as Basic customers,
+    # and products that need a prescription are removed when there is none.
+    # Returns a summary with the number of processed and skipped transactions, the errors and the throughput.
+    def process_transactions(self, transactions):
+        start_time = time.perf_counter()
+        # resolve each customer and product only once per batch
+        customers = {}
+        products = {}
+        catalogue = self.records.catalogue
+        summary = {'processed': 0, 'skipped': 0, 'errors': []}
+        for number, transaction in enumerate(transactions, start=1):
+            # prices were imported during the batch, look the products up again in the new catalogue
+            if self.records.catalogue is not catalogue:
+                catalogue = self.records.catalogue
+                products = {}
+            try:
+                customer_identifier, items, has_prescription = transaction
+                sale = self.sell(customer_identifier, items, has_prescription, customers, products, sync=False, catalogue=catalogue)
+                if sale is None:
+                    summary['skipped'] += 1
+                    continue
+                summary['processed'] += 1
+            except (InvalidCustomer, InvalidProduct, ValueError, TypeError) as e:
+                summary['skipped'] += 1
+                summary['errors'].append((number, str(e)))
+        # the journal is written to disk once for the whole batch
+        self.sync()
+        seconds = time.perf_counter() - start_time
+        summary['seconds'] = seconds
+        summary['per_minute'] = summary['processed'] / seconds * 60 if seconds > 0 else 0
+        return summary
 
+    # One purchase without any input or printing. Returns the sale from checkout,
+    # or None if nothing is left after removing the products that need a prescription.
+    # customers and products are optional dicts that remember names already resolved,
+    # catalogue is the version the products are looked up in, the live one by default.
+    def sell(self, customer_identifier, items, has_prescription, customers=None, products=None, sync=True, catalogue=None):
+        customers = {} if customers is None else customers
+        products = {} if products is None else products
+        catalogue = self.records.catalogue if catalogue is None else catalogue
+        customer = customers.get(customer_identifier)
+        if customer is None:
+            customer = self.find_or_register_customer(customer_identifier, sync=sync)
+            customers[customer_identifier] = customer
+        basket = []
+        quantities = []
+        for product_identifier, quantity in items:
+            product = products.get(product_identifier)
+            if product is None:
+                product = self.records.find_product(product_identifier, catalogue)
+                if product is None:
+                    raise InvalidProduct(f"Product {product_identifier} not found.")
+                products[product_identifier] = product
+            if int(quantity) != quantity or quantity <= 0:
+                raise ValueError(f"Invalid quantity {quantity} for {product_identifier}.")
+            if has_prescription or not product.dr_prescription:
+                basket.append(product)
+                quantities.append(quantity)
+        if not basket:
+            return None
+        return self.checkout(customer, basket, quantities, sync=sync)
+
+    # find a customer by name or ID, or register a new Basic customer for a new name
+    # the check and the registration happen under one lock, so two tills registering
+    # the same name at once get the same customer and every new customer gets a unique ID
+    def find_or_register_customer(self, customer_identifier, sync=True):
+        customer = self.records.find_customer(customer_identifier)
+        if customer is not None:
+            return customer
+        if customer_identifier.startswith(('B', 'V')) and customer_identifier[1:].isdigit():
+            raise InvalidCustomer(f"No such customer ID found: {customer_identifier}.")
+        if not customer_identifier.isalpha():
+            raise InvalidCustomer(f"Customer name must contain only alphabetic characters: {customer_identifier}.")
+        with self.records.change_lock.shared():
+            with self.records.lock, self.storage.transaction():
+                customer = self.records.find_customer(customer_identifier)
+                if customer is not None:
+                    return customer
+                customer = BasicCustomer(self.new_customer_id(), customer_identifier, 0)
+                self.records.add_customer(customer)
+                self.storage.log_change('customer', format_customer_line(customer), sync=sync)
+        self.maybe_compact()
+        return customer
+
+    # the unique number for the new customer comes from the records' ID allocator
+    def new_customer_id(self):
+        return self.records.new_customer_id("B")
 
+    # read transactions from a file, one per line:
+    # customer, product, quantity[, product, quantity ...][, y/n for a prescription]
+    def read_transactions(self, filename):
+        for line_number, offset, line in read_lines_in_chunks(filename):
+            yield parse_transaction_line(line)
+
+    def process_transaction_file(self, filename):
+        try:
+            summary = self.process_transactions(self.read_transactions(filename))
+        except FileNotFoundError:
+            print(f"Transaction file {filename} not found.")
+            return None
+        for number, error in summary['errors']:
+            print(f"Transaction {number} skipped: {error}")
+        print(f"Processed {summary['processed']} transactions, skipped {summary['skipped']}, "
+              f"in {summary['seconds']:.2f} seconds ({summary['per_minute']:.0f} per minute).")
+        return summary
+
+    # the receipt in one write, purchases go through the receipt spooler instead
     def display_receipt(self, customer, detail, original_total_cost, discount, final_total_cost, reward):
-        print('-' * 45)
-        print("Receipt".center(45, ' '))
-        print('-' * 45)
-        print("Name:".ljust(20),customer.name)
-        for info in detail:
-            product_name, unit_price, quantity = info
-            print("Product:".ljust(20), product_name)
-            print("Unit Price:".ljust(20), f"{unit_price:.2f} (AUD)")
-            print("Quantity:".ljust(20), f"{quantity}")
-            print('-' * 45)
-        if isinstance(customer, VIPCustomer):
-            print("Original cost:".ljust(20),f"{original_total_cost:.2f} (AUD)")
-            print("Discount:".ljust(20),f"{discount:.2f} (AUD)")
-        print("Total cost:".ljust(20), f"{final_total_cost:.2f} (AUD)")
-        print("Earned reward:".ljust(20), f"{reward}")
-        print('-' * 45)
+        print(render_receipt(customer, detail, original_total_cost, discount, final_total_cost, reward), end='')
+
+    # the archived receipt of an order, printed again; number counts from 1 like at option 7
+    def reprint_receipt(self, customer, number):
+        receipt = self.receipts.receipt(customer.ID, number)
+        if receipt is not None:
+            print(receipt, end='')
+        return receipt
 
 
 if __name__ == '__main__':
+    # --transactions file: process a file of purchases without the menu
+    # --metrics file: write Prometheus metrics to the file and log a summary every minute
+    # --sqlite file: keep the records in an SQLite database, a new one is filled from the text files
+    # --order-cache orders: keep at most this many orders of the order histories in memory
+    # --import-prices file: apply a price file of "product name or ID, price, y/n" lines before starting
+    # --receipts file: archive every receipt in the file (rotated every 10 MB) so it can be printed again at option 7
+    # --rewards file: keep a ledger of every change to the reward points, the balances are read from it at start
+    transaction_file = None
+    metrics_file = None
+    database_file = None
+    order_cache_size = None
+    price_file = None
+    receipt_file = None
+    reward_file = None
+    while len(sys.argv) >= 3 and sys.argv[1] in ('--transactions', '--metrics', '--sqlite', '--order-cache', '--import-prices', '--receipts',
+                                                  '--rewards'):
+        if sys.argv[1] == '--transactions':
+            transaction_file = sys.argv[2]
+        elif sys.argv[1] == '--rewards':
+            reward_file = sys.argv[2]
+        elif sys.argv[1] == '--receipts':
+            receipt_file = sys.argv[2]
+        elif sys.argv[1] == '--import-prices':
+            price_file = sys.argv[2]
+        elif sys.argv[1] == '--metrics':
+            metrics_file = sys.argv[2]
+        elif sys.argv[1] == '--order-cache':
+            order_cache_size = int(sys.argv[2])
+        else:
+            database_file = sys.argv[2]
+        sys.argv = sys.argv[:1] + sys.argv[3:]
+
     if len(sys.argv) not in [1, 3, 4]:
         # print the usage of the program
-        print("Usage: python ProgFunA2_s4070702.py [customers.txt products.txt] [orders.txt]")
+        print("Usage: python ProgFunA2_s4070702.py [--transactions transactions.txt] [--metrics metrics.prom] [--sqlite pharmacy.db] [--order-cache 100000] [--import-prices prices.csv] [--receipts receipts.txt] [--rewards rewards.txt] [customers.txt products.txt] [orders.txt]")
         sys.exit(1)
     
     customer_file = "customers.txt"
@@ -769,8 +3759,35 @@ if __name__ == '__main__':
     if len(sys.argv) == 4:
         order_file = sys.argv[3]
     
-    app = Operations(customer_file, product_file, order_file)
-    app.main_menu()
+    if metrics_file:
+        metrics.enable()
+        metrics.start_reporter(60, metrics_file, log=lambda summary: print(summary, file=sys.stderr))
+    storage = None
+    if database_file:
+        storage = SQLiteStorage(database_file)
+        # a new database starts with the records in the text files
+        if storage.is_empty():
+            records = Records()
+            records.read_customers(customer_file)
+            records.read_products(product_file)
+            if order_file:
+                records.read_orders(order_file)
+            storage.import_records(records)
+    app = Operations(customer_file, product_file, order_file, storage=storage, order_cache_size=order_cache_size,
+                     receipt_file=receipt_file, reward_file=reward_file)
+    # the loaded records live until the program ends: keep them out of the garbage collector's
+    # full collections, which would otherwise stop the till while they walk millions of objects
+    gc.freeze()
+    if price_file:
+        app.import_prices(price_file)
+    if transaction_file:
+        app.process_transaction_file(transaction_file)
+        app.save_and_exit()
+    else:
+        app.main_menu()
+    if metrics_file:
+        metrics.stop_reporter()
+        metrics.write_prometheus(metrics_file)
 
 
 
@@ -0,0 +1,181 @@
+import sys
+import datetime
+from ProgFunA2 import Operations, VIPCustomer, Bundle
+
+try:
+    import numpy as np
+except ImportError: # NumPy is only needed for the reports
+    np = None
+
+# End-of-day sales and reward reports over the whole order history.
+# The orders are loaded once into NumPy columns and every report is a vectorized group-by.
+# Needs NumPy (pip install numpy).
+# Usage: python analytics.py [customers.txt products.txt orders.txt] [--top 10]
+
+class OrderColumns:
+    # One entry per order in the order arrays and one per product line in the line arrays.
+    # line_order says which order each line belongs to.
+    # With Records(compact=True) the columns are taken straight from the OrderStore arrays,
+    # otherwise they are collected from the order dicts of every customer.
+    def __init__(self, records):
+        if np is None:
+            raise ImportError("The analytics module needs NumPy: pip install numpy")
+        self.customers = records.customers
+        bundle_names = {product.product_name for product in records.products.values() if isinstance(product, Bundle)}
+        if records.order_store is not None:
+            self.read_order_store(records, bundle_names)
+        else:
+            self.read_order_dicts(records, bundle_names)
+
+        # the cost before discounts and reward points, per order
+        self.original_cost = np.bincount(self.line_order, weights=self.line_cost, minlength=len(self.total_cost))
+        # VIP discount rate of each order's customer, 0 for Basic customers
+        discount_rates = np.array([customer.discount_rate if isinstance(customer, VIPCustomer) else 0.0
+                                   for customer in records.customers], dtype=np.float64)
+        self.discount = self.original_cost * discount_rates[self.customer_index] if len(self.customer_index) else np.zeros(0)
+        # whatever is left between the discounted cost and what was paid was paid with reward points ($1 per 10 points)
+        self.redeemed_dollars = np.clip(np.round(self.original_cost - self.discount - self.total_cost), 0, None)
+
+    def read_order_store(self, records, bundle_names):
+        # orders of customers loaded lazily must be in the store first
+        for customer in records.customers:
+            customer.order_history
+        store = records.order_store
+        self.product_names = store.product_names
+        self.customer_index = np.array(store.customer_index, dtype=np.int64)
+        self.total_cost = np.frombuffer(store.total_cost, dtype=np.float64).copy()
+        self.earned_rewards = np.array(store.earned_rewards, dtype=np.int64)
+        line_start = np.array(store.line_start, dtype=np.int64)
+        self.line_order = np.repeat(np.arange(len(self.total_cost)), np.diff(line_start))
+        self.line_product = np.array(store.product_index, dtype=np.int64)
+        self.line_cost = np.frombuffer(store.unit_price, dtype=np.float64) * np.array(store.quantity, dtype=np.float64)
+        is_bundle = np.array([name in bundle_names for name in self.product_names], dtype=bool)
+        self.line_is_bundle = is_bundle[self.line_product] if len(self.line_product) else np.zeros(0, dtype=bool)
+        # the order times are local times: convert each distinct hour once, not each order
+        hours, inverse = np.unique(np.array(store.order_time, dtype=np.int64) // 3600, return_inverse=True)
+        local_hours = [datetime.datetime.fromtimestamp(int(hour) * 3600) for hour in hours]
+        self.day = np.array([t.year * 10000 + t.month * 100 + t.day for t in local_hours], dtype=np.int64)[inverse]
+        self.hour = np.array([t.hour for t in local_hours], dtype=np.int64)[inverse]
+
+    def read_order_dicts(self, records, bundle_names):
+        self.product_names = []
+        product_numbers = {}
+
+        customer_index, total_cost, earned_rewards, day, hour = [], [], [], [], []
+        line_order, line_product, line_cost, line_is_bundle = [], [], [], []
+        for number, customer in enumerate(records.customers):
+            for order in customer.order_history:
+                order_number = len(total_cost)
+                for product_name, unit_price, quantity in order['products']:
+                    product_number = product_numbers.get(product_name)
+                    if product_number is None:
+                        product_number = product_numbers[product_name] = len(self.product_names)
+                        self.product_names.append(product_name)
+                    line_order.append(order_number)
+                    line_product.append(product_number)
+                    line_cost.append(unit_price * quantity)
+                    line_is_bundle.append(product_name in bundle_names)
+                # "dd/mm/yyyy HH:MM:SS" -> day as yyyymmdd and the hour
+                date, time = order['order_time'].split()
+                day_of_month, month, year = date.split("/")
+                customer_index.append(number)
+                total_cost.append(order['total_cost'])
+                earned_rewards.append(order['earned_rewards'])
+                day.append(int(year) * 10000 + int(month) * 100 + int(day_of_month))
+                hour.append(int(time.split(":")[0]))
+
+        self.customer_index = np.array(customer_index, dtype=np.int64)
+        self.total_cost = np.array(total_cost, dtype=np.float64)
+        self.earned_rewards = np.array(earned_rewards, dtype=np.int64)
+        self.day = np.array(day, dtype=np.int64)
+        self.hour = np.array(hour, dtype=np.int64)
+        self.line_order = np.array(line_order, dtype=np.int64)
+        self.line_product = np.array(line_product, dtype=np.int64)
+        self.line_cost = np.array(line_cost, dtype=np.float64)
+        self.line_is_bundle = np.array(line_is_bundle, dtype=bool)
+
+    def __len__(self):
+        return len(self.total_cost)
+
+    # revenue of each product: gross is price * quantity, net shares each order's paid total out over its lines
+    def revenue_by_product(self):
+        gross = np.bincount(self.line_product, weights=self.line_cost, minlength=len(self.product_names))
+        paid_share = np.divide(self.total_cost, self.original_cost, out=np.zeros_like(self.total_cost), where=self.original_cost > 0)
+        net = np.bincount(self.line_product, weights=self.line_cost * paid_share[self.line_order], minlength=len(self.product_names))
+        order = np.argsort(-net)
+        return [(self.product_names[i], float(gross[i]), float(net[i])) for i in order]
+
+    def revenue_by_day(self):
+        days, inverse = np.unique(self.day, return_inverse=True)
+        revenue = np.bincount(inverse, weights=self.total_cost)
+        counts = np.bincount(inverse)
+        return [(f"{day % 100:02d}/{day // 100 % 100:02d}/{day // 10000}", int(count), float(total))
+                for day, count, total in zip(days, counts, revenue)]
+
+    def revenue_by_hour(self):
+        revenue = np.bincount(self.hour, weights=self.total_cost, minlength=24)
+        counts = np.bincount(self.hour, minlength=24)
+        return [(hour, int(counts[hour]), float(revenue[hour])) for hour in range(24) if counts[hour]]
+
+    def top_customers(self, count=10):
+        spend = np.bincount(self.customer_index, weights=self.total_cost, minlength=len(self.customers))
+        top = np.argsort(-spend)[:count]
+        return [(self.customers[i].ID, self.customers[i].name, float(spend[i])) for i in top if spend[i] > 0]
+
+    def vip_discount_given(self):
+        return float(self.discount.sum())
+
+    def rewards(self):
+        return {
+            'issued': int(self.earned_rewards.sum()),
+            'redeemed': int(self.redeemed_dollars.sum() * 10),
+        }
+
+    # share of orders with at least one bundle, and the share of orders that contain each bundle
+    def bundle_attach_rates(self):
+        if len(self) == 0:
+            return 0.0, []
+        orders_with_bundle = np.zeros(len(self), dtype=bool)
+        orders_with_bundle[self.line_order[self.line_is_bundle]] = True
+        bundle_lines = np.flatnonzero(self.line_is_bundle)
+        # count each (order, bundle) pair once
+        pairs = np.unique(self.line_order[bundle_lines] * len(self.product_names) + self.line_product[bundle_lines])
+        per_bundle = np.bincount(pairs % len(self.product_names), minlength=len(self.product_names))
+        rates = [(self.product_names[i], float(per_bundle[i] / len(self))) for i in np.argsort(-per_bundle) if per_bundle[i]]
+        return float(orders_with_bundle.mean()), rates
+
+def print_report(columns, top=10):
+    print(f"{len(columns)} orders, revenue {columns.total_cost.sum():.2f}")
+    print("\nRevenue by product (gross / net)")
+    for name, gross, net in columns.revenue_by_product():
+        print(f"{name.ljust(25)} {gross:>12.2f} {net:>12.2f}")
+    print("\nRevenue by day")
+    for day, count, total in columns.revenue_by_day():
+        print(f"{day.ljust(12)} {count:>8} orders {total:>12.2f}")
+    print("\nRevenue by hour")
+    for hour, count, total in columns.revenue_by_hour():
+        print(f"{hour:02d}:00        {count:>8} orders {total:>12.2f}")
+    print(f"\nTop {top} customers")
+    for ID, name, spend in columns.top_customers(top):
+        print(f"{ID.ljust(8)} {name.ljust(20)} {spend:>12.2f}")
+    rewards = columns.rewards()
+    print(f"\nVIP discount given: {columns.vip_discount_given():.2f}")
+    print(f"Reward points issued: {rewards['issued']}, redeemed: {rewards['redeemed']}")
+    attach_rate, rates = columns.bundle_attach_rates()
+    print(f"\nBundle attach rate: {attach_rate:.1%}")
+    for name, rate in rates:
+        print(f"{name.ljust(25)} {rate:.1%}")
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    top = 10
+    if len(arguments) >= 2 and arguments[-2] == '--top':
+        top = int(arguments[-1])
+        arguments = arguments[:-2]
+    if len(arguments) not in [0, 3]:
+        print("Usage: python analytics.py [customers.txt products.txt orders.txt] [--top 10]")
+        sys.exit(1)
+    files = arguments or ["customers.txt", "products.txt", "orders.txt"]
+    # the orders are kept in the compact order store while the columns are built
+    app = Operations(*files, compact_orders=True, compact_every=float('inf'))
+    print_report(OrderColumns(app.records), top)
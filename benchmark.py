@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import contextlib
+from ProgFunA2 import Operations, write_snapshot
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+# Benchmarks for the hot paths of Records and Operations on synthetic data.
+# Usage:
+#   python benchmark.py [--scale 100000] [--save baseline.json] [--compare baseline.json] [--data folder]
+#   python benchmark.py --generate folder [--scale 100000]
+# --scale is the number of order lines; there are scale/10 customers and scale/100 products.
+# --compare exits with 1 if any benchmark is more than 20% slower than the baseline.
+
+REGRESSION_LIMIT = 0.2
+
+# a unique name made of letters only, as customer names must be alphabetic
+def letters_name(number):
+    name = ""
+    number += 1
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        name = chr(ord('a') + remainder) + name
+    return name.capitalize()
+
+# write customers.txt, products.txt (with bundles) and orders.txt in the formats read by Records
+def generate_data(folder, scale, seed=1):
+    random_numbers = random.Random(seed)
+    customer_count = max(10, scale // 10)
+    product_count = max(10, scale // 100)
+    bundle_count = max(2, product_count // 10)
+    with open(os.path.join(folder, "customers.txt"), 'w') as file:
+        for i in range(1, customer_count + 1):
+            if i % 5 == 0:
+                file.write(f"V{i},{letters_name(i)},1.0,0.08,{random_numbers.randint(0, 500)}\n")
+            else:
+                file.write(f"B{i},{letters_name(i)},1.0,{random_numbers.randint(0, 500)}\n")
+    product_names = []
+    with open(os.path.join(folder, "products.txt"), 'w') as file:
+        for i in range(1, product_count + 1):
+            name = f"product{i}"
+            product_names.append(name)
+            prescription = 'y' if i % 7 == 0 else 'n'
+            file.write(f"P{i},{name},{random_numbers.randint(100, 5000) / 100},{prescription}\n")
+        for i in range(product_count + 1, product_count + bundle_count + 1):
+            name = f"bundle{i}"
+            product_names.append(name)
+            components = ",".join(f"P{random_numbers.randint(1, product_count)}" for _ in range(random_numbers.randint(2, 4)))
+            file.write(f"B{i},{name},{components}\n")
+    start_time = time.mktime((2024, 1, 1, 8, 0, 0, 0, 0, -1))
+    with open(os.path.join(folder, "orders.txt"), 'w') as file:
+        for i in range(scale):
+            customer = random_numbers.randint(1, customer_count)
+            customer_ID = f"V{customer}" if customer % 5 == 0 else f"B{customer}"
+            products = ",".join(f"{random_numbers.choice(product_names)},{random_numbers.randint(1, 3)}" for _ in range(random_numbers.randint(1, 3)))
+            order_time = time.strftime("%d/%m/%Y %H:%M:%S", time.localtime(start_time + i * 60))
+            file.write(f"{customer_ID},{products},{random_numbers.randint(100, 20000) / 100:.2f},{random_numbers.randint(1, 200)},{order_time}\n")
+    return customer_count, product_count + bundle_count
+
+# peak memory of the process so far, in MB
+def peak_memory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+def timed(results, name, operations, function):
+    start_time = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start_time
+    results[name] = {
+        'operations': operations,
+        'seconds': round(seconds, 4),
+        'per_second': round(operations / seconds, 1) if seconds > 0 else None,
+        'peak_memory_mb': peak_memory(),
+    }
+    print(f"{name.ljust(22)} {operations:>10} ops {seconds:>9.3f} s {results[name]['per_second'] or 0:>14.0f} ops/s  peak {results[name]['peak_memory_mb']} MB")
+
+def run_benchmarks(folder, scale):
+    results = {}
+    files = [os.path.join(folder, name) for name in ("customers.txt", "products.txt", "orders.txt")]
+    app = None
+    def load():
+        nonlocal app
+        app = Operations(*files, journal_file=os.path.join(folder, "journal.txt"), compact_every=float('inf'), use_snapshot=False)
+    with open(files[2]) as file:
+        order_lines = sum(1 for line in file)
+    timed(results, 'load', order_lines, load)
+
+    snapshot_file = os.path.join(folder, "snapshot.bin")
+    write_snapshot(app.records, snapshot_file, files)
+    def load_snapshot():
+        snapshot_app = Operations(*files, journal_file=os.path.join(folder, "journal.txt"), snapshot_file=snapshot_file)
+        snapshot_app.storage.close()
+    timed(results, 'load_snapshot', order_lines, load_snapshot)
+
+    records = app.records
+    random_numbers = random.Random(2)
+    customer_keys = [random_numbers.choice(records.customers).name for _ in range(100000)]
+    product_keys = [random_numbers.choice(list(records.products.values())).product_name for _ in range(100000)]
+    timed(results, 'find_customer', len(customer_keys), lambda: [records.find_customer(key) for key in customer_keys])
+    timed(results, 'find_product', len(product_keys), lambda: [records.find_product(key) for key in product_keys])
+
+    plain_products = [product for product in records.products.values() if not product.dr_prescription][:50]
+    purchase_count = min(1000, max(100, scale // 100))
+    def purchases():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for i in range(purchase_count):
+                product = plain_products[i % len(plain_products)]
+                app.purchase(records.customers[i % len(records.customers)], [product.product_name], [1 + i % 3])
+    timed(results, 'purchase', purchase_count, purchases)
+
+    transactions = [(records.customers[i % len(records.customers)].name, [(plain_products[i % len(plain_products)].product_ID, 1)], False)
+                    for i in range(min(100000, scale))]
+    timed(results, 'process_transactions', len(transactions), lambda: app.process_transactions(transactions))
+
+    product_IDs = [product.product_ID for product in records.products.values() if product.product_ID.startswith('P')]
+    update_IDs = [random_numbers.choice(product_IDs) for _ in range(min(10000, len(product_IDs) * 10))]
+    timed(results, 'update_bundles', len(update_IDs), lambda: [app.update_bundles(ID) for ID in update_IDs])
+
+    timed(results, 'save_customers', len(records.customers), lambda: records.save_customers(os.path.join(folder, "customers.out")))
+    timed(results, 'save_products', len(records.products), lambda: records.save_products(os.path.join(folder, "products.out")))
+    timed(results, 'save_orders', order_lines + purchase_count + len(transactions), lambda: records.save_orders(os.path.join(folder, "orders.out")))
+
+    heavy_customer = max(records.customers, key=lambda customer: customer.order_count)
+    def customer_history():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            rows = ((f'Order {idx}', order) for idx, order in enumerate(heavy_customer.order_history, start=1))
+            app.print_order_pages(rows, '     ', 10, False, page_size=None)
+    timed(results, 'display_customer_history', heavy_customer.order_count, customer_history)
+    def all_orders():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            app.display_all_orders(page_size=None)
+    timed(results, 'display_all_orders', sum(customer.order_count for customer in records.customers), all_orders)
+    app.storage.close()
+    return results
+
+# compare throughput with a saved baseline, return the names of the benchmarks that got slower
+def compare(results, baseline, scale):
+    if baseline.get('scale') != scale:
+        print(f"Note: the baseline was run at scale {baseline.get('scale')}, this run is at scale {scale}.")
+    slower = []
+    for name, result in results.items():
+        old = baseline.get('results', {}).get(name)
+        if not old or not old.get('per_second') or not result['per_second']:
+            continue
+        change = result['per_second'] / old['per_second'] - 1
+        status = "SLOWER" if change < -REGRESSION_LIMIT else "ok"
+        print(f"{name.ljust(22)} {old['per_second']:>14.0f} -> {result['per_second']:>14.0f} ops/s ({change:+.0%}) {status}")
+        if status == "SLOWER":
+            slower.append(name)
+    return slower
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    options = {}
+    while arguments:
+        option = arguments.pop(0)
+        if option not in ('--scale', '--save', '--compare', '--data', '--generate') or not arguments:
+            print("Usage: python benchmark.py [--scale 100000] [--save baseline.json] [--compare baseline.json] [--data folder]")
+            print("       python benchmark.py --generate folder [--scale 100000]")
+            sys.exit(1)
+        options[option] = arguments.pop(0)
+    scale = int(options.get('--scale', 100000))
+
+    if '--generate' in options:
+        os.makedirs(options['--generate'], exist_ok=True)
+        customer_count, product_count = generate_data(options['--generate'], scale)
+        print(f"Wrote {customer_count} customers, {product_count} products and {scale} orders to {options['--generate']}")
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as folder:
+        if '--data' in options:
+            # work on a copy, the benchmarks add orders
+            for name in ("customers.txt", "products.txt", "orders.txt"):
+                with open(os.path.join(options['--data'], name)) as source, open(os.path.join(folder, name), 'w') as target:
+                    for line in source:
+                        target.write(line)
+        else:
+            generate_data(folder, scale)
+        results = run_benchmarks(folder, scale)
+
+    report = {'scale': scale, 'python': sys.version.split()[0], 'results': results}
+    if '--save' in options:
+        with open(options['--save'], 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Saved baseline to {options['--save']}")
+    if '--compare' in options:
+        with open(options['--compare']) as file:
+            slower = compare(results, json.load(file), scale)
+        if slower:
+            print(f"Slower than the baseline: {', '.join(slower)}")
+            sys.exit(1)
@@ -0,0 +1,333 @@
+import gc
+import sys
+import json
+import signal
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from ProgFunA2 import (Operations, BasicCustomer, VIPCustomer, Bundle, InvalidCustomer, InvalidProduct, InvalidReward,
+                       CUSTOMER_FILTERS, CUSTOMER_LISTING_SORTS, PRODUCT_FILTERS, PRODUCT_LISTING_SORTS, metrics, parse_order_time)
+
+# A local checkout service so that many tills can share one Operations object.
+# Each request is one line of JSON sent over TCP, e.g.
+#   {"op": "purchase", "customer": "Alice", "items": [["vitaminC", 2]], "prescription": false}
+# and each answer is one line of JSON: {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+# Operations: purchase, customer, customers, products, search, history, receipt, set_reward_rate, set_discount_rate,
+# import_prices, which applies a price file on the server while the tills keep selling,
+# and metrics, which returns the Prometheus text of ProgFunA2.metrics (enable it with --metrics).
+# customers and products answer a page at a time as {"items": [...], "cursor": ...}; the cursor is sent back
+# for the next page and is null after the last one. kind, sort and limit are optional:
+#   {"op": "customers", "kind": "vip", "sort": "name", "limit": 500, "cursor": [["alice", "V2"], 1]}
+# With --receipts every receipt is archived, and receipt returns the text of one again:
+#   {"op": "receipt", "customer": "Alice", "order": 3}
+# With --rewards the reward points are kept in a ledger: adjust_reward adds or takes off points,
+# and reward_balance gives the points at a past time:
+#   {"op": "adjust_reward", "customer": "Alice", "points": -50}
+#   {"op": "reward_balance", "customer": "Alice", "at": "18/10/2026 15:28:12"}
+# Usage: python checkout_service.py [--port 8765] [--metrics] [--receipts receipts.txt] [--rewards rewards.txt]
+#        [customers.txt products.txt] [orders.txt]
+
+# the JSON of a customer and of a product in the answers
+def customer_info(customer):
+    info = {'ID': customer.ID, 'name': customer.name, 'reward': customer.reward}
+    if isinstance(customer, VIPCustomer):
+        info['type'] = 'VIP'
+        info['reward_rate'] = VIPCustomer.get_reward_rate()
+        info['discount_rate'] = customer.discount_rate
+    else:
+        info['type'] = 'Basic'
+        info['reward_rate'] = BasicCustomer.get_reward_rate()
+    return info
+
+def product_info(product):
+    info = {'ID': product.product_ID, 'name': product.product_name,
+            'unit_price': product.unit_price, 'prescription': product.dr_prescription}
+    if isinstance(product, Bundle):
+        info['component'] = list(product.component)
+    return info
+
+# the most customers or products sent in one answer
+PAGE_SIZE = 1000
+
+# the types in the cursor of each sort: the sort key, then the position of the customer or the ID of the product
+CURSOR_SORT_KEYS = {'ID': (str, int, str), 'name': (str, str)}
+
+# the keys of the listings are tuples, which come back from JSON as lists
+# a cursor of another shape would fail to compare with the keys, so it is checked against shape first
+def read_cursor(cursor, shape):
+    if isinstance(shape, tuple):
+        if not isinstance(cursor, list) or len(cursor) != len(shape):
+            raise ValueError("Invalid cursor, send back the cursor of the last page.")
+        return tuple(read_cursor(value, value_shape) for value, value_shape in zip(cursor, shape))
+    if type(cursor) is not shape:
+        raise ValueError("Invalid cursor, send back the cursor of the last page.")
+    return cursor
+
+# the kind, sort, cursor and page size of a listing request
+# position is the type that follows the sort key in a cursor: int for customers, str for products
+def listing_options(request, filters, sorts, position):
+    kind = request.get('kind')
+    sort = request.get('sort', 'ID')
+    if kind is not None and kind not in filters:
+        raise ValueError(f"Unknown kind {kind}, use one of: {', '.join(filters)}.")
+    if sort not in sorts:
+        raise ValueError(f"Unknown sort {sort}, use one of: {', '.join(sorts)}.")
+    limit = int(request.get('limit', PAGE_SIZE))
+    if not 0 < limit <= PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {PAGE_SIZE}.")
+    cursor = request.get('cursor')
+    if cursor is not None:
+        cursor = read_cursor(cursor, (CURSOR_SORT_KEYS[sort], position))
+    return kind, sort, cursor, limit
+
+# one page of the (cursor, item) pairs of Records.iter_customers or iter_products
+def listing_page(items, limit, info):
+    page = []
+    cursor = None
+    for key, item in items:
+        if len(page) == limit:
+            return {'items': page, 'cursor': cursor}
+        page.append(info(item))
+        cursor = key
+    return {'items': page, 'cursor': None}
+
+# the answer to a purchase, customer is the customer_info after the sale
+def sale_info(sale, customer):
+    return {
+        'customer': customer,
+        'products': sale['detail'],
+        'original_total_cost': sale['original_total_cost'],
+        'discount': sale['discount'],
+        'reward_deduction': sale['reward_deduction'],
+        'total_cost': sale['final_total_cost'],
+        'earned_rewards': sale['reward'],
+        'order_time': sale['order']['order_time'],
+    }
+
+class CheckoutService:
+    # flush_interval: seconds between writing the journal to disk
+    # compact_every: journal entries before the data files are rewritten, done in the background
+    def __init__(self, app, host="127.0.0.1", port=8765, workers=8, flush_interval=0.5, compact_every=10000):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        # requests run on worker threads, so a till waiting for a lock never holds up the others
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.server = None
+        self.operations = {
+            'purchase': self.purchase,
+            'customer': self.customer,
+            'customers': self.customers,
+            'products': self.products,
+            'search': self.search,
+            'history': self.history,
+            'receipt': self.receipt,
+            'adjust_reward': self.adjust_reward,
+            'reward_balance': self.reward_balance,
+            'set_reward_rate': self.set_reward_rate,
+            'set_discount_rate': self.set_discount_rate,
+            'import_prices': self.import_prices,
+            'metrics': self.metrics,
+        }
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.flusher = asyncio.create_task(self.flush_in_background())
+
+    # serve until Ctrl+C or SIGTERM, then save everything
+    async def serve_forever(self):
+        await self.start()
+        print(f"Checkout service listening on {self.host}:{self.port}")
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, stopped.set)
+            except (NotImplementedError, RuntimeError): # not available on Windows
+                pass
+        try:
+            await stopped.wait()
+        finally:
+            await self.stop()
+            print("Checkout service stopped.")
+
+    async def stop(self):
+        self.flusher.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.app.compact)
+        self.app.save_and_exit()
+        self.executor.shutdown()
+
+    # write the journal to disk and fold it into the data files away from the request path
+    async def flush_in_background(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await loop.run_in_executor(self.executor, self.app.sync)
+            if self.app.storage.count >= self.compact_every:
+                await loop.run_in_executor(self.executor, self.app.compact)
+
+    async def handle_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError: # longer than the stream's limit, the rest of it cannot be told from the next request
+                    writer.write(json.dumps({'ok': False, 'error': "Request too long."}).encode('utf-8') + b"\n")
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                response = await loop.run_in_executor(self.executor, self.handle_request, line)
+                try:
+                    answer = json.dumps(response)
+                except (TypeError, ValueError) as e:
+                    answer = json.dumps({'ok': False, 'error': f"The answer could not be sent: {e}"})
+                writer.write(answer.encode('utf-8') + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def handle_request(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("A request must be a JSON object.")
+            operation = self.operations.get(request.get('op'))
+            if operation is None:
+                raise ValueError(f"Unknown operation: {request.get('op')}")
+            return {'ok': True, 'result': operation(request)}
+        except (InvalidCustomer, InvalidProduct, InvalidReward, ValueError, TypeError, KeyError) as e:
+            return {'ok': False, 'error': str(e)}
+        except Exception as e:
+            # any other error is answered too, so one bad request never drops the till's connection
+            print(f"Request {line[:200]!r} failed: {type(e).__name__}: {e}", file=sys.stderr)
+            return {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+    def find_customer(self, request):
+        customer = self.app.records.find_customer(str(request['customer']))
+        if customer is None:
+            raise InvalidCustomer(f"Customer {request['customer']} not found.")
+        return customer
+
+    def purchase(self, request):
+        items = [(str(name), int(quantity)) for name, quantity in request['items']]
+        # the journal is written to disk by the background flusher, never while a till waits
+        sale = self.app.sell(str(request['customer']), items, bool(request.get('prescription', False)), sync=False)
+        if sale is None:
+            raise InvalidProduct("No eligible products to purchase after filtering out prescription-required items.")
+        return sale_info(sale, customer_info(self.app.records.find_customer(str(request['customer']))))
+
+    def customer(self, request):
+        return customer_info(self.find_customer(request))
+
+    def customers(self, request):
+        kind, sort, cursor, limit = listing_options(request, CUSTOMER_FILTERS, CUSTOMER_LISTING_SORTS, int)
+        return listing_page(self.app.records.iter_customers(kind, sort, cursor), limit, customer_info)
+
+    def products(self, request):
+        kind, sort, cursor, limit = listing_options(request, PRODUCT_FILTERS, PRODUCT_LISTING_SORTS, str)
+        return listing_page(self.app.records.iter_products(kind, sort, cursor), limit, product_info)
+
+    # products whose name or ID starts with the text, or failing that names close to it
+    def search(self, request):
+        products = self.app.records.search_products(str(request['text']), int(request.get('limit', 5)))
+        return [{'ID': product.product_ID, 'name': product.product_name, 'unit_price': product.unit_price}
+                for product in products]
+
+    def history(self, request):
+        return list(self.find_customer(request).order_history)
+
+    # the archived receipt of the customer's order, numbered from 1 in the order of the history
+    def receipt(self, request):
+        customer = self.find_customer(request)
+        receipt = self.app.receipts.receipt(customer.ID, int(request['order']))
+        if receipt is None:
+            raise ValueError(f"No receipt of order {request['order']} of {customer.ID} was archived.")
+        return receipt
+
+    def adjust_reward(self, request):
+        return self.app.adjust_reward(self.find_customer(request), int(request['points']), sync=False)
+
+    # the points now, or just after "at" given as an order time
+    def reward_balance(self, request):
+        customer = self.find_customer(request)
+        if 'at' not in request:
+            return customer.reward
+        return self.app.reward_balance_at(customer, parse_order_time(str(request['at'])))
+
+    def set_reward_rate(self, request):
+        rate = float(request['rate'])
+        if rate <= 0:
+            raise ValueError("Reward rate must be a positive number.")
+        BasicCustomer.set_reward_rate(rate)
+        self.app.log_change('reward_rate', rate, sync=False)
+        return rate
+
+    def set_discount_rate(self, request):
+        customer = self.find_customer(request)
+        if not isinstance(customer, VIPCustomer):
+            raise InvalidCustomer("Please enter a existing VIP customer.")
+        rate = float(request['rate'])
+        if rate <= 0:
+            raise ValueError("Discount rate must be a positive number.")
+        customer.set_discount_rate(rate)
+        self.app.log_change('discount_rate', f"{customer.ID},{rate}", sync=False)
+        return rate
+
+    # {"op": "import_prices", "file": "prices.csv"}: nothing is changed if any line is invalid
+    def import_prices(self, request):
+        try:
+            changed, errors = self.app.records.import_prices(str(request['file']))
+        except FileNotFoundError:
+            raise ValueError(f"Price file {request['file']} not found.")
+        if errors:
+            raise ValueError(f"{len(errors)} invalid lines, no prices were changed: " + "; ".join(errors[:5]))
+        # the journal is written to disk by the background flusher
+        self.app.log_products(changed, sync=False)
+        return {'changed': len(changed)}
+
+    def metrics(self, request):
+        return metrics.prometheus_text()
+
+if __name__ == '__main__':
+    port = 8765
+    arguments = sys.argv[1:]
+    if len(arguments) >= 2 and arguments[0] == '--port':
+        port = int(arguments[1])
+        arguments = arguments[2:]
+    if arguments and arguments[0] == '--metrics':
+        metrics.enable()
+        metrics.start_reporter(60, log=lambda summary: print(summary, file=sys.stderr))
+        arguments = arguments[1:]
+    receipt_file = None
+    if len(arguments) >= 2 and arguments[0] == '--receipts':
+        receipt_file = arguments[1]
+        arguments = arguments[2:]
+    reward_file = None
+    if len(arguments) >= 2 and arguments[0] == '--rewards':
+        reward_file = arguments[1]
+        arguments = arguments[2:]
+    if len(arguments) not in [0, 2, 3]:
+        print("Usage: python checkout_service.py [--port 8765] [--metrics] [--receipts receipts.txt] [--rewards rewards.txt] "
+              "[customers.txt products.txt] [orders.txt]")
+        sys.exit(1)
+    customer_file = arguments[0] if arguments else "customers.txt"
+    product_file = arguments[1] if arguments else "products.txt"
+    order_file = arguments[2] if len(arguments) == 3 else ("orders.txt" if not arguments else None)
+
+    # compaction is left to the service's background flusher
+    app = Operations(customer_file, product_file, order_file, compact_every=float('inf'), receipt_file=receipt_file,
+                     reward_file=reward_file)
+    # the loaded records live as long as the service: keep them out of the garbage collector's
+    # full collections, which would otherwise stop every till while they walk millions of objects
+    gc.freeze()
+    service = CheckoutService(app, port=port)
+    asyncio.run(service.serve_forever())
@@ -0,0 +1,87 @@
+import os
+import sys
+import shutil
+import random
+import tempfile
+import multiprocessing
+import ProgFunA2
+from ProgFunA2 import Operations, Records, Journal
+from stress_checkout import write_data
+
+# Crash a compaction after each of its steps and check that a restart loads the same records as a
+# compaction that finished: no order twice and no reward points counted twice or lost.
+# A step is a call of one of the functions in STEPS during the compaction; the crash is os._exit,
+# so nothing is closed or flushed on the way out.
+# Usage: python crash_check.py [purchases]
+
+STEPS = [(Records, 'save_customers'), (Records, 'save_products'), (Records, 'append_orders'), (ProgFunA2, 'sync_file'),
+         (os, 'replace'), (shutil, 'copyfileobj'), (Journal, 'clear'), (os, 'remove')]
+
+def open_app(folder):
+    return Operations(os.path.join(folder, "customers.txt"), os.path.join(folder, "products.txt"),
+                      os.path.join(folder, "orders.txt"), compact_every=10**9)
+
+# make the purchases and compact, leaving the process after crash_after steps of the compaction
+# every step is counted into steps, so a run without a crash tells how many there are
+def run(folder, purchases, crash_after, steps):
+    app = open_app(folder)
+    random_numbers = random.Random(1)
+    app.find_or_register_customer("Dave")
+    for i in range(purchases):
+        customer = app.records.find_customer(random_numbers.choice(["Alice", "Bob", "Carol", "Dave"]))
+        product = app.records.find_product(random_numbers.choice(["vitaminC", "vitaminE", "vitaminPack"]))
+        app.checkout(customer, [product], [random_numbers.randint(1, 5)])
+
+    def crash_after_step(function):
+        def step(*args, **kwargs):
+            result = function(*args, **kwargs)
+            steps.value += 1
+            if steps.value == crash_after:
+                os._exit(1)
+            return result
+        return step
+    for owner, name in STEPS:
+        setattr(owner, name, crash_after_step(getattr(owner, name)))
+    app.compact()
+    os._exit(0)
+
+# what a restart sees: the reward points and orders of every customer and the price of every product
+def records_state(folder):
+    app = open_app(folder)
+    state = ({customer.ID: (customer.name, customer.reward, len(customer.order_history)) for customer in app.records.customers},
+             {product.product_ID: product.unit_price for product in app.records.products.values()})
+    app.storage.close()
+    return state
+
+def run_in_process(folder, purchases, crash_after):
+    steps = multiprocessing.Value('i', 0)
+    process = multiprocessing.Process(target=run, args=(folder, purchases, crash_after, steps))
+    process.start()
+    process.join()
+    return steps.value
+
+if __name__ == '__main__':
+    purchases = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with tempfile.TemporaryDirectory() as root:
+        folder = os.path.join(root, "finished")
+        os.makedirs(folder)
+        write_data(folder)
+        step_count = run_in_process(folder, purchases, 0)
+        expected = records_state(folder)
+        print(f"A compaction takes {step_count} steps")
+        ok = True
+        for crash_after in range(1, step_count + 1):
+            folder = os.path.join(root, f"crash-{crash_after}")
+            os.makedirs(folder)
+            write_data(folder)
+            run_in_process(folder, purchases, crash_after)
+            # start twice, the first start may have to finish the compaction
+            for start in (1, 2):
+                state = records_state(folder)
+                if state != expected:
+                    ok = False
+                    print(f"Crash after step {crash_after}, start {start}: the records differ")
+                    for customer_ID, (name, reward, order_count) in state[0].items():
+                        print(f"  {customer_ID}: {reward} points, {order_count} orders, expected {expected[0].get(customer_ID)}")
+        print("OK" if ok else "FAILED")
+        sys.exit(0 if ok else 1)
@@ -0,0 +1,77 @@
+import sys
+import json
+import time
+import random
+import asyncio
+
+# Send purchases to a running checkout_service.py from many tills at once and report latency.
+# Usage: python load_generator.py [--port 8765] [tills] [purchases per till]
+
+# customers and products read per request; answers are single lines, and asyncio
+# refuses lines longer than its limit (64 KB unless it is given a larger one)
+PAGE_SIZE = 200
+LINE_LIMIT = 1 << 20
+
+async def send(reader, writer, request):
+    writer.write(json.dumps(request).encode('utf-8') + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+async def run_till(port, till_number, purchases, customers, products, latencies, errors):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=LINE_LIMIT)
+    random_numbers = random.Random(till_number)
+    for i in range(purchases):
+        items = [[random_numbers.choice(products), random_numbers.randint(1, 3)] for _ in range(random_numbers.randint(1, 3))]
+        request = {'op': 'purchase', 'customer': random_numbers.choice(customers), 'items': items, 'prescription': True}
+        start_time = time.perf_counter()
+        response = await send(reader, writer, request)
+        latencies.append(time.perf_counter() - start_time)
+        if not response['ok']:
+            errors.append(response['error'])
+    writer.close()
+
+# every customer or product of the service, a page at a time
+async def read_listing(reader, writer, op):
+    items = []
+    cursor = None
+    while True:
+        page = (await send(reader, writer, {'op': op, 'cursor': cursor, 'limit': PAGE_SIZE}))['result']
+        items += page['items']
+        cursor = page['cursor']
+        if cursor is None:
+            return items
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def main(port, tills, purchases):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=LINE_LIMIT)
+    customers = [customer['name'] for customer in await read_listing(reader, writer, 'customers')]
+    products = [product['name'] for product in await read_listing(reader, writer, 'products')]
+    writer.close()
+    if not customers or not products:
+        print("The service needs at least one customer and one product.")
+        return
+
+    latencies = []
+    errors = []
+    start_time = time.perf_counter()
+    await asyncio.gather(*[run_till(port, i, purchases, customers, products, latencies, errors) for i in range(tills)])
+    seconds = time.perf_counter() - start_time
+
+    latencies.sort()
+    print(f"{len(latencies)} purchases from {tills} tills in {seconds:.2f} seconds ({len(latencies) / seconds:.0f} per second)")
+    print(f"p50 {percentile(latencies, 0.50) * 1000:.2f} ms, p99 {percentile(latencies, 0.99) * 1000:.2f} ms, "
+          f"max {latencies[-1] * 1000:.2f} ms")
+    if errors:
+        print(f"{len(errors)} purchases failed, e.g. {errors[0]}")
+
+if __name__ == '__main__':
+    port = 8765
+    arguments = sys.argv[1:]
+    if len(arguments) >= 2 and arguments[0] == '--port':
+        port = int(arguments[1])
+        arguments = arguments[2:]
+    tills = int(arguments[0]) if len(arguments) > 0 else 20
+    purchases = int(arguments[1]) if len(arguments) > 1 else 500
+    asyncio.run(main(port, tills, purchases))
@@ -0,0 +1,40 @@
+import sys
+import tracemalloc
+from ProgFunA2 import Records, BasicCustomer
+
+# Compare the memory used by order histories kept as lists of dicts (the default)
+# with the columnar OrderStore used by Records(compact=True).
+# Usage: python measure_memory.py [number of orders]
+
+def build_orders(compact, order_count, customer_count=1000):
+    records = Records(compact=compact)
+    for i in range(customer_count):
+        records.add_customer(BasicCustomer(f"B{i+1}", f"customer{i+1}", 0))
+    # orders read from the file share the product name strings of the Product objects
+    product_names = [f"product{i}" for i in range(500)]
+    for i in range(order_count):
+        # same kind of order as in orders.txt: a few products, a cost, rewards and a time
+        order = {
+            'products': [(product_names[i % 500], 12.5, 2), (product_names[(i*7) % 500], 3.0, 1), (product_names[(i*13) % 500], 8.25, 3)],
+            'total_cost': float(i % 100) + 0.75,
+            'earned_rewards': 53,
+            'order_time': f"{i % 28 + 1:02d}/{i % 12 + 1:02d}/2024 {i % 24:02d}:{i % 60:02d}:{i % 60:02d}"
+        }
+        records.customers[i % customer_count].order_history.append(order)
+    return records
+
+def measure(compact, order_count):
+    tracemalloc.start()
+    records = build_orders(compact, order_count)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+if __name__ == '__main__':
+    order_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    dict_size = measure(False, order_count)
+    compact_size = measure(True, order_count)
+    print(f"{order_count} orders")
+    print(f"list of dicts: {dict_size / 1024 / 1024:.1f} MB ({dict_size / order_count:.0f} bytes per order)")
+    print(f"OrderStore:    {compact_size / 1024 / 1024:.1f} MB ({compact_size / order_count:.0f} bytes per order)")
+    print(f"ratio: {dict_size / compact_size:.1f}x")
@@ -0,0 +1,200 @@
+import os
+import sys
+import csv
+import time
+import multiprocessing
+from decimal import Decimal
+from ProgFunA2 import (Operations, Records, Bundle, pricing, parse_customer_line, parse_product_line,
+                       format_customer_line, format_product_line, read_lines_in_chunks, CENT)
+
+# Re-price every order in an order file against the current catalogue and customer tiers,
+# and report the orders whose stored total or earned rewards do not match.
+# The order file is split into byte ranges that a pool of processes check in parallel; the
+# results are merged in file order, so the report is the same for any number of processes.
+# Each order is checked the way checkout works it out:
+#   earned rewards must be the reward of the discounted total at the current reward rate
+#   the stored total must be the discounted total less a whole number of dollars of redeemed points
+# An order with a product that is no longer in the catalogue is only reported as such and left out of the totals.
+# Usage: python reconcile.py [customers.txt products.txt orders.txt] [--workers 4] [--report discrepancies.csv]
+
+SHOWN_DISCREPANCIES = 20
+# the stored total has two decimals
+TOLERANCE = CENT / 2
+
+# the catalogue of each worker process, set by load_catalogue
+catalogue = None
+
+# build the records of a worker from the customer and product lines of the parent,
+# so every worker prices against the same catalogue, journal changes included
+def load_catalogue(customer_lines, product_lines):
+    global catalogue
+    catalogue = Records()
+    for line in customer_lines:
+        catalogue.add_customer(parse_customer_line(line))
+    for line in product_lines:
+        product = parse_product_line(line)
+        catalogue.add_product(product)
+        if isinstance(product, Bundle):
+            catalogue.dirty_bundles.add(product.product_ID)
+    catalogue.recompute_bundles()
+
+# split the file into about count byte ranges that start and end at line boundaries
+def shard_ranges(filename, count):
+    size = os.path.getsize(filename)
+    starts = [0]
+    with open(filename, 'rb') as file:
+        for i in range(1, count):
+            file.seek(max(size * i // count, starts[-1]))
+            if starts[-1] < file.tell():
+                file.readline() # move to the start of the next line
+            if file.tell() >= size:
+                break
+            if file.tell() > starts[-1]:
+                starts.append(file.tell())
+    return list(zip(starts, starts[1:] + [size]))
+
+# the number of lines in a byte range, counted from the last non-empty line the reader saw
+def count_lines(filename, last_line_number, last_offset, end):
+    with open(filename, 'rb') as file:
+        file.seek(last_offset)
+        tail = file.read(end - last_offset)
+    return max(last_line_number - 1, 0) + tail.count(b"\n") + (1 if tail and not tail.endswith(b"\n") else 0)
+
+# check one byte range of the order file
+# returns (lines in the range, {customer ID: totals}, [(line number in the range, customer ID, kind, stored, expected)])
+def reconcile_shard(filename, start, end):
+    totals = {}
+    discrepancies = []
+    last_line_number, last_offset = 0, start
+    for line_number, offset, line in read_lines_in_chunks(filename, start=start, end=end):
+        last_line_number, last_offset = line_number, offset
+        try:
+            data = [item.strip() for item in line.split(",")]
+            customer_ID = data[0]
+            stored_total = Decimal(data[-3])
+            stored_rewards = int(data[-2])
+            quantities = [int(quantity) for quantity in data[2:-3:2]]
+        except (ValueError, IndexError, ArithmeticError) as e:
+            discrepancies.append((line_number, None, 'format', line, str(e)))
+            continue
+        customer = catalogue.find_customer(customer_ID)
+        if customer is None:
+            discrepancies.append((line_number, customer_ID, 'unknown customer', customer_ID, None))
+            continue
+        products = []
+        basket_quantities = []
+        for product_identifier, quantity in zip(data[1:-3:2], quantities):
+            product = catalogue.find_product(product_identifier)
+            if product is None:
+                discrepancies.append((line_number, customer.ID, 'unknown product', product_identifier, None))
+            products.append(product)
+            basket_quantities.append(quantity)
+        # the rest of the basket says nothing about the order, so it is neither priced nor added to the totals
+        if None in products:
+            continue
+        price = pricing.price(customer, products, basket_quantities)
+
+        # what was paid with points is the gap between the discounted and the stored total
+        redeemed = price['final_total_cost'] - stored_total
+        redeemed_dollars = redeemed.to_integral_value()
+        if redeemed < -TOLERANCE or abs(redeemed - redeemed_dollars) > TOLERANCE:
+            discrepancies.append((line_number, customer.ID, 'total', str(stored_total), str(price['final_total_cost'].quantize(CENT))))
+            redeemed_dollars = 0
+        if stored_rewards != price['reward']:
+            discrepancies.append((line_number, customer.ID, 'reward', str(stored_rewards), str(price['reward'])))
+
+        customer_totals = totals.get(customer.ID)
+        if customer_totals is None:
+            customer_totals = totals[customer.ID] = {'orders': 0, 'spend': Decimal(0), 'stored_rewards': 0,
+                                                     'expected_rewards': 0, 'redeemed_points': 0}
+        customer_totals['orders'] += 1
+        customer_totals['spend'] += stored_total
+        customer_totals['stored_rewards'] += stored_rewards
+        customer_totals['expected_rewards'] += price['reward']
+        customer_totals['redeemed_points'] += int(redeemed_dollars) * 10
+    return count_lines(filename, last_line_number, last_offset, end), totals, discrepancies
+
+# check the whole order file with a pool of processes
+# the shards are merged in file order: totals are summed in the same order and the line numbers
+# of the discrepancies are made absolute, so the result does not depend on the number of workers
+def reconcile(app, order_file, workers=None):
+    workers = workers or os.cpu_count() or 1
+    customer_lines = [format_customer_line(customer) for customer in app.records.customers]
+    product_lines = [format_product_line(product) for product in app.records.products.values()]
+    # more shards than workers, so that a slow shard does not leave the other workers idle
+    shards = shard_ranges(order_file, workers * 4)
+    if workers == 1:
+        load_catalogue(customer_lines, product_lines)
+        results = [reconcile_shard(order_file, start, end) for start, end in shards]
+    else:
+        with multiprocessing.Pool(workers, initializer=load_catalogue, initargs=(customer_lines, product_lines)) as pool:
+            results = pool.starmap(reconcile_shard, [(order_file, start, end) for start, end in shards])
+
+    totals = {}
+    discrepancies = []
+    first_line = 1
+    for line_count, shard_totals, shard_discrepancies in results:
+        for customer_ID, customer_totals in shard_totals.items():
+            merged = totals.get(customer_ID)
+            if merged is None:
+                totals[customer_ID] = customer_totals
+            else:
+                for key, value in customer_totals.items():
+                    merged[key] += value
+        for line_number, *discrepancy in shard_discrepancies:
+            discrepancies.append((first_line + line_number - 1, *discrepancy))
+        first_line += line_count
+    return {'orders': sum(customer_totals['orders'] for customer_totals in totals.values()),
+            'totals': dict(sorted(totals.items())), 'discrepancies': discrepancies}
+
+def print_report(result, seconds, workers):
+    discrepancies = result['discrepancies']
+    print(f"Reconciled {result['orders']} orders in {seconds:.2f} seconds with {workers} processes.")
+    kinds = {}
+    for discrepancy in discrepancies:
+        kinds[discrepancy[2]] = kinds.get(discrepancy[2], 0) + 1
+    print(f"{len(discrepancies)} discrepancies" + (": " + ", ".join(f"{kind} {count}" for kind, count in kinds.items()) if kinds else "."))
+    for line_number, customer_ID, kind, stored, expected in discrepancies[:SHOWN_DISCREPANCIES]:
+        print(f"  line {line_number}: {customer_ID or '-'} {kind}, stored {stored}" + (f", expected {expected}" if expected is not None else ""))
+    if len(discrepancies) > SHOWN_DISCREPANCIES:
+        print(f"  ... and {len(discrepancies) - SHOWN_DISCREPANCIES} more, see --report")
+    differing = [(ID, totals) for ID, totals in result['totals'].items() if totals['stored_rewards'] != totals['expected_rewards']]
+    if differing:
+        print(f"\n{len(differing)} customers earned a different number of reward points than expected")
+        print(f"{'ID'.ljust(8)} {'orders':>8} {'stored':>10} {'expected':>10} {'difference':>10}")
+        for ID, totals in differing[:SHOWN_DISCREPANCIES]:
+            difference = totals['stored_rewards'] - totals['expected_rewards']
+            print(f"{ID.ljust(8)} {totals['orders']:>8} {totals['stored_rewards']:>10} {totals['expected_rewards']:>10} {difference:>+10}")
+
+def write_report(result, filename):
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['line', 'customer', 'kind', 'stored', 'expected'])
+        writer.writerows(result['discrepancies'])
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    options = {}
+    for option in ('--workers', '--report'):
+        if option in arguments:
+            index = arguments.index(option)
+            options[option] = arguments[index + 1] if index + 1 < len(arguments) else None
+            del arguments[index:index + 2]
+    if len(arguments) not in [0, 3] or None in options.values():
+        print("Usage: python reconcile.py [customers.txt products.txt orders.txt] [--workers 4] [--report discrepancies.csv]")
+        sys.exit(1)
+    customer_file, product_file, order_file = arguments or ["customers.txt", "products.txt", "orders.txt"]
+    if not os.path.exists(order_file):
+        print(f"Order file {order_file} not found.")
+        sys.exit(1)
+    workers = int(options.get('--workers', 0)) or os.cpu_count() or 1
+
+    # the catalogue as it is now, with the changes in the journal; the orders stay on disk
+    app = Operations(customer_file, product_file, None, compact_every=float('inf'))
+    start_time = time.perf_counter()
+    result = reconcile(app, order_file, workers)
+    print_report(result, time.perf_counter() - start_time, workers)
+    if '--report' in options:
+        write_report(result, options['--report'])
+        print(f"Wrote {len(result['discrepancies'])} discrepancies to {options['--report']}")
+    app.storage.close()
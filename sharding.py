@@ -0,0 +1,548 @@
+import gc
+import os
+import sys
+import time
+import zlib
+import heapq
+import itertools
+import signal
+import asyncio
+import threading
+import multiprocessing
+from ProgFunA2 import (Operations, BasicCustomer, VIPCustomer, InvalidCustomer, InvalidProduct, InvalidReward, IdAllocator,
+                       id_number, format_customer_line, format_saved_customer_line, format_product_line, format_order_line,
+                       order_timestamp, parse_order_time, parse_transaction_line, read_lines_in_chunks, CUSTOMER_FILTERS,
+                       CUSTOMER_LISTING_SORTS, PRODUCT_FILTERS, PRODUCT_LISTING_SORTS)
+from checkout_service import (CheckoutService, PAGE_SIZE, customer_info, product_info, sale_info, listing_options,
+                              listing_page)
+
+# Split the records over several processes so that checkouts use every core of the machine.
+# Each customer and their order history belong to one shard, chosen from a hash of the customer ID;
+# every shard has a full copy of the catalogue. A shard is an ordinary Operations over its own folder
+# (shard-0, shard-1, ...) with its own data files and journal, run in a worker process.
+# The ShardRouter in the main process knows which shard holds each customer: purchases, lookups and
+# histories go to that shard only, changes to the catalogue and the reward rate go to every shard,
+# and listings are gathered from all of them.
+# The first run splits the given data files into the folder; after that the folder is the data.
+# Usage: python sharding.py [--shards 4] [--folder shards] [--transactions transactions.txt]
+#        [--port 8765] [--receipts] [--rewards] [customers.txt products.txt orders.txt]
+# With --transactions the file is processed by all shards at once, with --port the checkout service
+# of checkout_service.py is served from the shards, otherwise the number of customers per shard is shown.
+
+DATA_FILES = ("customers.txt", "products.txt", "orders.txt")
+SHARD_FILE = "shards.txt"
+# transactions sent to the shards at a time by process_transactions
+BATCH_SIZE = 10000
+
+# the shard of a customer; crc32 gives the same shard in every process and every run, hash() does not
+def shard_of(customer_ID, shard_count):
+    return zlib.crc32(customer_ID.encode('utf-8')) % shard_count
+
+def shard_folder(folder, shard):
+    return os.path.join(folder, f"shard-{shard}")
+
+# the number of shards the folder was split into, or None if it has not been split
+def read_shard_count(folder):
+    try:
+        with open(os.path.join(folder, SHARD_FILE)) as file:
+            return int(file.read().strip())
+    except FileNotFoundError:
+        return None
+
+# write the records of app into shard_count shard folders: the customers and their orders of each
+# shard, and all products in every one. The shard count is written last, so a split that did not
+# finish is done again on the next start.
+def split_records(app, folder, shard_count):
+    files = []
+    for shard in range(shard_count):
+        os.makedirs(shard_folder(folder, shard), exist_ok=True)
+        files.append([open(os.path.join(shard_folder(folder, shard), name), 'w') for name in DATA_FILES])
+    try:
+        product_lines = [format_product_line(product) + "\n" for product in app.records.products.values()]
+        for customer_file, product_file, order_file in files:
+            product_file.writelines(product_lines)
+        for customer, order in app.storage.all_orders():
+            files[shard_of(customer.ID, shard_count)][2].write(format_order_line(customer, order) + "\n")
+        for customer in app.records.customers:
+            files[shard_of(customer.ID, shard_count)][0].write(format_saved_customer_line(customer) + "\n")
+    finally:
+        for shard_files in files:
+            for file in shard_files:
+                file.close()
+    with open(os.path.join(folder, SHARD_FILE), 'w') as file:
+        file.write(f"{shard_count}\n")
+
+# The requests a shard answers, each a function of the shard's Operations and the arguments.
+# Customers are always given by ID: the router has already found them.
+def shard_customer(app, customer_ID):
+    customer = app.records.find_customer(customer_ID)
+    if customer is None:
+        raise InvalidCustomer(f"Customer {customer_ID} not found.")
+    return customer
+
+def shard_sell(app, customer_ID, items, has_prescription, sync):
+    sale = app.sell(customer_ID, items, has_prescription, sync=sync)
+    if sale is None:
+        return None
+    return sale_info(sale, customer_info(shard_customer(app, customer_ID)))
+
+# a new Basic customer with the ID the router gave it
+def shard_register(app, customer_ID, name, sync):
+    customer = BasicCustomer(customer_ID, name, 0)
+    with app.records.change_lock.shared():
+        with app.records.lock, app.storage.transaction():
+            app.records.add_customer(customer)
+            app.storage.log_change('customer', format_customer_line(customer), sync=sync)
+    app.maybe_compact()
+    return customer_info(customer)
+
+# up to limit customers after cursor as (cursor, customer info), for the router to merge with the other shards
+def shard_customers(app, kind, sort, cursor, limit):
+    return [(key, customer_info(customer)) for key, customer in itertools.islice(app.records.iter_customers(kind, sort, cursor), limit)]
+
+# the orders in the window as (timestamp, customer ID, order), oldest first
+def shard_orders_between(app, start, end):
+    return [(order_timestamp(order), customer.ID, order) for customer, order in app.records.orders_between(start, end)]
+
+def shard_receipt(app, customer_ID, number):
+    return app.receipts.receipt(customer_ID, number)
+
+def shard_adjust_reward(app, customer_ID, points, sync):
+    return app.adjust_reward(shard_customer(app, customer_ID), points, sync=sync)
+
+def shard_reward_balance_at(app, customer_ID, when):
+    return app.reward_balance_at(shard_customer(app, customer_ID), when)
+
+def shard_set_reward_rate(app, rate):
+    BasicCustomer.set_reward_rate(rate)
+    app.log_change('reward_rate', rate)
+    return rate
+
+def shard_set_discount_rate(app, customer_ID, rate):
+    customer = shard_customer(app, customer_ID)
+    if not isinstance(customer, VIPCustomer):
+        raise InvalidCustomer("Please enter a existing VIP customer.")
+    customer.set_discount_rate(rate)
+    app.log_change('discount_rate', f"{customer.ID},{rate}")
+    return rate
+
+# every shard applies the same file to the same catalogue, so new products get the same IDs everywhere
+def shard_import_prices(app, filename):
+    try:
+        changed, errors = app.records.import_prices(filename)
+    except FileNotFoundError:
+        raise ValueError(f"Price file {filename} not found.")
+    if errors:
+        raise ValueError(f"{len(errors)} invalid lines, no prices were changed: " + "; ".join(errors[:5]))
+    app.log_products(changed)
+    return len(changed)
+
+# write the journal to disk, and fold it into the data files once it has compact_every entries
+def shard_flush(app, compact_every):
+    app.sync()
+    if app.storage.count >= compact_every:
+        app.compact()
+
+SHARD_OPERATIONS = {
+    'directory': lambda app: [(customer.ID, customer.name) for customer in app.records.customers],
+    'sell': shard_sell,
+    'sell_many': lambda app, transactions: app.process_transactions(transactions),
+    'register': shard_register,
+    'customer': lambda app, customer_ID: customer_info(shard_customer(app, customer_ID)),
+    'customers': shard_customers,
+    'history': lambda app, customer_ID: list(shard_customer(app, customer_ID).order_history),
+    'orders_between': shard_orders_between,
+    'products': lambda app, kind, sort, cursor, limit: listing_page(app.records.iter_products(kind, sort, cursor), limit, product_info),
+    'search': lambda app, text, limit: [product_info(product) for product in app.records.search_products(text, limit)],
+    'receipt': shard_receipt,
+    'adjust_reward': shard_adjust_reward,
+    'reward_balance_at': shard_reward_balance_at,
+    'set_reward_rate': shard_set_reward_rate,
+    'set_discount_rate': shard_set_discount_rate,
+    'import_prices': shard_import_prices,
+    'flush': shard_flush,
+    'close': lambda app: app.save_and_exit(),
+}
+# the errors the router raises again as they are, any other is raised as a ValueError with its name
+SHARD_ERRORS = {error.__name__: error for error in (InvalidCustomer, InvalidProduct, InvalidReward, ValueError, TypeError, KeyError)}
+
+# the loop of a worker process: answer one request at a time until the router closes the shard
+# each answer is (True, result) or (False, error class name, message)
+def serve_shard(folder, connection, compact_every, receipts, rewards):
+    # Ctrl+C is for the router, which closes the shards itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    files = [os.path.join(folder, name) for name in DATA_FILES]
+    app = Operations(*files, compact_every=compact_every,
+                     receipt_file=os.path.join(folder, "receipts.txt") if receipts else None,
+                     reward_file=os.path.join(folder, "rewards.txt") if rewards else None)
+    # the shard's records live as long as the worker, see checkout_service.py
+    gc.freeze()
+    closed = False
+    try:
+        while not closed:
+            operation, arguments = connection.recv()
+            try:
+                connection.send((True, SHARD_OPERATIONS[operation](app, *arguments)))
+            except Exception as e:
+                # any other error is answered too, so one failed request never takes the shard down
+                if type(e).__name__ not in SHARD_ERRORS:
+                    print(f"Shard {folder}: {operation} failed: {type(e).__name__}: {e}", file=sys.stderr)
+                connection.send((False, type(e).__name__, str(e)))
+            closed = operation == 'close'
+    except EOFError: # the router has gone away
+        app.save_and_exit()
+
+class ShardRouter:
+    # Sends each request to the shard of its customer over a pipe to the worker process.
+    # One request at a time goes to each shard, so tills served by different shards never wait for each other.
+    # compact_every: journal entries before a shard rewrites its data files, float('inf') leaves it to flush()
+    # receipts, rewards: archive the receipts and keep a reward ledger in each shard folder
+    def __init__(self, folder, compact_every=1000, receipts=False, rewards=False):
+        self.folder = folder
+        self.shard_count = read_shard_count(folder)
+        if self.shard_count is None:
+            raise FileNotFoundError(f"{folder} has not been split into shards.")
+        context = multiprocessing.get_context()
+        self.connections = []
+        self.processes = []
+        for shard in range(self.shard_count):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=serve_shard, daemon=True,
+                                      args=(shard_folder(folder, shard), worker_connection, compact_every, receipts, rewards))
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self.shard_locks = [threading.Lock() for _ in range(self.shard_count)]
+        # the catalogue is the same in every shard, reads of it take turns
+        self.next_catalogue_shard = 0
+
+        # where every customer is, found by ID, name or case-folded name like Records.find_customer
+        self.lock = threading.Lock()
+        self.customer_shards = {}
+        self.customer_names = {}
+        self.customer_names_folded = {}
+        directory = []
+        for shard, customers in enumerate(self.call_all('directory')):
+            directory.extend((customer_ID, name, shard) for customer_ID, name in customers)
+        # the first customer with a name keeps it, as in Records, taking the customers in the order they were numbered
+        directory.sort(key=lambda entry: (id_number(entry[0]) or -1, entry[0]))
+        for customer_ID, name, shard in directory:
+            self.index_customer(customer_ID, name, shard)
+        # new customer IDs are handed out here, so they are unique over all shards
+        self.customer_numbers = IdAllocator()
+        self.customer_numbers.rebuild(self.customer_shards)
+
+    def index_customer(self, customer_ID, name, shard):
+        self.customer_shards.setdefault(customer_ID, shard)
+        self.customer_names.setdefault(name, customer_ID)
+        self.customer_names_folded.setdefault(name.casefold(), customer_ID)
+
+    # send one request to one shard and wait for the answer
+    def call(self, shard, operation, *arguments):
+        with self.shard_locks[shard]:
+            self.connections[shard].send((operation, arguments))
+            answer = self.connections[shard].recv()
+        return self.result(answer)
+
+    # send requests to every shard at once and wait for all the answers, in shard order
+    # requests is one (operation, arguments) per shard, or a single operation for all of them
+    def call_all(self, operation, *arguments, requests=None):
+        requests = requests or [(operation, arguments)] * self.shard_count
+        # the locks are always taken in shard order, so two gathers never wait for each other
+        for shard, request in enumerate(requests):
+            self.shard_locks[shard].acquire()
+            self.connections[shard].send(request)
+        answers = []
+        for shard in range(self.shard_count):
+            try:
+                answers.append(self.connections[shard].recv())
+            finally:
+                self.shard_locks[shard].release()
+        return [self.result(answer) for answer in answers]
+
+    @staticmethod
+    def result(answer):
+        if not answer[0]:
+            if answer[1] in SHARD_ERRORS:
+                raise SHARD_ERRORS[answer[1]](answer[2])
+            raise ValueError(f"{answer[1]}: {answer[2]}")
+        return answer[1]
+
+    # the ID of a customer given by ID or name, or None
+    def find_customer(self, search_value):
+        search_value = search_value.strip()
+        if search_value in self.customer_shards:
+            return search_value
+        customer_ID = self.customer_names.get(search_value)
+        if customer_ID is None:
+            customer_ID = self.customer_names_folded.get(search_value.casefold())
+        return customer_ID
+
+    def owner(self, search_value):
+        customer_ID = self.find_customer(search_value)
+        if customer_ID is None:
+            raise InvalidCustomer(f"Customer {search_value} not found.")
+        return self.customer_shards[customer_ID], customer_ID
+
+    # the ID of a customer, registering a new Basic customer for a new name, with the same rules as
+    # Operations.find_or_register_customer; the lock makes two tills registering one name get one customer
+    def find_or_register_customer(self, customer_identifier, sync=True):
+        customer_ID = self.find_customer(customer_identifier)
+        if customer_ID is not None:
+            return customer_ID
+        if customer_identifier.startswith(('B', 'V')) and customer_identifier[1:].isdigit():
+            raise InvalidCustomer(f"No such customer ID found: {customer_identifier}.")
+        if not customer_identifier.isalpha():
+            raise InvalidCustomer(f"Customer name must contain only alphabetic characters: {customer_identifier}.")
+        with self.lock:
+            customer_ID = self.find_customer(customer_identifier)
+            if customer_ID is not None:
+                return customer_ID
+            customer_ID = f"B{self.customer_numbers.allocate()}"
+            shard = shard_of(customer_ID, self.shard_count)
+            self.call(shard, 'register', customer_ID, customer_identifier, sync)
+            self.index_customer(customer_ID, customer_identifier, shard)
+        return customer_ID
+
+    # one purchase, see Operations.sell; returns the answer of checkout_service's purchase, or None
+    def sell(self, customer_identifier, items, has_prescription, sync=True):
+        customer_ID = self.find_or_register_customer(customer_identifier, sync=sync)
+        return self.call(self.customer_shards[customer_ID], 'sell', customer_ID, items, has_prescription, sync)
+
+    # many purchases, see Operations.process_transactions. Each batch is split by shard and the shards
+    # work through their parts at the same time; the errors are numbered as in the whole list.
+    def process_transactions(self, transactions):
+        start_time = time.perf_counter()
+        summary = {'processed': 0, 'skipped': 0, 'errors': []}
+        batch = []
+        for number, transaction in enumerate(transactions, start=1):
+            batch.append((number, transaction))
+            if len(batch) == BATCH_SIZE:
+                self.process_batch(batch, summary)
+                batch = []
+        if batch:
+            self.process_batch(batch, summary)
+        summary['errors'].sort()
+        seconds = time.perf_counter() - start_time
+        summary['seconds'] = seconds
+        summary['per_minute'] = summary['processed'] / seconds * 60 if seconds > 0 else 0
+        return summary
+
+    def process_batch(self, batch, summary):
+        shard_transactions = [[] for _ in range(self.shard_count)]
+        shard_numbers = [[] for _ in range(self.shard_count)]
+        for number, transaction in batch:
+            try:
+                customer_identifier, items, has_prescription = transaction
+                customer_ID = self.find_or_register_customer(customer_identifier, sync=False)
+            except (InvalidCustomer, ValueError, TypeError) as e:
+                summary['skipped'] += 1
+                summary['errors'].append((number, str(e)))
+                continue
+            shard = self.customer_shards[customer_ID]
+            shard_transactions[shard].append((customer_ID, items, has_prescription))
+            shard_numbers[shard].append(number)
+        results = self.call_all(None, requests=[('sell_many', (transactions,)) for transactions in shard_transactions])
+        for numbers, result in zip(shard_numbers, results):
+            summary['processed'] += result['processed']
+            summary['skipped'] += result['skipped']
+            summary['errors'].extend((numbers[number - 1], error) for number, error in result['errors'])
+
+    def customer(self, search_value):
+        shard, customer_ID = self.owner(search_value)
+        return self.call(shard, 'customer', customer_ID)
+
+    def history(self, search_value):
+        shard, customer_ID = self.owner(search_value)
+        return self.call(shard, 'history', customer_ID)
+
+    def receipt(self, search_value, number):
+        shard, customer_ID = self.owner(search_value)
+        return self.call(shard, 'receipt', customer_ID, number)
+
+    def adjust_reward(self, search_value, points, sync=True):
+        shard, customer_ID = self.owner(search_value)
+        return self.call(shard, 'adjust_reward', customer_ID, points, sync)
+
+    def reward_balance_at(self, search_value, when):
+        shard, customer_ID = self.owner(search_value)
+        return self.call(shard, 'reward_balance_at', customer_ID, when)
+
+    # one page of the customers of every shard, see Records.iter_customers; the answer is as listing_page's.
+    # The sort keys hold the customer ID, so no two shards have the same one and any shard's cursor
+    # marks the same place in the others.
+    def customers(self, kind=None, sort='ID', cursor=None, limit=PAGE_SIZE):
+        pages = self.call_all('customers', kind, sort, cursor, limit + 1)
+        merged = list(itertools.islice(heapq.merge(*pages, key=lambda entry: entry[0][0]), limit + 1))
+        return {'items': [info for key, info in merged[:limit]], 'cursor': merged[limit - 1][0] if len(merged) > limit else None}
+
+    # the orders in the window of every shard as (customer ID, order), oldest first
+    def orders_between(self, start, end):
+        merged = heapq.merge(*self.call_all('orders_between', start, end), key=lambda entry: entry[0])
+        return [(customer_ID, order) for timestamp, customer_ID, order in merged]
+
+    # the catalogue is read from one shard, a different one each time
+    def catalogue_call(self, operation, *arguments):
+        shard = self.next_catalogue_shard
+        self.next_catalogue_shard = (shard + 1) % self.shard_count
+        return self.call(shard, operation, *arguments)
+
+    def products(self, kind=None, sort='ID', cursor=None, limit=PAGE_SIZE):
+        return self.catalogue_call('products', kind, sort, cursor, limit)
+
+    def search_products(self, text, limit=5):
+        return self.catalogue_call('search', text, limit)
+
+    def set_reward_rate(self, rate):
+        if rate <= 0:
+            raise ValueError("Reward rate must be a positive number.")
+        return self.call_all('set_reward_rate', rate)[0]
+
+    def set_discount_rate(self, search_value, rate):
+        if rate <= 0:
+            raise ValueError("Discount rate must be a positive number.")
+        shard, customer_ID = self.owner(search_value)
+        return self.call(shard, 'set_discount_rate', customer_ID, rate)
+
+    # the same price file in every shard; a file that is invalid is invalid in all of them
+    def import_prices(self, filename):
+        return self.call_all('import_prices', filename)[0]
+
+    def flush(self, compact_every=float('inf')):
+        self.call_all('flush', compact_every)
+
+    # save every shard and stop the worker processes
+    def close(self):
+        self.call_all('close')
+        for connection, process in zip(self.connections, self.processes):
+            process.join()
+            connection.close()
+
+class ShardedCheckoutService(CheckoutService):
+    # The checkout service of checkout_service.py with a ShardRouter as its app.
+    # The shards write and compact their own journals when the flusher asks them to.
+    def __init__(self, router, host="127.0.0.1", port=8765, workers=None, flush_interval=0.5, compact_every=10000):
+        # enough threads to keep every shard busy while others wait for answers
+        super().__init__(router, host, port, workers or max(8, router.shard_count * 4), flush_interval, compact_every)
+
+    async def stop(self):
+        self.flusher.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.app.flush, self.compact_every)
+        self.app.close()
+        self.executor.shutdown()
+
+    async def flush_in_background(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await loop.run_in_executor(self.executor, self.app.flush, self.compact_every)
+
+    def purchase(self, request):
+        items = [(str(name), int(quantity)) for name, quantity in request['items']]
+        sale = self.app.sell(str(request['customer']), items, bool(request.get('prescription', False)), sync=False)
+        if sale is None:
+            raise InvalidProduct("No eligible products to purchase after filtering out prescription-required items.")
+        return sale
+
+    def customer(self, request):
+        return self.app.customer(str(request['customer']))
+
+    def customers(self, request):
+        return self.app.customers(*listing_options(request, CUSTOMER_FILTERS, CUSTOMER_LISTING_SORTS, int))
+
+    def products(self, request):
+        return self.app.products(*listing_options(request, PRODUCT_FILTERS, PRODUCT_LISTING_SORTS, str))
+
+    def search(self, request):
+        return self.app.search_products(str(request['text']), int(request.get('limit', 5)))
+
+    def history(self, request):
+        return self.app.history(str(request['customer']))
+
+    def receipt(self, request):
+        receipt = self.app.receipt(str(request['customer']), int(request['order']))
+        if receipt is None:
+            raise ValueError(f"No receipt of order {request['order']} of {request['customer']} was archived.")
+        return receipt
+
+    def adjust_reward(self, request):
+        return self.app.adjust_reward(str(request['customer']), int(request['points']), sync=False)
+
+    def reward_balance(self, request):
+        if 'at' not in request:
+            return self.app.customer(str(request['customer']))['reward']
+        return self.app.reward_balance_at(str(request['customer']), parse_order_time(str(request['at'])))
+
+    def set_reward_rate(self, request):
+        return self.app.set_reward_rate(float(request['rate']))
+
+    def set_discount_rate(self, request):
+        return self.app.set_discount_rate(str(request['customer']), float(request['rate']))
+
+    def import_prices(self, request):
+        return {'changed': self.app.import_prices(str(request['file']))}
+
+def print_shards(router):
+    counts = [0] * router.shard_count
+    for shard in router.customer_shards.values():
+        counts[shard] += 1
+    for shard, count in enumerate(counts):
+        print(f"Shard {shard}: {count} customers")
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    options = {}
+    for option in ('--shards', '--folder', '--transactions', '--port'):
+        if option in arguments:
+            index = arguments.index(option)
+            options[option] = arguments[index + 1] if index + 1 < len(arguments) else None
+            del arguments[index:index + 2]
+    flags = {flag for flag in ('--receipts', '--rewards') if flag in arguments}
+    arguments = [argument for argument in arguments if argument not in flags]
+    if len(arguments) not in [0, 3] or None in options.values():
+        print("Usage: python sharding.py [--shards 4] [--folder shards] [--transactions transactions.txt]")
+        print("       [--port 8765] [--receipts] [--rewards] [customers.txt products.txt orders.txt]")
+        sys.exit(1)
+    files = arguments or list(DATA_FILES)
+    folder = options.get('--folder', "shards")
+    shard_count = read_shard_count(folder)
+    if shard_count is None:
+        shard_count = int(options.get('--shards', 0)) or os.cpu_count() or 1
+        # the records as they are now, with the changes in the journal
+        app = Operations(*files, compact_every=float('inf'))
+        split_records(app, folder, shard_count)
+        app.storage.close()
+        print(f"Split {len(app.records.customers)} customers into {shard_count} shards in {folder}; "
+              f"the records are kept there from now on.")
+    elif int(options.get('--shards', shard_count)) != shard_count:
+        print(f"{folder} is already split into {shard_count} shards.")
+        sys.exit(1)
+
+    if '--port' in options:
+        # compaction is left to the service's flusher
+        router = ShardRouter(folder, compact_every=float('inf'), receipts='--receipts' in flags, rewards='--rewards' in flags)
+        service = ShardedCheckoutService(router, port=int(options['--port']))
+        asyncio.run(service.serve_forever())
+        sys.exit(0)
+
+    router = ShardRouter(folder, receipts='--receipts' in flags, rewards='--rewards' in flags)
+    try:
+        if '--transactions' in options:
+            try:
+                summary = router.process_transactions(parse_transaction_line(line) for line_number, offset, line
+                                                      in read_lines_in_chunks(options['--transactions']))
+            except FileNotFoundError:
+                print(f"Transaction file {options['--transactions']} not found.")
+            else:
+                for number, error in summary['errors']:
+                    print(f"Transaction {number} skipped: {error}")
+                print(f"Processed {summary['processed']} transactions, skipped {summary['skipped']}, "
+                      f"in {summary['seconds']:.2f} seconds ({summary['per_minute']:.0f} per minute) on {router.shard_count} shards.")
+        else:
+            print_shards(router)
+    finally:
+        router.close()
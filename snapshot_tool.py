@@ -0,0 +1,50 @@
+import sys
+from ProgFunA2 import Records, Snapshot, write_snapshot
+
+# Convert between the text data files and the binary snapshot read by Operations at startup.
+# Usage:
+#   python snapshot_tool.py to-binary customers.txt products.txt orders.txt snapshot.bin
+#   python snapshot_tool.py to-text snapshot.bin customers.txt products.txt orders.txt
+#   python snapshot_tool.py info snapshot.bin
+
+def to_binary(customer_file, product_file, order_file, snapshot_file):
+    records = Records()
+    records.read_customers(customer_file)
+    records.read_products(product_file)
+    records.read_orders(order_file)
+    write_snapshot(records, snapshot_file, [customer_file, product_file, order_file])
+    order_count = sum(customer.order_count for customer in records.customers)
+    print(f"Wrote {len(records.customers)} customers, {len(records.products)} products and {order_count} orders to {snapshot_file}")
+
+def to_text(snapshot_file, customer_file, product_file, order_file):
+    records = Records()
+    snapshot = Snapshot(snapshot_file)
+    records.read_snapshot(snapshot)
+    records.save_customers(customer_file)
+    records.save_products(product_file)
+    records.save_orders(order_file)
+    print(f"Wrote {len(records.customers)} customers, {len(records.products)} products and {len(snapshot)} orders")
+
+def info(snapshot_file):
+    snapshot = Snapshot(snapshot_file)
+    print(f"{snapshot_file}: {sum(1 for customer in snapshot.customers())} customers, "
+          f"{sum(1 for product in snapshot.products())} products, {len(snapshot)} orders, "
+          f"{len(snapshot.quantity)} order lines")
+    print(f"Reward rates: Basic {snapshot.basic_reward_rate}, VIP {snapshot.vip_reward_rate}")
+    for name, (size, modified) in zip(["customer", "product", "order"], snapshot.stamps):
+        print(f"Written from the {name} file of {size} bytes, modified at {modified} ns")
+    snapshot.close()
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    if len(arguments) == 5 and arguments[0] == 'to-binary':
+        to_binary(*arguments[1:])
+    elif len(arguments) == 5 and arguments[0] == 'to-text':
+        to_text(*arguments[1:])
+    elif len(arguments) == 2 and arguments[0] == 'info':
+        info(arguments[1])
+    else:
+        print("Usage: python snapshot_tool.py to-binary customers.txt products.txt orders.txt snapshot.bin")
+        print("       python snapshot_tool.py to-text snapshot.bin customers.txt products.txt orders.txt")
+        print("       python snapshot_tool.py info snapshot.bin")
+        sys.exit(1)
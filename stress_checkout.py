@@ -0,0 +1,84 @@
+import os
+import sys
+import random
+import tempfile
+import threading
+from ProgFunA2 import Operations
+
+# Run many tills at once against one Operations object and check that no reward update is lost
+# and that customers registered at the same time get unique IDs.
+# Usage: python stress_checkout.py [number of tills] [purchases per till]
+
+def write_data(folder):
+    with open(os.path.join(folder, "customers.txt"), 'w') as file:
+        file.write("B1,Alice,1.0,500\nV2,Bob,1.0,0.08,1000\nB3,Carol,1.0,0\n")
+    with open(os.path.join(folder, "products.txt"), 'w') as file:
+        file.write("P1,vitaminC,12.0,n\nP2,vitaminE,14.5,n\nP3,coldTablet,6.4,y\nB1,vitaminPack,P1,P2\n")
+    open(os.path.join(folder, "orders.txt"), 'w').close()
+
+def run_till(app, till_number, purchases, reward_changes, order_changes, errors):
+    random_numbers = random.Random(till_number)
+    try:
+        for i in range(purchases):
+            if i % 50 == 0:
+                # every till registers the same new names, only one customer each may be created
+                app.find_or_register_customer(f"New{chr(ord('a') + i // 50 % 26)}", sync=False)
+            customer = app.records.find_customer(random_numbers.choice(["Alice", "Bob", "Carol"]))
+            product = app.records.find_product(random_numbers.choice(["vitaminC", "vitaminE", "vitaminPack"]))
+            sale = app.checkout(customer, [product], [random_numbers.randint(1, 5)], sync=False)
+            reward_changes.append((customer.ID, sale['reward_change']))
+            order_changes[id(sale['order'])] = sale['reward_change']
+    except Exception as e:
+        errors.append(e)
+
+if __name__ == '__main__':
+    tills = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    purchases = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    # switch threads as often as possible to make races show up
+    sys.setswitchinterval(1e-6)
+    with tempfile.TemporaryDirectory() as folder:
+        write_data(folder)
+        app = Operations(os.path.join(folder, "customers.txt"), os.path.join(folder, "products.txt"),
+                         os.path.join(folder, "orders.txt"), compact_every=10**9)
+        start_rewards = {customer.ID: customer.reward for customer in app.records.customers}
+        reward_changes = []
+        order_changes = {}
+        errors = []
+        threads = [threading.Thread(target=run_till, args=(app, i, purchases, reward_changes, order_changes, errors)) for i in range(tills)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # replay the orders in the order they were recorded: a till must never redeem points
+        # that another till already spent
+        balances = dict(start_rewards)
+        overdrawn = 0
+        for customer, order in app.records.new_orders:
+            change = order_changes[id(order)]
+            redeemed = order['earned_rewards'] - change
+            if customer.ID in balances and redeemed > balances[customer.ID]:
+                overdrawn += 1
+            balances[customer.ID] = balances.get(customer.ID, 0) + change
+        app.compact()
+        app.save_and_exit()
+
+        ok = not errors
+        for error in errors:
+            print(f"Till error: {error}")
+        for customer_ID, start_reward in start_rewards.items():
+            expected = start_reward + sum(change for ID, change in reward_changes if ID == customer_ID)
+            actual = app.records.find_customer(customer_ID).reward
+            print(f"{customer_ID}: expected {expected} reward points, got {actual}")
+            ok = ok and expected == actual
+        print(f"{overdrawn} purchases redeemed points that were already spent")
+        ok = ok and overdrawn == 0
+        customer_IDs = [customer.ID for customer in app.records.customers]
+        names = [customer.name for customer in app.records.customers]
+        print(f"{len(customer_IDs)} customers, {len(set(customer_IDs))} unique IDs, {len(set(names))} unique names")
+        ok = ok and len(set(customer_IDs)) == len(customer_IDs) == len(set(names))
+        order_count = sum(len(customer.order_history) for customer in app.records.customers)
+        print(f"{order_count} orders recorded for {tills * purchases} purchases")
+        ok = ok and order_count == tills * purchases
+        print("OK" if ok else "FAILED")
+        sys.exit(0 if ok else 1)